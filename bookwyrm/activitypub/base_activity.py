@@ -1,9 +1,10 @@
 """ basics for an activitypub serializer """
 from __future__ import annotations
 from dataclasses import dataclass, fields, MISSING
+from functools import cache
 from json import JSONEncoder
 import logging
-from typing import Optional, Union, TypeVar, overload, Any
+from typing import Optional, NamedTuple, Union, TypeVar, overload, Any
 
 import requests
 
@@ -12,7 +13,7 @@ from django.db import IntegrityError, transaction
 from django.utils.http import http_date
 
 from bookwyrm import models
-from bookwyrm.connectors import ConnectorException, get_data
+from bookwyrm.connectors import ConnectorException, fetch_cache, get_data
 from bookwyrm.models import base_model
 from bookwyrm.signatures import make_signature
 from bookwyrm.settings import DOMAIN, INSTANCE_ACTOR_USERNAME
@@ -81,33 +82,25 @@ class ActivityObject:
         """this lets you pass in an object with fields that aren't in the
         dataclass, which it ignores. Any field in the dataclass is required or
         has a default value"""
-        for field in fields(self):
-            try:
-                value = kwargs[field.name]
-                if value in (None, MISSING, {}):
-                    raise KeyError("Missing required field", field.name)
-                try:
-                    is_subclass = issubclass(field.type, ActivityObject)
-                except TypeError:
-                    is_subclass = False
-                # serialize a model obj
-                if hasattr(value, "to_activity"):
-                    value = value.to_activity()
-                # parse a dict into the appropriate activity
-                elif is_subclass and isinstance(value, dict):
-                    if activity_objects:
-                        value = naive_parse(activity_objects, value)
-                    else:
-                        value = naive_parse(
-                            activity_objects, value, serializer=field.type
-                        )
-
-            except KeyError:
-                if field.default == MISSING and field.default_factory == MISSING:
+        for field in get_parse_plan(type(self)):
+            value = kwargs.get(field.name, MISSING)
+            if value is None or value is MISSING or value == {}:
+                if field.required:
                     raise ActivitySerializerError(
                         f"Missing required field: {field.name}"
                     )
                 value = field.default
+            # serialize a model obj
+            elif hasattr(value, "to_activity"):
+                value = value.to_activity()
+            # parse a dict into the appropriate activity
+            elif field.serializer and isinstance(value, dict):
+                if activity_objects:
+                    value = naive_parse(activity_objects, value)
+                else:
+                    value = naive_parse(
+                        activity_objects, value, serializer=field.serializer
+                    )
             setattr(self, field.name, value)
 
     # pylint: disable=too-many-locals,too-many-branches,too-many-arguments
@@ -221,67 +214,129 @@ class ActivityObject:
             related_model = model_field.field.model
             related_field_name = model_field.field.name
 
-            for item in values:
-                set_related_field.delay(
+            if values:
+                set_related_fields.delay(
                     related_model.__name__,
                     instance.__class__.__name__,
                     related_field_name,
                     instance.remote_id,
-                    item,
+                    values,
                 )
         return instance
 
     def serialize(self, **kwargs):
         """convert to dictionary with context attr"""
         omit = kwargs.get("omit", ())
-        data = self.__dict__.copy()
-        # recursively serialize
-        for k, v in data.items():
-            try:
-                if issubclass(type(v), ActivityObject):
-                    data[k] = v.serialize()
-                elif isinstance(v, list):
-                    data[k] = [
-                        e.serialize() if issubclass(type(e), ActivityObject) else e
-                        for e in v
-                    ]
-            except TypeError:
-                pass
-        data = {k: v for (k, v) in data.items() if v is not None and k not in omit}
+        data = {}
+        # __init__ only sets the fields in the parse plan, so __dict__ already
+        # holds them in order, and it's faster to walk than the plan itself
+        for key, value in self.__dict__.items():
+            if value is None or key in omit:
+                continue
+            # recursively serialize. annotations are strings here, so a field's
+            # declared type doesn't say whether it holds an activity object
+            if isinstance(value, ActivityObject):
+                value = value.serialize()
+            elif isinstance(value, list):
+                value = [
+                    e.serialize() if isinstance(e, ActivityObject) else e for e in value
+                ]
+            data[key] = value
         if "@context" not in omit:
             data["@context"] = "https://www.w3.org/ns/activitystreams"
         return data
 
 
+class ParsePlanField(NamedTuple):
+    """what we need to know about a dataclass field to parse it"""
+
+    name: str
+    default: Any
+    required: bool
+    # the ActivityObject a dict value should be parsed into, if any
+    serializer: Optional[type[ActivityObject]]
+
+
+@cache
+def get_parse_plan(activity_class: type[ActivityObject]) -> tuple[ParsePlanField, ...]:
+    """inspecting dataclass fields is slow, so it's done once per class"""
+    plan = []
+    for field in fields(activity_class):
+        try:
+            is_subclass = issubclass(field.type, ActivityObject)
+        except TypeError:
+            is_subclass = False
+        plan.append(
+            ParsePlanField(
+                name=field.name,
+                default=field.default,
+                required=field.default == MISSING and field.default_factory == MISSING,
+                serializer=field.type if is_subclass else None,
+            )
+        )
+    return tuple(plan)
+
+
 @app.task(queue=MISC)
-@transaction.atomic
 def set_related_field(
     model_name, origin_model_name, related_field_name, related_remote_id, data
 ):
-    """load reverse related fields (editions, attachments) without blocking"""
+    """load one reverse related field. set_related_fields does this in batches,
+    but tasks queued before it existed may still come through here"""
+    set_related_fields(
+        model_name, origin_model_name, related_field_name, related_remote_id, [data]
+    )
+
+
+@app.task(queue=MISC)
+def set_related_fields(
+    model_name, origin_model_name, related_field_name, related_remote_id, items
+):
+    """load reverse related fields (editions, attachments) without blocking.
+    items can be remote ids or activity json"""
     model = apps.get_model(f"bookwyrm.{model_name}", require_ready=True)
     origin_model = apps.get_model(f"bookwyrm.{origin_model_name}", require_ready=True)
 
-    if isinstance(data, str):
-        existing = model.find_existing_by_remote_id(data)
-        if existing:
-            data = existing.to_activity()
-        else:
-            data = get_data(data)
-    activity = model.activity_serializer(**data)
-
     # this must exist because it's the object that triggered this function
     instance = origin_model.find_existing_by_remote_id(related_remote_id)
     if not instance:
         raise ValueError(f"Invalid related remote id: {related_remote_id}")
 
+    # look up all the items we already have at once
+    existing_items = model.find_existing_batch(
+        [{"id": item} if isinstance(item, str) else item for item in items]
+    )
+    for data, existing in zip(items, existing_items):
+        if (
+            isinstance(data, str)
+            and existing
+            and getattr(existing, f"{related_field_name}_id", None) == instance.id
+        ):
+            # nothing new to say about this one
+            continue
+        try:
+            with transaction.atomic():
+                set_related_item(model, instance, related_field_name, data, existing)
+        except Exception:  # pylint: disable=broad-except
+            # one bad item shouldn't stop the rest from loading
+            logger.exception(
+                "Unable to load %s for %s: %s", model_name, related_remote_id, data
+            )
+
+
+def set_related_item(model, instance, related_field_name, data, existing=None):
+    """create or update one reverse related item, pointing it at the instance"""
+    if isinstance(data, str):
+        data = existing.to_activity() if existing else get_data(data, use_cache=True)
+    activity = model.activity_serializer(**data)
+
     # set the origin's remote id on the activity so it will be there when
     # the model instance is created
     # edition.parentWork = instance, for example
     model_field = getattr(model, related_field_name)
     if hasattr(model_field, "activitypub_field"):
         setattr(activity, getattr(model_field, "activitypub_field"), instance.remote_id)
-    item = activity.to_model(model=model)
+    item = activity.to_model(model=model, instance=existing)
 
     # if the related field isn't serialized (attachments on Status), then
     # we have to set it post-creation
@@ -365,14 +420,14 @@ def resolve_remote_id(
 
     # load the data and create the object
     try:
-        data = get_data(remote_id)
+        data = get_data(remote_id, use_cache=True, refresh=refresh)
     except ConnectionError:
         logger.info("Could not connect to host for remote_id: %s", remote_id)
         return None
     except requests.HTTPError as e:
         if (e.response is not None) and e.response.status_code == 401:
             # This most likely means it's a mastodon with secure fetch enabled.
-            data = get_activitypub_data(remote_id)
+            data = get_activitypub_data(remote_id, refresh=refresh)
         else:
             logger.info("Could not connect to host for remote_id: %s", remote_id)
             return None
@@ -407,15 +462,15 @@ def get_representative():
     )[0]
 
 
-def get_activitypub_data(url):
-    """wrapper for request.get"""
+def get_activitypub_data(url, refresh=False):
+    """wrapper for request.get, signed and cached"""
     now = http_date()
     sender = get_representative()
     if not sender.key_pair.private_key:
         # this shouldn't happen. it would be bad if it happened.
         raise ValueError("No private key found for sender")
     try:
-        resp = requests.get(
+        resp = fetch_cache.get(
             url,
             headers={
                 # pylint: disable=line-too-long
@@ -423,6 +478,7 @@ def get_activitypub_data(url):
                 "Date": now,
                 "Signature": make_signature("get", sender, url, now),
             },
+            refresh=refresh,
         )
     except requests.RequestException:
         raise ConnectorException()
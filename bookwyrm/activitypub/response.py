@@ -1,5 +1,5 @@
 """ ActivityPub-specific json response wrapper """
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 
 from .base_activity import ActivityEncoder
 
@@ -9,19 +9,26 @@ class ActivitypubResponse(JsonResponse):
     A class to be used in any place that's serializing responses for
     Activitypub enabled clients. Uses JsonResponse under the hood, but already
     configures some stuff beforehand. Made to be a drop-in replacement of
-    JsonResponse.
+    JsonResponse. Activities that have already been serialized (usually from
+    the cache) can be passed in as a string with the serialized argument.
     """
 
     def __init__(
         self,
-        data,
+        data=None,
         encoder=ActivityEncoder,
         safe=False,
         json_dumps_params=None,
+        serialized=None,
         **kwargs
     ):
 
         if "content_type" not in kwargs:
             kwargs["content_type"] = "application/activity+json"
 
+        if serialized is not None:
+            # skip JsonResponse's encoding, the work is already done
+            HttpResponse.__init__(self, content=serialized, **kwargs)
+            return
+
         super().__init__(data, encoder, safe, json_dumps_params, **kwargs)
@@ -508,6 +508,17 @@ def add_book_statuses_task(user_id, book_id):
     BooksStream().add_book_statuses(user, book)
 
 
+@app.task(queue=STREAMS)
+def add_books_statuses_task(user_id, book_ids):
+    """add statuses related to books shelved together, like in an import"""
+    user = models.User.objects.get(id=user_id)
+    stream = BooksStream()
+    for book in models.Edition.objects.filter(id__in=book_ids).select_related(
+        "parent_work"
+    ):
+        stream.add_book_statuses(user, book)
+
+
 @app.task(queue=STREAMS)
 def remove_book_statuses_task(user_id, book_id):
     """remove statuses about a book from a user's books feed"""
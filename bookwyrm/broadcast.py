@@ -0,0 +1,218 @@
+""" deliver activities to other servers """
+import asyncio
+from collections import defaultdict
+import json
+import logging
+from typing import Any
+from urllib.parse import urlparse
+
+import aiohttp
+from django.apps import apps
+from django.utils.http import http_date
+
+from bookwyrm.redis_store import r
+from bookwyrm.settings import (
+    BROADCAST_DELIVERY_BATCH_SIZE,
+    BROADCAST_DELIVERY_CONCURRENCY,
+    BROADCAST_DELIVERY_WINDOW,
+    USER_AGENT,
+)
+from bookwyrm.signatures import make_signature, make_digest
+from bookwyrm.tasks import app, BROADCAST
+
+logger = logging.getLogger(__name__)
+
+
+# keeps the name it had in activitypub_mixin so queued tasks still run
+@app.task(queue=BROADCAST, name="bookwyrm.models.activitypub_mixin.broadcast_task")
+def broadcast_task(sender_id: int, activity: str, recipients: list[str]):
+    """the celery task for broadcast"""
+    if BROADCAST_DELIVERY_WINDOW > 0:
+        queue_deliveries(sender_id, activity, recipients)
+        return
+    user_model = apps.get_model("bookwyrm.User", require_ready=True)
+    sender = user_model.objects.select_related("key_pair").get(id=sender_id)
+    asyncio.run(async_broadcast(recipients, sender, activity))
+
+
+@app.task(queue=BROADCAST)
+def broadcast_many_task(sender_id: int, activities: list[tuple[str, list[str]]]):
+    """send a batch of activities from one user, like the ones from an import"""
+    for activity, recipients in activities:
+        broadcast_task(sender_id, activity, recipients)
+
+
+def get_delivery_queue_key(host: str) -> str:
+    """the redis list of activities waiting to be sent to a server"""
+    return f"broadcast-queue-{host}"
+
+
+def get_delivery_scheduled_key(host: str) -> str:
+    """set while a delivery task is waiting to run for a server"""
+    return f"broadcast-scheduled-{host}"
+
+
+def queue_deliveries(sender_id: int, activity: str, recipients: list[str]):
+    """hold on to activities briefly, so that everything going to a server
+    in quick succession is sent together"""
+    deliveries = defaultdict(list)
+    for recipient in recipients:
+        deliveries[urlparse(recipient).netloc].append(
+            json.dumps([sender_id, recipient, activity])
+        )
+    if not deliveries:
+        return
+
+    pipeline = r.pipeline()
+    for host, items in deliveries.items():
+        pipeline.rpush(get_delivery_queue_key(host), *items)
+    pipeline.execute()
+
+    for host in deliveries:
+        schedule_delivery(host, BROADCAST_DELIVERY_WINDOW)
+
+
+def schedule_delivery(host: str, countdown: int):
+    """start a delivery task for a server, unless one is already waiting"""
+    # the flag expires in case the task is lost, so the queue can't get stuck
+    if r.set(get_delivery_scheduled_key(host), 1, nx=True, ex=countdown + 60 * 5):
+        deliver_task.apply_async(args=(host,), countdown=countdown, queue=BROADCAST)
+
+
+@app.task(queue=BROADCAST)
+def deliver_task(host: str):
+    """send the activities that are waiting for a server"""
+    # anything queued from here on will need a new task
+    r.delete(get_delivery_scheduled_key(host))
+
+    queue_key = get_delivery_queue_key(host)
+    pipeline = r.pipeline()
+    pipeline.lrange(queue_key, 0, BROADCAST_DELIVERY_BATCH_SIZE - 1)
+    pipeline.ltrim(queue_key, BROADCAST_DELIVERY_BATCH_SIZE, -1)
+    pipeline.llen(queue_key)
+    batch, _, remaining = pipeline.execute()
+    if remaining:
+        schedule_delivery(host, 0)
+
+    # the same activity can be queued for a shared inbox more than once
+    deliveries = [json.loads(item) for item in dict.fromkeys(batch)]
+    user_model = apps.get_model("bookwyrm.User", require_ready=True)
+    senders = user_model.objects.select_related("key_pair").in_bulk(
+        {sender_id for sender_id, _, _ in deliveries}
+    )
+    asyncio.run(
+        async_deliver(
+            [
+                (senders[sender_id], recipient, activity)
+                for sender_id, recipient, activity in deliveries
+                if sender_id in senders
+            ]
+        )
+    )
+
+
+def get_delivery_order_key(activity: str) -> str:
+    """activities about the same object need to arrive in order"""
+    data = json.loads(activity)
+    activity_object = data.get("object")
+    if isinstance(activity_object, dict):
+        activity_object = activity_object.get("id")
+    return activity_object or data.get("id") or activity
+
+
+async def async_deliver(deliveries: list[tuple[Any, str, str]]):
+    """send activities to a single server, a few at a time over kept-alive
+    connections"""
+    semaphore = asyncio.Semaphore(BROADCAST_DELIVERY_CONCURRENCY)
+    digests: dict[str, str] = {}
+
+    # a Delete mustn't overtake the Create it undoes, so each object's
+    # activities go one after another
+    sequences = defaultdict(list)
+    for delivery in deliveries:
+        sequences[get_delivery_order_key(delivery[2])].append(delivery)
+
+    async def send_in_order(session, sequence):
+        """deliver one object's activities"""
+        for sender, recipient, activity in sequence:
+            if activity not in digests:
+                digests[activity] = make_digest(activity)
+            async with semaphore:
+                await sign_and_send(
+                    session, sender, activity, recipient, digest=digests[activity]
+                )
+
+    timeout = aiohttp.ClientTimeout(total=10)
+    connector = aiohttp.TCPConnector(limit_per_host=BROADCAST_DELIVERY_CONCURRENCY)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        await asyncio.gather(
+            *[send_in_order(session, sequence) for sequence in sequences.values()]
+        )
+
+
+async def async_broadcast(recipients: list[str], sender, data: str):
+    """Send all the broadcasts simultaneously"""
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        tasks = []
+        for recipient in recipients:
+            tasks.append(
+                asyncio.ensure_future(sign_and_send(session, sender, data, recipient))
+            )
+
+        results = await asyncio.gather(*tasks)
+        return results
+
+
+async def sign_and_send(
+    session: aiohttp.ClientSession, sender, data: str, destination: str, **kwargs
+):
+    """Sign the messages and send them in an asynchronous bundle"""
+    now = http_date()
+
+    if not sender.key_pair.private_key:
+        # this shouldn't happen. it would be bad if it happened.
+        raise ValueError("No private key found for sender")
+
+    digest = kwargs.get("digest") or make_digest(data)
+    signature = make_signature(
+        "post",
+        sender,
+        destination,
+        now,
+        digest=digest,
+        use_legacy_key=kwargs.get("use_legacy_key"),
+    )
+
+    headers = {
+        "Date": now,
+        "Digest": digest,
+        "Signature": signature,
+        "Content-Type": "application/activity+json; charset=utf-8",
+        "User-Agent": USER_AGENT,
+    }
+
+    try:
+        async with session.post(destination, data=data, headers=headers) as response:
+            if not response.ok:
+                logger.exception(
+                    "Failed to send broadcast to %s: %s", destination, response.reason
+                )
+                if kwargs.get("use_legacy_key") is not True:
+                    logger.info("Trying again with legacy keyId header value")
+                    asyncio.ensure_future(
+                        sign_and_send(
+                            session,
+                            sender,
+                            data,
+                            destination,
+                            digest=digest,
+                            use_legacy_key=True,
+                        )
+                    )
+
+            return response
+    except asyncio.TimeoutError:
+        logger.info("Connection timed out for url: %s", destination)
+    except aiohttp.ClientError as err:
+        logger.exception(err)
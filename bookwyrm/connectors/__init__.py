@@ -2,5 +2,6 @@
 from .settings import CONNECTORS
 from .abstract_connector import ConnectorException
 from .abstract_connector import get_data, get_image, maybe_isbn
+from . import fetch_cache
 
 from .connector_manager import search, first_search_result
@@ -3,7 +3,6 @@ from __future__ import annotations
 from abc import ABC, abstractmethod
 from typing import Optional, TypedDict, Any, Callable, Union, Iterator
 from urllib.parse import quote_plus
-import imghdr
 import logging
 import re
 import asyncio
@@ -11,12 +10,14 @@ import requests
 from requests.exceptions import RequestException
 import aiohttp
 
-from django.core.files.base import ContentFile
+from django.core.files import File
 from django.db import transaction
 
 from bookwyrm import activitypub, models, settings
 from bookwyrm.settings import USER_AGENT
+from . import fetch_cache
 from .connector_manager import load_more_data, ConnectorException, raise_not_valid_url
+from .covers import CHUNK_SIZE, ImageDownload, queue_cover
 from .format_mappings import format_mappings
 from ..book_search import SearchResult
 
@@ -204,6 +205,9 @@ class AbstractConnector(AbstractMinimalConnector):
 
         mapped_data = dict_from_mappings(edition_data, self.book_mappings)
         mapped_data["work"] = work.remote_id
+        # the cover is downloaded in the background, so the edition can be
+        # used right away
+        cover = mapped_data.pop("cover", None)
         edition_activity = activitypub.Edition(**mapped_data)
         edition = edition_activity.to_model(
             model=models.Edition, overwrite=False, instance=instance
@@ -212,6 +216,9 @@ class AbstractConnector(AbstractMinimalConnector):
         if not edition:
             return None
 
+        if cover and not edition.cover:
+            queue_cover(edition.id, cover)
+
         # if we're updating an existing instance, we don't need to load authors
         if instance:
             return edition
@@ -308,23 +315,27 @@ def get_data(
     url: str,
     params: Optional[dict[str, str]] = None,
     timeout: int = settings.QUERY_TIMEOUT,
+    use_cache: bool = False,
+    refresh: bool = False,
 ) -> JsonDict:
-    """wrapper for request.get"""
+    """wrapper for request.get. use_cache serves the response from the fetch
+    cache when the remote server says it's still fresh"""
     # check if the url is blocked
     raise_not_valid_url(url)
 
+    headers = {
+        "Accept": (
+            'application/json, application/activity+json, application/ld+json; profile="https://www.w3.org/ns/activitystreams"; charset=utf-8'  # pylint: disable=line-too-long
+        ),
+        "User-Agent": settings.USER_AGENT,
+    }
     try:
-        resp = requests.get(
-            url,
-            params=params,
-            headers={  # pylint: disable=line-too-long
-                "Accept": (
-                    'application/json, application/activity+json, application/ld+json; profile="https://www.w3.org/ns/activitystreams"; charset=utf-8'
-                ),
-                "User-Agent": settings.USER_AGENT,
-            },
-            timeout=timeout,
-        )
+        if use_cache and not params:
+            resp = fetch_cache.get(
+                url, headers=headers, refresh=refresh, timeout=timeout
+            )
+        else:
+            resp = requests.get(url, params=params, headers=headers, timeout=timeout)
     except RequestException as err:
         logger.info(err)
         raise ConnectorException(err)
@@ -349,30 +360,33 @@ def get_data(
 
 def get_image(
     url: str, timeout: int = 10
-) -> Union[tuple[ContentFile[bytes], str], tuple[None, None]]:
+) -> Union[tuple[File[Any], str], tuple[None, None]]:
     """wrapper for requesting an image"""
     raise_not_valid_url(url)
+    image = ImageDownload()
     try:
-        resp = requests.get(
+        with requests.get(
             url,
             headers={
                 "User-Agent": settings.USER_AGENT,
             },
             timeout=timeout,
-        )
+            stream=True,
+        ) as resp:
+            if not resp.ok:
+                return image.discard()
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                if not image.write(chunk):
+                    logger.info("File requested was not a usable image: %s", url)
+                    return image.discard()
     except RequestException as err:
         logger.info(err)
-        return None, None
+        return image.discard()
 
-    if not resp.ok:
-        return None, None
-
-    image_content = ContentFile(resp.content)
-    extension = imghdr.what(None, image_content.read())
-    if not extension:
+    image_content, extension = image.result()
+    if image_content is None or not extension:
         logger.info("File requested was not an image: %s", url)
         return None, None
-
     return image_content, extension
 
 
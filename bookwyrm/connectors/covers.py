@@ -0,0 +1,181 @@
+""" download book covers in the background, a batch at a time """
+from __future__ import annotations
+import asyncio
+import imghdr
+import json
+import logging
+import os
+from tempfile import SpooledTemporaryFile
+from typing import Any, Optional
+from uuid import uuid4
+
+import aiohttp
+from django.core.files import File
+from django.db.models import Q
+
+from bookwyrm import models
+from bookwyrm.redis_store import r
+from bookwyrm.settings import (
+    COVER_DOWNLOAD_BATCH_SIZE,
+    COVER_DOWNLOAD_CONCURRENCY,
+    COVER_DOWNLOAD_MAX_SIZE,
+    COVER_DOWNLOAD_WINDOW,
+    USER_AGENT,
+)
+from bookwyrm.tasks import app, IMAGES
+from .connector_manager import ConnectorException, raise_not_valid_url
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = "cover-download-queue"
+SCHEDULED_KEY = "cover-download-scheduled"
+# how much of a download to keep in memory before it goes to disk
+SPOOL_SIZE = 1024 * 1024
+# enough of the start of a file to tell what kind of image it is
+SNIFF_SIZE = 32
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageDownload:
+    """a downloaded image, written to a temporary file as it arrives. it's
+    given up on once it's too big or turns out not to be an image"""
+
+    def __init__(self) -> None:
+        self.file = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.size = 0
+        self.extension: Optional[str] = None
+
+    def write(self, chunk: bytes) -> bool:
+        """add the next part of the file, if it's worth keeping going"""
+        self.size += len(chunk)
+        if self.size > COVER_DOWNLOAD_MAX_SIZE:
+            return False
+        self.file.write(chunk)
+        if self.extension is None and self.size >= SNIFF_SIZE:
+            return bool(self.sniff())
+        return True
+
+    def sniff(self) -> str:
+        """what kind of image this is, going by the start of the file"""
+        self.file.seek(0)
+        self.extension = imghdr.what(None, self.file.read(SNIFF_SIZE)) or ""
+        self.file.seek(0, os.SEEK_END)
+        return self.extension
+
+    def result(self) -> tuple[Optional[File[Any]], Optional[str]]:
+        """the image and its extension, if it is one"""
+        if self.extension is None:
+            self.sniff()
+        if not self.extension:
+            return self.discard()
+        self.file.seek(0)
+        return File(self.file, name=f"image.{self.extension}"), self.extension
+
+    def discard(self) -> tuple[None, None]:
+        """give up on the download"""
+        self.file.close()
+        return None, None
+
+
+def queue_cover(book_id: int, url: str) -> None:
+    """download a book's cover soon, along with any others that are waiting"""
+    r.rpush(QUEUE_KEY, json.dumps([book_id, url]))
+    schedule_downloads(COVER_DOWNLOAD_WINDOW)
+
+
+def schedule_downloads(countdown: int) -> None:
+    """start a download task, unless one is already waiting"""
+    # the flag expires in case the task is lost, so the queue can't get stuck
+    if r.set(SCHEDULED_KEY, 1, nx=True, ex=countdown + 60 * 5):
+        download_covers_task.apply_async(countdown=countdown, queue=IMAGES)
+
+
+@app.task(queue=IMAGES)
+def download_covers_task() -> None:
+    """download the covers that are waiting, and attach them to their books"""
+    # anything queued from here on will need a new task
+    r.delete(SCHEDULED_KEY)
+
+    pipeline = r.pipeline()
+    pipeline.lrange(QUEUE_KEY, 0, COVER_DOWNLOAD_BATCH_SIZE - 1)
+    pipeline.ltrim(QUEUE_KEY, COVER_DOWNLOAD_BATCH_SIZE, -1)
+    pipeline.llen(QUEUE_KEY)
+    batch, _, remaining = pipeline.execute()
+    if remaining:
+        schedule_downloads(0)
+
+    covers = dict(json.loads(item) for item in batch)
+    # a book that got a cover some other way in the meantime keeps it
+    books = {
+        book.id: book
+        for book in models.Book.objects.filter(id__in=covers.keys())
+        .filter(Q(cover="") | Q(cover__isnull=True))
+        .select_subclasses()
+    }
+    images = asyncio.run(
+        download_images(
+            get_valid_urls([url for book_id, url in covers.items() if book_id in books])
+        )
+    )
+    for book_id, book in books.items():
+        image, extension = images.get(covers[book_id], (None, None))
+        if not image or not extension:
+            continue
+        book.cover.save(f"{uuid4()}.{extension}", image, save=False)
+        book.save(broadcast=False, update_fields=["cover"])
+    for image, _ in images.values():
+        if image is not None:
+            image.close()
+
+
+def get_valid_urls(urls: list[str]) -> list[str]:
+    """the urls that covers can be downloaded from"""
+    valid = []
+    for url in dict.fromkeys(urls):
+        try:
+            raise_not_valid_url(url)
+        except ConnectorException as err:
+            logger.info(err)
+            continue
+        valid.append(url)
+    return valid
+
+
+async def download_images(
+    urls: list[str],
+) -> dict[str, tuple[Optional[File[Any]], Optional[str]]]:
+    """download images a few at a time, from urls that have been checked"""
+    semaphore = asyncio.Semaphore(COVER_DOWNLOAD_CONCURRENCY)
+
+    async def download(session: aiohttp.ClientSession, url: str) -> Any:
+        async with semaphore:
+            return await download_image(session, url)
+
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(
+        timeout=timeout, headers={"User-Agent": USER_AGENT}
+    ) as session:
+        results = await asyncio.gather(*[download(session, url) for url in urls])
+    return dict(zip(urls, results))
+
+
+async def download_image(
+    session: aiohttp.ClientSession, url: str
+) -> tuple[Optional[File[Any]], Optional[str]]:
+    """stream an image into a temporary file"""
+    image = ImageDownload()
+    try:
+        async with session.get(url) as response:
+            if (
+                not response.ok
+                or (response.content_length or 0) > COVER_DOWNLOAD_MAX_SIZE
+            ):
+                return image.discard()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                if not image.write(chunk):
+                    logger.info("File requested was not a usable image: %s", url)
+                    return image.discard()
+    except (asyncio.TimeoutError, aiohttp.ClientError) as err:
+        logger.info(err)
+        return image.discard()
+    return image.result()
@@ -0,0 +1,190 @@
+""" cache remote http fetches, honoring the remote server's caching headers """
+from hashlib import sha256
+import re
+import time
+from typing import Any, Optional
+from uuid import uuid4
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from django.core.cache import cache
+
+from bookwyrm import settings
+from bookwyrm.utils import cache as cache_utils
+
+# statuses that mean "this isn't coming back", which we remember for a while
+NEGATIVE_STATUSES = (404, 410)
+# headers we need to rebuild a usable response from the cache
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control")
+STATS = ("hit", "miss", "revalidated", "negative")
+
+
+def get_cache_key(url: str, signed: bool = False) -> str:
+    """urls can be long and full of weird characters. servers can respond
+    differently to signed requests, so those are kept separately"""
+    url_hash = sha256(url.encode("utf-8")).hexdigest()
+    return f"fetch-{'signed' if signed else 'unsigned'}-{url_hash}"
+
+
+def get_stats_cache_key(stat: str) -> str:
+    """where the hit and miss counts live"""
+    return f"fetch-stats-{stat}"
+
+
+def get(
+    url: str,
+    headers: Optional[dict[str, str]] = None,
+    refresh: bool = False,
+    **kwargs: Any,
+) -> requests.Response:
+    """a drop-in for requests.get that serves fresh copies from the cache,
+    revalidates stale ones, and lets only one worker fetch a url at a time.
+    refresh skips the fresh copy, but will still revalidate it"""
+    cache_key = get_cache_key(url, signed="Signature" in (headers or {}))
+    entry = cache.get(cache_key)
+    if entry and not refresh and entry["expires"] > time.time():
+        record_stat("negative" if entry["status"] in NEGATIVE_STATUSES else "hit")
+        return build_response(url, entry)
+
+    lock_key = f"{cache_key}-lock"
+    lock_token: Optional[str] = uuid4().hex
+    timeout = kwargs.get("timeout") or settings.QUERY_TIMEOUT
+    if not cache.add(lock_key, lock_token, timeout=timeout):
+        # someone else is already fetching this, so we'll wait for their copy
+        if new_entry := wait_for_fetch(cache_key, lock_key, entry, timeout):
+            record_stat("hit")
+            return build_response(url, new_entry)
+        # they didn't get anything we can use, so we'll have to try ourselves
+        if not cache.add(lock_key, lock_token, timeout=timeout):
+            lock_token = None
+
+    try:
+        return fetch(url, cache_key, entry, headers=headers, **kwargs)
+    finally:
+        # only release the lock if it's ours
+        if lock_token and cache.get(lock_key) == lock_token:
+            cache.delete(lock_key)
+
+
+def wait_for_fetch(
+    cache_key: str, lock_key: str, entry: Optional[dict[str, Any]], timeout: float
+) -> Optional[dict[str, Any]]:
+    """the entry another worker stored, or None if they gave up without one"""
+    fetched = entry["fetched"] if entry else 0
+    started = time.time()
+    while time.time() - started < timeout:
+        time.sleep(0.1)
+        new_entry: Optional[dict[str, Any]] = cache.get(cache_key)
+        if new_entry and new_entry["fetched"] > fetched:
+            return new_entry
+        if cache.get(lock_key) is None:
+            # the lock was released without storing anything new
+            return None
+    return None
+
+
+def fetch(
+    url: str,
+    cache_key: str,
+    entry: Optional[dict[str, Any]],
+    headers: Optional[dict[str, str]] = None,
+    **kwargs: Any,
+) -> requests.Response:
+    """make the request, conditionally if we have a stale copy"""
+    headers = dict(headers or {})
+    if entry and entry["status"] == 200:
+        if etag := entry["headers"].get("ETag"):
+            headers["If-None-Match"] = etag
+        if last_modified := entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = last_modified
+
+    resp = requests.get(url, headers=headers, **kwargs)
+
+    if resp.status_code == 304 and entry:
+        record_stat("revalidated")
+        # the server may send updated caching headers along with the 304
+        entry["headers"].update(
+            {k: resp.headers[k] for k in STORED_HEADERS if k in resp.headers}
+        )
+        store(cache_key, entry)
+        return build_response(url, entry)
+
+    record_stat("miss")
+    if (resp.status_code == 200 or resp.status_code in NEGATIVE_STATUSES) and len(
+        resp.content
+    ) <= settings.FETCH_CACHE_MAX_SIZE:
+        store(
+            cache_key,
+            {
+                "status": resp.status_code,
+                "reason": resp.reason,
+                "headers": {
+                    k: resp.headers[k] for k in STORED_HEADERS if k in resp.headers
+                },
+                "content": resp.content,
+            },
+        )
+    return resp
+
+
+def store(cache_key: str, entry: dict[str, Any]) -> None:
+    """save an entry along with how long it stays fresh"""
+    if entry["status"] in NEGATIVE_STATUSES:
+        ttl = settings.FETCH_CACHE_NEGATIVE_TTL
+    else:
+        ttl = get_freshness(entry["headers"].get("Cache-Control"))
+        if ttl is None:
+            # the remote server asked us not to keep this
+            cache.delete(cache_key)
+            return
+
+    entry["fetched"] = time.time()
+    entry["expires"] = entry["fetched"] + ttl
+    # keep stale copies around so we can revalidate them
+    cache.set(cache_key, entry, timeout=ttl + settings.FETCH_CACHE_MAX_TTL)
+
+
+def get_freshness(cache_control: Optional[str]) -> Optional[int]:
+    """how many seconds a response is fresh for, or None if it can't be stored"""
+    directives = {}
+    for directive in (cache_control or "").split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name.lower()] = value.strip('"')
+
+    # we share the cache between workers, so it isn't a private cache
+    if "no-store" in directives or "private" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+
+    max_age = directives.get("s-maxage") or directives.get("max-age")
+    if max_age is None or not re.match(r"^\d+$", max_age):
+        return int(settings.FETCH_CACHE_DEFAULT_TTL)
+    return min(int(max_age), int(settings.FETCH_CACHE_MAX_TTL))
+
+
+def build_response(url: str, entry: dict[str, Any]) -> requests.Response:
+    """make something that looks like what requests would have given us"""
+    resp = requests.Response()
+    resp.url = url
+    resp.status_code = entry["status"]
+    resp.reason = entry["reason"]
+    resp.headers = CaseInsensitiveDict(entry["headers"])
+    resp._content = entry["content"]  # pylint: disable=protected-access
+    return resp
+
+
+def record_stat(stat: str) -> None:
+    """keep count of how the cache is doing"""
+    cache_utils.incr(get_stats_cache_key(stat))
+
+
+def get_stats() -> dict[str, Any]:
+    """counts of cache hits and misses, for the admin"""
+    stats = {stat: cache.get(get_stats_cache_key(stat), 0) for stat in STATS}
+    total = sum(stats.values())
+    served = stats["hit"] + stats["revalidated"] + stats["negative"]
+    stats["total"] = total
+    stats["hit_rate"] = round(served / total * 100) if total else 0
+    return stats
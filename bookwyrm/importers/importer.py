@@ -1,10 +1,21 @@
 """ handle reading a csv from an external service, defaults are from Goodreads """
 import csv
 from datetime import timedelta
-from typing import Iterable, Optional
+from io import TextIOWrapper
+from itertools import chain, islice
+import logging
+import os
+from typing import IO, Iterable, Iterator, Optional
 
 from django.utils import timezone
 from bookwyrm.models import ImportJob, ImportItem, SiteSettings, User
+from bookwyrm.models.import_job import update_item_counts
+from bookwyrm.tasks import app, IMPORTS
+
+logger = logging.getLogger(__name__)
+
+# how many rows to save at a time
+INGEST_BATCH_SIZE = 500
 
 
 class Importer:
@@ -36,39 +47,84 @@ class Importer:
         "reading": ["currently-reading", "reading", "currently reading"],
     }
 
-    # pylint: disable=too-many-locals
     def create_job(
         self, user: User, csv_file: Iterable[str], include_reviews: bool, privacy: str
     ) -> ImportJob:
         """check over a csv and creates a database entry for the job"""
         csv_reader = csv.DictReader(csv_file, delimiter=self.delimiter)
-        rows = list(csv_reader)
-        if len(rows) < 1:
+        first_row = next(csv_reader, None)
+        if first_row is None:
             raise ValueError("CSV file is empty")
 
-        mappings = (
-            self.create_row_mappings(list(fieldnames))
-            if (fieldnames := csv_reader.fieldnames)
-            else {}
+        job = ImportJob.objects.create(
+            user=user,
+            include_reviews=include_reviews,
+            privacy=privacy,
+            mappings=self.get_mappings(csv_reader),
+            source=self.service,
         )
+        self.create_items(job, chain([first_row], csv_reader))
+        return job
 
-        job = ImportJob.objects.create(
+    def queue_job(
+        self, user: User, csv_file: IO[bytes], include_reviews: bool, privacy: str
+    ) -> ImportJob:
+        """check the header of an uploaded csv and store it, so the rows can be
+        read in a task instead of during the request"""
+        text_file = TextIOWrapper(csv_file, encoding=self.encoding, newline="")
+        csv_reader = csv.DictReader(text_file, delimiter=self.delimiter)
+        if next(csv_reader, None) is None:
+            raise ValueError("CSV file is empty")
+        mappings = self.get_mappings(csv_reader)
+        # give the file back without closing it
+        text_file.detach()
+        csv_file.seek(0)
+
+        job = ImportJob(
             user=user,
             include_reviews=include_reviews,
             privacy=privacy,
             mappings=mappings,
             source=self.service,
         )
+        file_name = os.path.basename(getattr(csv_file, "name", "") or "import.csv")
+        job.import_file.save(file_name, csv_file)
+        ingest_import_task.delay(job.id)
+        return job
 
-        enforce_limit, allowed_imports = self.get_import_limit(user)
+    def ingest(self, job: ImportJob) -> None:
+        """read the rows of a stored csv into the job"""
+        with job.import_file.open("rb") as csv_file:
+            text_file = TextIOWrapper(csv_file, encoding=self.encoding, newline="")
+            self.create_items(job, csv.DictReader(text_file, delimiter=self.delimiter))
+        job.import_file.delete(save=False)
+        job.import_file = None
+        job.save(update_fields=["import_file"])
+
+    def get_mappings(
+        self, csv_reader: "csv.DictReader[str]"
+    ) -> dict[str, Optional[str]]:
+        """the row mappings for a csv, once its header has been read"""
+        if not (fieldnames := csv_reader.fieldnames):
+            return {}
+        return self.create_row_mappings(list(fieldnames))
+
+    def create_items(self, job: ImportJob, rows: Iterable[dict[str, str]]) -> None:
+        """save rows as import items in batches, up to the user's import limit"""
+        enforce_limit, allowed_imports = self.get_import_limit(job.user)
         if enforce_limit and allowed_imports <= 0:
             job.complete_job()
-            return job
-        for index, entry in enumerate(rows):
-            if enforce_limit and index >= allowed_imports:
-                break
-            self.create_item(job, index, entry)
-        return job
+            return
+
+        entries: Iterator[dict[str, str]] = iter(rows)
+        if enforce_limit:
+            entries = islice(entries, allowed_imports)
+        items = (
+            self.get_item(job, index, entry) for index, entry in enumerate(entries)
+        )
+        while batch := list(islice(items, INGEST_BATCH_SIZE)):
+            ImportItem.objects.bulk_create(batch)
+            update_item_counts(batch)
 
     def update_legacy_job(self, job: ImportJob) -> None:
         """patch up a job that was in the old format"""
@@ -101,9 +157,13 @@ class Importer:
 
     def create_item(self, job: ImportJob, index: int, data: dict[str, str]) -> None:
         """creates and saves an import item"""
+        self.get_item(job, index, data).save()
+
+    def get_item(self, job: ImportJob, index: int, data: dict[str, str]) -> ImportItem:
+        """an unsaved import item for a row"""
         normalized = self.normalize_row(data, job.mappings)
         normalized["shelf"] = self.get_shelf(normalized)
-        ImportItem(job=job, index=index, data=data, normalized_data=normalized).save()
+        return ImportItem(job=job, index=index, data=data, normalized_data=normalized)
 
     def get_shelf(self, normalized_row: dict[str, Optional[str]]) -> Optional[str]:
         """determine which shelf to use"""
@@ -165,3 +225,31 @@ class Importer:
             # this will re-normalize the raw data
             self.create_item(job, item.index, item.data)
         return job
+
+
+def get_importer(source: str) -> Importer:
+    """the importer that created a job"""
+    importers = {cls.service: cls for cls in Importer.__subclasses__()}
+    return importers.get(source, Importer)()
+
+
+@app.task(queue=IMPORTS)
+def ingest_import_task(job_id: int) -> None:
+    """read an uploaded csv, then start importing it"""
+    job = ImportJob.objects.get(id=job_id)
+    if job.complete:
+        return
+
+    try:
+        get_importer(job.source).ingest(job)
+    except (UnicodeDecodeError, csv.Error):
+        logger.exception("Unable to read import file for job %s", job.id)
+        job.import_file.delete(save=False)
+        job.import_file = None
+        job.status = "stopped"
+        job.complete = True
+        job.save(update_fields=["import_file", "status", "complete"])
+        return
+
+    if not job.complete:
+        job.start_job()
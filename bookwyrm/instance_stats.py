@@ -0,0 +1,69 @@
+""" usage counts that other servers and the admin dashboard ask about """
+import time
+
+from dateutil.relativedelta import relativedelta
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from bookwyrm import models
+from bookwyrm.settings import INSTANCE_STATS_TTL
+from bookwyrm.tasks import app, MISC
+
+CACHE_KEY = "instance-stats"
+
+
+def get_instance_stats():
+    """the latest snapshot, counting everything up if there isn't one yet.
+    a snapshot that's out of date is still used while a task replaces it"""
+    stats = cache.get(CACHE_KEY)
+    if stats is None:
+        return refresh_instance_stats()
+
+    if stats["computed"] < time.time() - INSTANCE_STATS_TTL and cache.add(
+        f"{CACHE_KEY}-refreshing", 1, timeout=60
+    ):
+        refresh_instance_stats_task.delay()
+    return stats
+
+
+def refresh_instance_stats():
+    """count everything up and store it"""
+    stats = compute_instance_stats()
+    cache.set(CACHE_KEY, stats, timeout=None)
+    return stats
+
+
+def compute_instance_stats():
+    """the queries behind the snapshot"""
+    now = timezone.now()
+    users = models.User.objects.filter(is_active=True, local=True).aggregate(
+        total=Count("id"),
+        active_month=Count(
+            "id", filter=Q(last_active_date__gt=now - relativedelta(months=1))
+        ),
+        active_halfyear=Count(
+            "id", filter=Q(last_active_date__gt=now - relativedelta(months=6))
+        ),
+    )
+    return {
+        "computed": time.time(),
+        "users": users["total"],
+        "active_month": users["active_month"],
+        "active_halfyear": users["active_halfyear"],
+        "statuses": models.Status.objects.filter(
+            user__local=True, deleted=False
+        ).count(),
+        "works": models.Work.objects.count(),
+        "peers": list(
+            models.FederatedServer.objects.filter(status="federated").values_list(
+                "server_name", flat=True
+            )
+        ),
+    }
+
+
+@app.task(queue=MISC)
+def refresh_instance_stats_task():
+    """replace the snapshot"""
+    refresh_instance_stats()
@@ -0,0 +1,67 @@
+""" Store each cover image once, under a hash of its contents """
+import os
+import re
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from bookwyrm import models
+from bookwyrm.models.fields import get_content_name
+from bookwyrm.thumbnail_generation import get_thumbnail_names
+
+# the covers that are already stored under their hash
+CONTENT_NAME = re.compile(r"^[0-9a-f]{64}(\.\w+)?$")
+
+
+def dedupe_covers(stdout=None):
+    """move every cover to its content addressed name, and remove the copies.
+    returns how many files were removed"""
+    field = models.Book._meta.get_field("cover")
+    names = (
+        models.Book.objects.exclude(Q(cover="") | Q(cover__isnull=True))
+        .order_by("cover")
+        .values_list("cover", flat=True)
+        .distinct()
+    )
+    removed = 0
+    for name in names.iterator():
+        if CONTENT_NAME.match(os.path.basename(name)):
+            continue
+        storage = field.storage
+        if not storage.exists(name):
+            continue
+
+        with storage.open(name) as image:
+            content_name = field.generate_filename(None, get_content_name(name, image))
+            if not storage.exists(content_name):
+                content_name = storage.save(content_name, image)
+
+        books = models.Book.objects.filter(cover=name)
+        remove_thumbnails(books.first())
+        books.update(cover=content_name)
+        storage.delete(name)
+        removed += 1
+        if stdout:
+            stdout.write(".", ending="")
+    return removed
+
+
+def remove_thumbnails(book):
+    """the thumbnails that were made for a cover's old name"""
+    for thumbnail_name in get_thumbnail_names(models.Book, "cover"):
+        thumbnail = getattr(book, thumbnail_name)
+        if thumbnail.storage.exists(thumbnail.name):
+            thumbnail.storage.delete(thumbnail.name)
+
+
+class Command(BaseCommand):
+    """Combines covers that are stored more than once"""
+
+    help = "Store each cover image once, and remove the duplicate copies"
+
+    # pylint: disable=no-self-use,unused-argument
+    def handle(self, *args, **options):
+        """deduplicate covers"""
+        self.stdout.write("Deduplicating covers: ", ending="")
+        removed = dedupe_covers(stdout=self.stdout)
+        self.stdout.write(f" {removed} covers moved to shared files")
@@ -1,8 +1,17 @@
 """ Generate preview images """
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import os
+
+import django
 from django.core.management.base import BaseCommand
+from django.db import connections
 
 from bookwyrm import models, preview_images
 
+# how many books or users to render together in batch mode
+BATCH_SIZE = 100
+
 
 # pylint: disable=line-too-long
 class Command(BaseCommand):
@@ -19,6 +28,19 @@ class Command(BaseCommand):
             action="store_true",
             help="Generates images for ALL types: site, users and books. Can use a lot of computing power.",
         )
+        parser.add_argument(
+            "--batch",
+            "-b",
+            action="store_true",
+            help="With --all, render the user and book images here in worker processes instead of queueing a task for each one, skipping images that are up to date.",
+        )
+        parser.add_argument(
+            "--workers",
+            "-w",
+            type=int,
+            default=os.cpu_count(),
+            help="How many worker processes to render with in batch mode",
+        )
 
     # pylint: disable=no-self-use,unused-argument
     def handle(self, *args, **options):
@@ -41,7 +63,9 @@ class Command(BaseCommand):
         self.stdout.write(" OK 🖼")
 
         # pylint: disable=consider-using-f-string
-        if options["all"]:
+        if options["all"] and options["batch"]:
+            self.generate_batch(options["workers"])
+        elif options["all"]:
             # Users
             users = models.User.objects.filter(
                 local=True,
@@ -71,3 +95,49 @@ class Command(BaseCommand):
             self.stdout.write(" OK 🖼")
 
         self.stdout.write("🧑‍🎨 ⎨ I’m all done! ✧ Enjoy ✧")
+
+    def generate_batch(self, workers):
+        """render the user and book images in chunks, in worker processes"""
+        users = models.User.objects.filter(local=True, is_active=True)
+        books = models.Book.objects.prefetch_related("authors")
+
+        # the workers don't use the database, but they mustn't share a
+        # connection with this process either
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=django.setup
+        ) as executor:
+            self.stdout.write("   → User preview images: ", ending="")
+            rendered = 0
+            for batch in get_batches(users):
+                previews = {
+                    user: preview_images.get_user_preview_inputs(user) for user in batch
+                }
+                rendered += preview_images.generate_preview_images_batch(
+                    models.User, previews, executor
+                )
+                self.stdout.write(".", ending="")
+            self.stdout.write(f" {rendered} rendered, OK 🖼")
+
+            self.stdout.write("   → Book preview images: ", ending="")
+            rendered = 0
+            for batch in get_batches(books):
+                ratings = preview_images.get_ratings([book.id for book in batch])
+                previews = {
+                    book: preview_images.get_edition_preview_inputs(
+                        book, ratings.get(book.id)
+                    )
+                    for book in batch
+                }
+                rendered += preview_images.generate_preview_images_batch(
+                    models.Book, previews, executor
+                )
+                self.stdout.write(".", ending="")
+            self.stdout.write(f" {rendered} rendered, OK 🖼")
+
+
+def get_batches(queryset):
+    """the objects in id order, loaded a batch at a time"""
+    ids = queryset.order_by("id").values_list("id", flat=True).iterator()
+    while batch := list(islice(ids, BATCH_SIZE)):
+        yield list(queryset.filter(id__in=batch).order_by("id"))
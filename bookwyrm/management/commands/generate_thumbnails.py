@@ -0,0 +1,48 @@
+""" Generate cover thumbnails """
+from django.core.management.base import BaseCommand
+
+from bookwyrm import models
+from bookwyrm.settings import ENABLE_THUMBNAIL_GENERATION
+from bookwyrm.thumbnail_generation import generate_thumbnails, queue_thumbnails
+
+# how many books to load from the database at a time
+BATCH_SIZE = 100
+
+
+class Command(BaseCommand):
+    """Creates the thumbnails for existing covers"""
+
+    help = "Generate the cover thumbnails that are missing"
+
+    # pylint: disable=no-self-use
+    def add_arguments(self, parser):
+        """options for how the command is run"""
+        parser.add_argument(
+            "--queue",
+            "-q",
+            action="store_true",
+            help="Queue a task for each book instead of generating the thumbnails here",
+        )
+
+    # pylint: disable=unused-argument
+    def handle(self, *args, **options):
+        """generate thumbnails"""
+        if not ENABLE_THUMBNAIL_GENERATION:
+            self.stdout.write("Thumbnail generation is disabled in settings")
+            return
+
+        books = (
+            models.Book.objects.exclude(cover="")
+            .exclude(cover__isnull=True)
+            .order_by("id")
+        )
+        self.stdout.write(f"Thumbnails for {books.count()} covers: ", ending="")
+        for i, book in enumerate(books.iterator(chunk_size=BATCH_SIZE)):
+            if options["queue"]:
+                queue_thumbnails(book.cover)
+            else:
+                generate_thumbnails(book)
+            if i % BATCH_SIZE == 0:
+                self.stdout.write(".", ending="")
+                self.stdout.flush()
+        self.stdout.write(" OK")
@@ -0,0 +1,17 @@
+""" Count up the reviews and ratings of every work from scratch """
+from django.core.management.base import BaseCommand
+
+from bookwyrm.models.rating_stats import refresh_rating_stats
+
+
+class Command(BaseCommand):
+    """Rebuilds the rating stats of every work"""
+
+    help = "Recount the reviews and ratings of every work"
+
+    # pylint: disable=no-self-use,unused-argument
+    def handle(self, *args, **options):
+        """recount ratings"""
+        self.stdout.write("Counting reviews and ratings...")
+        count = refresh_rating_stats()
+        self.stdout.write(f"{count} reviewed works counted")
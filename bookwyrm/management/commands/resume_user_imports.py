@@ -0,0 +1,28 @@
+""" Pick up user imports that were interrupted """
+from django.core.management.base import BaseCommand
+
+from bookwyrm.models import BookwyrmImportJob
+
+
+class Command(BaseCommand):
+    """restart the unfinished chunks of user imports"""
+
+    help = "Run the unfinished parts of user imports again, like after a crash"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "job_ids",
+            nargs="*",
+            type=int,
+            help="The imports to resume (defaults to all active imports)",
+        )
+
+    # pylint: disable=unused-argument
+    def handle(self, *args, **options):
+        """queue the chunks again"""
+        jobs = BookwyrmImportJob.objects.filter(complete=False)
+        if options["job_ids"]:
+            jobs = jobs.filter(id__in=options["job_ids"])
+        for job in jobs:
+            job.resume_job()
+            self.stdout.write(f"   | Resumed import {job.id}")
@@ -1,5 +1,8 @@
 from django.db.models import ManyToManyField
 
+from bookwyrm.models import Work
+from bookwyrm.models.rating_stats import refresh_rating_stats
+
 
 def update_related(canonical, obj):
     """update all the models with fk to the object being removed"""
@@ -48,3 +51,6 @@ def merge_objects(canonical, obj):
     update_related(canonical, obj)
     # remove the outdated entry
     obj.delete()
+    if isinstance(canonical, Work):
+        # the editions that moved over brought their reviews with them
+        refresh_rating_stats([canonical.id])
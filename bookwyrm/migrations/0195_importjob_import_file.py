@@ -0,0 +1,18 @@
+# Generated by Django 3.2.23 on 2026-10-19 12:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0194_merge_20240203_1619"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="import_file",
+            field=models.FileField(blank=True, null=True, upload_to=""),
+        ),
+    ]
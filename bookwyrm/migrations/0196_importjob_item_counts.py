@@ -0,0 +1,54 @@
+# Generated by Django 3.2.23 on 2026-10-19 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0195_importjob_import_file"),
+    ]
+
+    # existing jobs are left without counts, so they're counted up when needed
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="total_items",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="succeeded_items",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="failed_items",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="finished_items",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="importjob",
+            name="total_items",
+            field=models.IntegerField(default=0, null=True),
+        ),
+        migrations.AlterField(
+            model_name="importjob",
+            name="succeeded_items",
+            field=models.IntegerField(default=0, null=True),
+        ),
+        migrations.AlterField(
+            model_name="importjob",
+            name="failed_items",
+            field=models.IntegerField(default=0, null=True),
+        ),
+        migrations.AlterField(
+            model_name="importjob",
+            name="finished_items",
+            field=models.IntegerField(default=0, null=True),
+        ),
+    ]
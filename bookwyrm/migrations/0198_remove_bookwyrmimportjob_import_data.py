@@ -0,0 +1,17 @@
+# Generated by Django 3.2.23 on 2026-10-19 15:02
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0197_bookwyrmimportchunk"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="bookwyrmimportjob",
+            name="import_data",
+        ),
+    ]
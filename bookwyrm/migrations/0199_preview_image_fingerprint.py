@@ -0,0 +1,23 @@
+# Generated by Django 3.2.23 on 2026-10-19 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0198_remove_bookwyrmimportjob_import_data"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="preview_image_fingerprint",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="preview_image_fingerprint",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.23 on 2026-10-19 14:09
+
+import bookwyrm.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0199_preview_image_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="book",
+            name="cover",
+            field=bookwyrm.models.fields.ContentAddressedImageField(
+                blank=True, db_index=True, null=True, upload_to="covers/"
+            ),
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 3.2.23 on 2026-10-19 16:02
+
+from decimal import Decimal, ROUND_HALF_UP
+
+import bookwyrm.models.rating_stats
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def count_ratings(apps, schema_editor):
+    """count up the reviews that are already there"""
+    db_alias = schema_editor.connection.alias
+    review_model = apps.get_model("bookwyrm", "Review")
+    stats_model = apps.get_model("bookwyrm", "WorkRatingStats")
+    counts = (
+        review_model.objects.using(db_alias)
+        .filter(
+            deleted=False,
+            privacy__in=bookwyrm.models.rating_stats.COUNTED_PRIVACY,
+            book__parent_work__isnull=False,
+        )
+        .values_list("book__parent_work", "rating")
+        .annotate(Count("id"))
+        .order_by("book__parent_work")
+    )
+    stats = {}
+    for work_id, rating, count in counts.iterator():
+        work_stats = stats.setdefault(
+            work_id,
+            stats_model(
+                work_id=work_id,
+                rating_sum=0,
+                histogram=bookwyrm.models.rating_stats.empty_histogram(),
+            ),
+        )
+        work_stats.review_count += count
+        if rating:
+            work_stats.rating_count += count
+            work_stats.rating_sum += rating * count
+            index = bookwyrm.models.rating_stats.get_histogram_index(rating)
+            work_stats.histogram[index] += count
+
+    for work_stats in stats.values():
+        if work_stats.rating_count:
+            work_stats.rating = (
+                work_stats.rating_sum / work_stats.rating_count
+            ).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    stats_model.objects.using(db_alias).bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0200_book_cover_content_addressed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WorkRatingStats",
+            fields=[
+                (
+                    "work",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="rating_stats",
+                        serialize=False,
+                        to="bookwyrm.work",
+                    ),
+                ),
+                ("review_count", models.IntegerField(default=0)),
+                ("rating_count", models.IntegerField(default=0)),
+                (
+                    "rating_sum",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                (
+                    "histogram",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.IntegerField(),
+                        default=bookwyrm.models.rating_stats.empty_histogram,
+                        size=10,
+                    ),
+                ),
+                (
+                    "rating",
+                    models.DecimalField(decimal_places=2, max_digits=3, null=True),
+                ),
+            ],
+        ),
+        migrations.RunPython(count_ratings, reverse_code=migrations.RunPython.noop),
+    ]
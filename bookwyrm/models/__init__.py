@@ -13,6 +13,7 @@ from .list import List, ListItem
 from .status import Status, GeneratedNote, Comment, Quotation
 from .status import Review, ReviewRating
 from .status import Boost
+from .rating_stats import WorkRatingStats
 from .attachment import Image
 from .favorite import Favorite
 from .readthrough import ReadThrough, ProgressUpdate, ProgressMode
@@ -26,7 +27,7 @@ from .federated_server import FederatedServer
 from .group import Group, GroupMember, GroupMemberInvitation
 
 from .import_job import ImportJob, ImportItem
-from .bookwyrm_import_job import BookwyrmImportJob
+from .bookwyrm_import_job import BookwyrmImportJob, BookwyrmImportChunk
 from .bookwyrm_export_job import BookwyrmExportJob
 
 from .move import MoveUser
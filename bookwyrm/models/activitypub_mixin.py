@@ -1,28 +1,40 @@
 """ activitypub model functionality """
-import asyncio
-from base64 import b64encode
+from base64 import b64encode, urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
 from collections import namedtuple
-from functools import reduce
+from functools import lru_cache, partial, reduce
+from hashlib import sha256
 import json
+from math import ceil
 import operator
 import logging
 from typing import Any, Optional
 from uuid import uuid4
 from typing_extensions import Self
 
-import aiohttp
-from Crypto.PublicKey import RSA
 from Crypto.Signature import pkcs1_15
 from Crypto.Hash import SHA256
 from django.apps import apps
-from django.core.paginator import Paginator
+from django.contrib.postgres.fields import CICharField
+from django.core.cache import cache
+from django.core.exceptions import (
+    EmptyResultSet,
+    FieldDoesNotExist,
+    ValidationError,
+)
 from django.db.models import Q
-from django.utils.http import http_date
 
 from bookwyrm import activitypub
-from bookwyrm.settings import USER_AGENT, PAGE_LENGTH
-from bookwyrm.signatures import make_signature, make_digest
-from bookwyrm.tasks import app, BROADCAST
+from bookwyrm.broadcast import broadcast_task
+from bookwyrm.settings import (
+    ACTIVITY_CACHE_TTL,
+    COLLECTION_COUNT_CACHE_TTL,
+    PAGE_LENGTH,
+    REMOTE_ID_CACHE_TTL,
+)
+from bookwyrm.signatures import load_private_key
+from bookwyrm.tasks import BROADCAST
+from bookwyrm.utils import cache as cache_utils
 from bookwyrm.models.fields import ImageField, ManyToManyField
 
 logger = logging.getLogger(__name__)
@@ -37,6 +49,60 @@ def set_activity_from_property_field(activity, obj, field):
     activity[field[1]] = getattr(obj, field[0])
 
 
+@lru_cache(maxsize=None)
+def get_deduplication_fields(model):
+    """the (model field, activitypub field, case insensitive) triples used to
+    find existing objects, which only need to be worked out once per model"""
+    return tuple(
+        (
+            field.name,
+            field.get_activitypub_field(),
+            isinstance(field, CICharField),
+        )
+        # pylint: disable=protected-access
+        for field in model._meta.get_fields()
+        if getattr(field, "deduplication_field", False)
+    )
+
+
+def get_deduplication_key(name, value, case_insensitive=()):
+    """identify a field value the way the database compares it"""
+    if name in case_insensitive and isinstance(value, str):
+        value = value.lower()
+    return (name, value)
+
+
+def get_remote_id_cache_key(model, remote_id):
+    """where we remember which object a remote id belongs to"""
+    remote_id_hash = sha256(str(remote_id).encode("utf-8")).hexdigest()
+    return f"remote-id-{model.__name__}-{remote_id_hash}"
+
+
+def is_remote_id_match(obj, remote_id):
+    """was this object found by its remote id, rather than another identifier"""
+    return bool(remote_id) and remote_id in (
+        obj.remote_id,
+        getattr(obj, "origin_id", None),
+    )
+
+
+def get_activity_cache_key(remote_id, pure=False):
+    """where the serialized activitypub json for an object is kept"""
+    remote_id_hash = sha256(remote_id.encode("utf-8")).hexdigest()
+    representation = "pure" if pure else "bookwyrm"
+    return f"activity-json-{remote_id_hash}-{representation}"
+
+
+def clear_activity_cache(remote_id):
+    """remove all the cached representations of an object"""
+    cache.delete_many(
+        [
+            get_activity_cache_key(remote_id, pure=False),
+            get_activity_cache_key(remote_id, pure=True),
+        ]
+    )
+
+
 class ActivitypubMixin:
     """add this mixin for models that are AP serializable"""
 
@@ -95,24 +161,7 @@ class ActivitypubMixin:
         """compare data to fields that can be used for deduplication.
         This always includes remote_id, but can also be unique identifiers
         like an isbn for an edition"""
-        filters = []
-        # grabs all the data from the model to create django queryset filters
-        for field in cls._meta.get_fields():
-            if (
-                not hasattr(field, "deduplication_field")
-                or not field.deduplication_field
-            ):
-                continue
-
-            value = data.get(field.get_activitypub_field())
-            if not value:
-                continue
-            filters.append({field.name: value})
-
-        if hasattr(cls, "origin_id") and "id" in data:
-            # kinda janky, but this handles special case for books
-            filters.append({"origin_id": data["id"]})
-
+        filters = cls.get_deduplication_filters(data)
         if not filters:
             # if there are no deduplication fields, it will match the first
             # item no matter what. this shouldn't happen but just in case.
@@ -122,10 +171,129 @@ class ActivitypubMixin:
         if hasattr(objects, "select_subclasses"):
             objects = objects.select_subclasses()
 
+        # the overwhelmingly common case is that we've matched this id before
+        remote_id = data.get("id")
+        if remote_id and (pk := cache.get(get_remote_id_cache_key(cls, remote_id))):
+            match = objects.filter(pk=pk).first()
+            if match and is_remote_id_match(match, remote_id):
+                return match
+
         # an OR operation on all the match fields, sorry for the dense syntax
         match = objects.filter(reduce(operator.or_, (Q(**f) for f in filters)))
         # there OUGHT to be only one match
-        return match.first()
+        match = match.first()
+        if match and is_remote_id_match(match, remote_id):
+            cache.set(
+                get_remote_id_cache_key(cls, remote_id),
+                match.pk,
+                timeout=REMOTE_ID_CACHE_TTL,
+            )
+        return match
+
+    @classmethod
+    def find_existing_batch(cls, data_list):
+        """find_existing for many activities at once, in as few queries as we
+        can. Returns the matches in the same order as the data, with None for
+        no match"""
+        objects = cls.objects
+        if hasattr(objects, "select_subclasses"):
+            objects = objects.select_subclasses()
+
+        # first, the ids we've matched before
+        remote_ids = {
+            index: data["id"] for index, data in enumerate(data_list) if data.get("id")
+        }
+        results = cls.find_cached_remote_ids(objects, remote_ids)
+
+        # then everything else in one OR query
+        filters_list = {
+            index: cls.get_deduplication_filters(data)
+            for index, data in enumerate(data_list)
+            if index not in results
+        }
+        matches = cls.match_deduplication_filters(objects, filters_list)
+        cache.set_many(
+            {
+                get_remote_id_cache_key(cls, remote_ids[index]): match.pk
+                for index, match in matches.items()
+                if is_remote_id_match(match, remote_ids.get(index))
+            },
+            timeout=REMOTE_ID_CACHE_TTL,
+        )
+        results.update(matches)
+        return [results.get(index) for index in range(len(data_list))]
+
+    @classmethod
+    def find_cached_remote_ids(cls, objects, remote_ids):
+        """look up the objects we've already matched to remote ids"""
+        cache_keys = {
+            index: get_remote_id_cache_key(cls, remote_id)
+            for index, remote_id in remote_ids.items()
+        }
+        cached_pks = cache.get_many(cache_keys.values())
+        if not cached_pks:
+            return {}
+
+        found = objects.in_bulk(set(cached_pks.values()))
+        results = {}
+        for index, cache_key in cache_keys.items():
+            match = found.get(cached_pks.get(cache_key))
+            if match and is_remote_id_match(match, remote_ids[index]):
+                results[index] = match
+        return results
+
+    @classmethod
+    def match_deduplication_filters(cls, objects, filters_list):
+        """run many sets of deduplication filters in one query"""
+        all_filters = [f for filters in filters_list.values() for f in filters]
+        if not all_filters:
+            return {}
+
+        # the database ignores case on some fields, so we have to as well
+        get_key = partial(
+            get_deduplication_key,
+            case_insensitive={
+                name for name, _, ci in get_deduplication_fields(cls) if ci
+            },
+        )
+
+        # index each match by every identifier that could have found it
+        field_names = {name for f in all_filters for name in f}
+        found = {}
+        for match in objects.filter(
+            reduce(operator.or_, (Q(**f) for f in all_filters))
+        ).order_by("-pk"):
+            for name in field_names:
+                if value := getattr(match, name, None):
+                    # going backwards so that the lowest pk wins, like first()
+                    found[get_key(name, value)] = match
+
+        results = {}
+        for index, filters in filters_list.items():
+            candidates = [
+                found[key]
+                for key in (get_key(*item) for f in filters for item in f.items())
+                if key in found
+            ]
+            if candidates:
+                results[index] = min(candidates, key=lambda m: m.pk)
+        return results
+
+    @classmethod
+    def get_deduplication_filters(cls, data):
+        """queryset filters for each unique identifier present in the data"""
+        filters = []
+        # grabs all the data from the model to create django queryset filters
+        for name, activitypub_field, _ in get_deduplication_fields(cls):
+            value = data.get(activitypub_field)
+            if not value:
+                continue
+            filters.append({name: value})
+
+        if hasattr(cls, "origin_id") and "id" in data:
+            # kinda janky, but this handles special case for books
+            filters.append({"origin_id": data["id"]})
+        return filters
 
     def broadcast(self, activity, sender, software=None, queue=BROADCAST):
         """send out an activity"""
@@ -196,6 +364,45 @@ class ActivitypubMixin:
         """convert from a model to a json activity"""
         return self.to_activity_dataclass().serialize()
 
+    def get_activity_cache_key(self, pure=False):
+        """each representation of the object is cached separately"""
+        return get_activity_cache_key(
+            self.remote_id, pure=pure and hasattr(self, "pure_content")
+        )
+
+    def to_activity_json(self, pure=False):
+        """the serialized activity, ready to send, from the cache if possible"""
+        if not self.id or not self.remote_id:
+            return self.serialize_activity(pure=pure)
+
+        cache_key = self.get_activity_cache_key(pure=pure)
+        activity_json = cache.get(cache_key)
+        if activity_json is None:
+            activity_json = self.serialize_activity(pure=pure)
+            cache.set(cache_key, activity_json, timeout=ACTIVITY_CACHE_TTL)
+        return activity_json
+
+    def serialize_activity(self, pure=False):
+        """the activity as a json string"""
+        activity = self.to_activity(pure=True) if pure else self.to_activity()
+        return json.dumps(activity, cls=activitypub.ActivityEncoder)
+
+    def prime_activity_cache(self, activity, pure=False):
+        """we've just serialized the object to broadcast it, so keep it around
+        for the servers that will fetch it"""
+        if not activity or not self.remote_id:
+            return
+        cache.set(
+            self.get_activity_cache_key(pure=pure),
+            json.dumps(activity, cls=activitypub.ActivityEncoder),
+            timeout=ACTIVITY_CACHE_TTL,
+        )
+
+    def clear_activity_cache(self):
+        """the object (or something it includes) changed"""
+        if self.remote_id:
+            clear_activity_cache(self.remote_id)
+
 
 class ObjectMixin(ActivitypubMixin):
     """add this mixin for object models that are AP serializable"""
@@ -217,6 +424,11 @@ class ObjectMixin(ActivitypubMixin):
         created = created or not bool(self.id)
         # first off, we want to save normally no matter what
         super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if not update_fields or any(
+            getattr(f, "name", None) in update_fields for f in self.activity_fields
+        ):
+            self.clear_activity_cache()
         if not broadcast or (
             hasattr(self, "status_type") and self.status_type == "Announce"
         ):
@@ -234,6 +446,7 @@ class ObjectMixin(ActivitypubMixin):
                 # do we have a "pure" activitypub version of this for mastodon?
                 if software != "bookwyrm" and hasattr(self, "pure_content"):
                     pure_activity = self.to_create_activity(user, pure=True)
+                    self.prime_activity_cache(pure_activity.get("object"), pure=True)
                     self.broadcast(
                         pure_activity, user, software="other", queue=priority
                     )
@@ -241,6 +454,7 @@ class ObjectMixin(ActivitypubMixin):
                     software = "bookwyrm"
                 # sends to BW only if we just did a pure version for masto
                 activity = self.to_create_activity(user)
+                self.prime_activity_cache(activity.get("object"))
                 self.broadcast(activity, user, software=software, queue=priority)
             except AttributeError:
                 # janky as heck, this catches the multiple inheritance chain
@@ -265,6 +479,7 @@ class ObjectMixin(ActivitypubMixin):
             activity = self.to_delete_activity(user)
         else:
             activity = self.to_update_activity(user)
+        self.prime_activity_cache(activity.get("object"))
         self.broadcast(activity, user, queue=priority)
 
     def to_create_activity(self, user, **kwargs):
@@ -274,7 +489,7 @@ class ObjectMixin(ActivitypubMixin):
         signature = None
         create_id = self.remote_id + "/activity"
         if hasattr(activity_object, "content") and activity_object.content:
-            signer = pkcs1_15.new(RSA.import_key(user.key_pair.private_key))
+            signer = pkcs1_15.new(load_private_key(user.key_pair.private_key))
             content = activity_object.content
             signed_message = signer.sign(SHA256.new(content.encode("utf8")))
 
@@ -347,11 +562,11 @@ class OrderedCollectionPageMixin(ObjectMixin):
         if remote_id:
             activity["id"] = remote_id
 
-        paginated = Paginator(queryset, PAGE_LENGTH)
         # add computed fields specific to ordered collections
-        activity["totalItems"] = paginated.count
+        total_items = get_collection_count(queryset)
+        activity["totalItems"] = total_items
         activity["first"] = f"{remote_id}?page=1"
-        activity["last"] = f"{remote_id}?page={paginated.num_pages}"
+        activity["last"] = f"{remote_id}?page={max(ceil(total_items / PAGE_LENGTH), 1)}"
 
         return serializer(**activity)
 
@@ -413,6 +628,7 @@ class CollectionItemMixin(ActivitypubMixin):
         """broadcast updated"""
         # first off, we want to save normally no matter what
         super().save(*args, **kwargs)
+        getattr(self, self.collection_field).clear_activity_cache()
 
         # list items can be updated, normally you would only broadcast on created
         if not broadcast or not self.user.local:
@@ -426,6 +642,7 @@ class CollectionItemMixin(ActivitypubMixin):
         """broadcast a remove activity"""
         activity = self.to_remove_activity(self.user)
         super().delete(*args, **kwargs)
+        getattr(self, self.collection_field).clear_activity_cache()
         if self.user.local and broadcast:
             self.broadcast(activity, self.user)
 
@@ -504,7 +721,7 @@ def unfurl_related_field(related_field, sort_field=None):
     """load reverse lookups (like public key owner or Status attachment"""
     if sort_field and hasattr(related_field, "all"):
         return [
-            unfurl_related_field(i) for i in related_field.order_by(sort_field).all()
+            unfurl_related_field(i) for i in sort_related(related_field, sort_field)
         ]
     if related_field.reverse_unfurl:
         # if it's a one-to-one (key pair)
@@ -515,99 +732,156 @@ def unfurl_related_field(related_field, sort_field=None):
     return related_field.remote_id
 
 
-@app.task(queue=BROADCAST)
-def broadcast_task(sender_id: int, activity: str, recipients: list[str]):
-    """the celery task for broadcast"""
-    user_model = apps.get_model("bookwyrm.User", require_ready=True)
-    sender = user_model.objects.select_related("key_pair").get(id=sender_id)
-    asyncio.run(async_broadcast(recipients, sender, activity))
-
-
-async def async_broadcast(recipients: list[str], sender, data: str):
-    """Send all the broadcasts simultaneously"""
-    timeout = aiohttp.ClientTimeout(total=10)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        tasks = []
-        for recipient in recipients:
-            tasks.append(
-                asyncio.ensure_future(sign_and_send(session, sender, data, recipient))
-            )
-
-        results = await asyncio.gather(*tasks)
-        return results
-
-
-async def sign_and_send(
-    session: aiohttp.ClientSession, sender, data: str, destination: str, **kwargs
-):
-    """Sign the messages and send them in an asynchronous bundle"""
-    now = http_date()
-
-    if not sender.key_pair.private_key:
-        # this shouldn't happen. it would be bad if it happened.
-        raise ValueError("No private key found for sender")
-
-    digest = make_digest(data)
-    signature = make_signature(
-        "post",
-        sender,
-        destination,
-        now,
-        digest=digest,
-        use_legacy_key=kwargs.get("use_legacy_key"),
+def sort_related(related_field, sort_field):
+    """the related objects in order, sorted in python if they were prefetched"""
+    objects = related_field.all()
+    # pylint: disable=protected-access
+    if objects._result_cache is None:
+        return objects.order_by(sort_field)
+    field_name = sort_field.lstrip("-")
+    return sorted(
+        objects,
+        key=lambda obj: getattr(obj, field_name),
+        reverse=sort_field.startswith("-"),
     )
 
-    headers = {
-        "Date": now,
-        "Digest": digest,
-        "Signature": signature,
-        "Content-Type": "application/activity+json; charset=utf-8",
-        "User-Agent": USER_AGENT,
-    }
-
-    try:
-        async with session.post(destination, data=data, headers=headers) as response:
-            if not response.ok:
-                logger.exception(
-                    "Failed to send broadcast to %s: %s", destination, response.reason
-                )
-                if kwargs.get("use_legacy_key") is not True:
-                    logger.info("Trying again with legacy keyId header value")
-                    asyncio.ensure_future(
-                        sign_and_send(
-                            session, sender, data, destination, use_legacy_key=True
-                        )
-                    )
-
-            return response
-    except asyncio.TimeoutError:
-        logger.info("Connection timed out for url: %s", destination)
-    except aiohttp.ClientError as err:
-        logger.exception(err)
-
 
 # pylint: disable=unused-argument
 def to_ordered_collection_page(
     queryset, remote_id, id_only=False, page=1, pure=False, **kwargs
 ):
-    """serialize and paginate a queryset"""
-    paginated = Paginator(queryset, PAGE_LENGTH)
+    """serialize and paginate a queryset. pages are opaque cursors that pick up
+    after (or before) an item, but numbered pages still work"""
+    ordering = get_keyset_ordering(queryset)
+    if ordering:
+        queryset = queryset.order_by(
+            *[f"-{f.name}" if descending else f.name for f, descending in ordering]
+        )
+    cursor = parse_page_cursor(page, ordering) if ordering else None
+
+    page_number = None
+    if cursor and cursor[0] == "before":
+        # walk backwards from the cursor, then put the items back in order
+        object_list = list(
+            queryset.reverse().filter(
+                get_keyset_filter(ordering, cursor[1], reverse=True)
+            )[: PAGE_LENGTH + 1]
+        )
+        has_previous = len(object_list) > PAGE_LENGTH
+        object_list = object_list[:PAGE_LENGTH][::-1]
+        has_next = True
+    else:
+        if cursor:
+            queryset = queryset.filter(get_keyset_filter(ordering, cursor[1]))
+            has_previous = True
+        else:
+            # an old-fashioned numbered page
+            try:
+                page_number = max(int(page), 1)
+            except (TypeError, ValueError):
+                page_number = 1
+            queryset = queryset[(page_number - 1) * PAGE_LENGTH :]
+            has_previous = page_number > 1
+        object_list = list(queryset[: PAGE_LENGTH + 1])
+        has_next = len(object_list) > PAGE_LENGTH
+        object_list = object_list[:PAGE_LENGTH]
 
-    activity_page = paginated.get_page(page)
     if id_only:
-        items = [s.remote_id for s in activity_page.object_list]
+        items = [s.remote_id for s in object_list]
     else:
-        items = [s.to_activity(pure=pure) for s in activity_page.object_list]
+        items = [s.to_activity(pure=pure) for s in object_list]
 
     prev_page = next_page = None
-    if activity_page.has_next():
-        next_page = f"{remote_id}?page={activity_page.next_page_number()}"
-    if activity_page.has_previous():
-        prev_page = f"{remote_id}?page={activity_page.previous_page_number()}"
+    if ordering and object_list:
+        if has_next:
+            next_page = get_page_cursor("after", object_list[-1], ordering)
+        if has_previous:
+            prev_page = get_page_cursor("before", object_list[0], ordering)
+    elif page_number:
+        # this can't be paged by keyset, so it's numbers all the way down
+        next_page = page_number + 1 if has_next else None
+        prev_page = page_number - 1 if has_previous else None
     return activitypub.OrderedCollectionPage(
         id=f"{remote_id}?page={page}",
         partOf=remote_id,
         orderedItems=items,
-        next=next_page,
-        prev=prev_page,
+        next=f"{remote_id}?page={next_page}" if next_page else None,
+        prev=f"{remote_id}?page={prev_page}" if prev_page else None,
     )
+
+
+def get_collection_count(queryset):
+    """counting a big collection is slow, so the totals are cached for a bit"""
+    try:
+        query = str(queryset.query)
+    except EmptyResultSet:
+        return 0
+    cache_key = f"collection-count-{sha256(query.encode('utf-8')).hexdigest()}"
+    return cache_utils.get_or_set(
+        cache_key, queryset.count, timeout=COLLECTION_COUNT_CACHE_TTL
+    )
+
+
+def get_keyset_ordering(queryset):
+    """the (field, descending) pairs that order a queryset, ending with the
+    primary key to break ties, or None if it can't be paged by keyset"""
+    model = queryset.model
+    # pylint: disable=protected-access
+    order_by = queryset.query.order_by or (
+        model._meta.ordering if queryset.query.default_ordering else ()
+    )
+    ordering = []
+    for name in order_by:
+        if not isinstance(name, str):
+            return None
+        descending = name.startswith("-")
+        name = name.lstrip("-")
+        try:
+            field = model._meta.pk if name == "pk" else model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        # related and nullable fields can't be compared reliably
+        if not field.concrete or field.is_relation or field.null:
+            return None
+        ordering.append((field, descending))
+        if field.primary_key:
+            return tuple(ordering)
+    if not ordering:
+        return None
+    ordering.append((model._meta.pk, ordering[-1][1]))
+    return tuple(ordering)
+
+
+def get_keyset_filter(ordering, values, reverse=False):
+    """everything that comes after these values, or before them if reversed"""
+    filters = []
+    equal = {}
+    for (field, descending), value in zip(ordering, values):
+        lookup = "lt" if descending != reverse else "gt"
+        filters.append(Q(**equal, **{f"{field.name}__{lookup}": value}))
+        equal[field.name] = value
+    return reduce(operator.or_, filters)
+
+
+def get_page_cursor(direction, obj, ordering):
+    """an opaque page id that starts after (or ends before) an object"""
+    values = [field.value_to_string(obj) for field, _ in ordering]
+    cursor = json.dumps([direction, values]).encode("utf-8")
+    return urlsafe_b64encode(cursor).decode("utf-8").rstrip("=")
+
+
+def parse_page_cursor(page, ordering):
+    """the direction and values of a page cursor, or None if it's not one"""
+    if isinstance(page, int) or not page or str(page).isdigit():
+        return None
+    try:
+        page = str(page)
+        cursor = json.loads(urlsafe_b64decode(page + "=" * (-len(page) % 4)))
+        direction, values = cursor
+        if direction not in ("after", "before") or len(values) != len(ordering):
+            return None
+        return direction, [
+            field.to_python(value) for (field, _), value in zip(ordering, values)
+        ]
+    except (BinasciiError, TypeError, ValueError, ValidationError):
+        return None
@@ -15,6 +15,12 @@ class Attachment(ActivitypubMixin, BookWyrmModel):
     )
     reverse_unfurl = True
 
+    def save(self, *args, **kwargs):
+        """the status's activity includes its attachments"""
+        super().save(*args, **kwargs)
+        if self.status:
+            self.status.clear_activity_cache()
+
     class Meta:
         """one day we'll have other types of attachments besides images"""
 
@@ -26,6 +26,7 @@ from bookwyrm.settings import (
 )
 
 from .activitypub_mixin import OrderedCollectionPageMixin, ObjectMixin
+from .activitypub_mixin import clear_activity_cache
 from .base_model import BookWyrmModel
 from . import fields
 
@@ -129,12 +130,18 @@ class Book(BookDataModel):
         models.CharField(max_length=255), blank=True, null=True, default=list
     )
     authors = fields.ManyToManyField("Author")
-    cover = fields.ImageField(
-        upload_to="covers/", blank=True, null=True, alt_field="alt_text"
+    cover = fields.ContentAddressedImageField(
+        upload_to="covers/",
+        blank=True,
+        null=True,
+        alt_field="alt_text",
+        db_index=True,
     )
     preview_image = models.ImageField(
         upload_to="previews/covers/", blank=True, null=True
     )
+    # a hash of what went into the preview image, to tell if it's out of date
+    preview_image_fingerprint = models.CharField(max_length=64, blank=True, null=True)
     first_published_date = fields.PartialDateField(blank=True, null=True)
     published_date = fields.PartialDateField(blank=True, null=True)
 
@@ -382,7 +389,11 @@ class Edition(Book):
         if self.sort_title in [None, ""]:
             self.sort_title = self.guess_sort_title()
 
-        return super().save(*args, **kwargs)
+        super().save(*args, **kwargs)
+
+        # the work's activity includes its editions
+        if self.parent_work_id:
+            clear_activity_cache(f"https://{DOMAIN}/book/{self.parent_work_id}")
 
     @transaction.atomic
     def repair(self):
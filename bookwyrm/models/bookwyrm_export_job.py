@@ -1,7 +1,13 @@
 """Export user account to tar.gz file for import into another Bookwyrm instance"""
 
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 import dataclasses
+from io import BytesIO
+from itertools import islice
 import logging
+import shutil
+from tempfile import SpooledTemporaryFile
 from uuid import uuid4
 
 from django.db.models import FileField
@@ -14,11 +20,19 @@ from bookwyrm.models import Review, Comment, Quotation
 from bookwyrm.models import Edition
 from bookwyrm.models import UserFollows, User, UserBlocks
 from bookwyrm.models.job import ParentJob, ParentTask
+from bookwyrm.settings import USER_EXPORT_COVER_WORKERS
 from bookwyrm.tasks import app, IMPORTS
 from bookwyrm.utils.tar import BookwyrmTarFile
 
 logger = logging.getLogger(__name__)
 
+# how many editions to load from the database at once
+EXPORT_BATCH_SIZE = 100
+# how much of the archive json to keep in memory before it goes to disk
+EXPORT_SPOOL_SIZE = 10 * 1024 * 1024
+# how much of each cover to keep in memory while it waits to go in the tar
+COVER_SPOOL_SIZE = 1024 * 1024
+
 
 class BookwyrmExportJob(ParentJob):
     """entry for a specific request to export a bookwyrm user"""
@@ -43,8 +57,7 @@ def start_export_task(**kwargs):
     try:
         # This is where ChildJobs get made
         job.export_data = ContentFile(b"", str(uuid4()))
-        json_data = json_export(job.user)
-        tar_export(json_data, job.user, job.export_data)
+        tar_export(job.user, job.export_data)
         job.save(update_fields=["export_data"])
     except Exception as err:  # pylint: disable=broad-except
         logger.exception("User Export Job %s Failed with error: %s", job.id, err)
@@ -53,28 +66,82 @@ def start_export_task(**kwargs):
     job.set_status("complete")
 
 
-def tar_export(json_data: str, user, file):
+def tar_export(user, file):
     """wrap the export information in a tar file"""
     file.open("wb")
-    with BookwyrmTarFile.open(mode="w:gz", fileobj=file) as tar:
-        tar.write_bytes(json_data.encode("utf-8"))
+    with BookwyrmTarFile.open(mode="w:gz", fileobj=file) as tar, SpooledTemporaryFile(
+        max_size=EXPORT_SPOOL_SIZE
+    ) as json_file:
+        covers = {}
+        write_json_export(user, json_file, covers)
+        tar.write_json_file(json_file)
 
         # Add avatar image if present
         if getattr(user, "avatar", False):
             tar.add_image(user.avatar, filename="avatar")
 
-        editions = get_books_for_user(user)
-        for book in editions:
-            if getattr(book, "cover", False):
-                tar.add_image(book.cover)
+        add_covers(tar, covers.values())
 
     file.close()
 
 
-def json_export(
-    user,
-):  # pylint: disable=too-many-locals, too-many-statements, too-many-branches
+def add_covers(tar, covers):
+    """download covers a few at a time, and add them to the tar in order as
+    they're ready"""
+    covers = iter(covers)
+    with ThreadPoolExecutor(max_workers=USER_EXPORT_COVER_WORKERS) as executor:
+        pending = deque(
+            (cover.name, executor.submit(read_cover, cover))
+            for cover in islice(covers, USER_EXPORT_COVER_WORKERS * 2)
+        )
+        while pending:
+            name, download = pending.popleft()
+            if (cover := next(covers, None)) is not None:
+                pending.append((cover.name, executor.submit(read_cover, cover)))
+            with download.result() as buffer:
+                tar.write_file(name, buffer)
+
+
+def read_cover(cover):
+    """a copy of a cover, kept in memory unless it's a big one"""
+    # pylint: disable-next=consider-using-with
+    buffer = SpooledTemporaryFile(max_size=COVER_SPOOL_SIZE)
+    with cover.storage.open(cover.name, "rb") as remote:
+        shutil.copyfileobj(remote, buffer)
+    return buffer
+
+
+def json_export(user):
     """Generate an export for a user"""
+    output = BytesIO()
+    write_json_export(user, output)
+    return output.getvalue().decode("utf-8")
+
+
+def write_json_export(user, output, covers=None):
+    """write the export to a binary file a book at a time, so that only one
+    batch of books is ever in memory. covers are collected by file name, so
+    editions that share one only add it once"""
+    encoder = DjangoJSONEncoder()
+    # the books go at the end, so they can be written as they're serialized
+    user_json = encoder.encode(export_user(user))
+    output.write(f'{user_json[:-1]}, "books": ['.encode("utf-8"))
+    first = True
+    # shelves and lists come up again and again, so they're serialized once
+    collections = {}
+    for editions in get_book_batches(user):
+        if covers is not None:
+            covers.update((e.cover.name, e.cover) for e in editions if e.cover)
+        for book in export_books(user, editions, collections):
+            if not first:
+                output.write(b", ")
+            first = False
+            output.write(encoder.encode(book).encode("utf-8"))
+    output.write(b"]}")
+
+
+def export_user(user):
+    """everything but the books"""
 
     # User as AP object
     exported_user = user.to_activity()
@@ -110,91 +177,6 @@ def json_export(
             {"goal": goal.goal, "year": goal.year, "privacy": goal.privacy}
         )
 
-    # Reading history - can't be serialized as AP
-    readthroughs = ReadThrough.objects.filter(user=user).distinct().values()
-    readthroughs = list(readthroughs)
-
-    # Books
-    editions = get_books_for_user(user)
-    exported_user["books"] = []
-
-    for edition in editions:
-        book = {}
-        book["work"] = edition.parent_work.to_activity()
-        book["edition"] = edition.to_activity()
-
-        if book["edition"].get("cover"):
-            # change the URL to be relative to the JSON file
-            filename = book["edition"]["cover"]["url"].rsplit("/", maxsplit=1)[-1]
-            book["edition"]["cover"]["url"] = f"covers/{filename}"
-
-        # authors
-        book["authors"] = []
-        for author in edition.authors.all():
-            book["authors"].append(author.to_activity())
-
-        # Shelves this book is on
-        # Every ShelfItem is this book so we don't other serializing
-        book["shelves"] = []
-        shelf_books = (
-            ShelfBook.objects.select_related("shelf")
-            .filter(user=user, book=edition)
-            .distinct()
-        )
-
-        for shelfbook in shelf_books:
-            book["shelves"].append(shelfbook.shelf.to_activity())
-
-        # Lists and ListItems
-        # ListItems include "notes" and "approved" so we need them
-        # even though we know it's this book
-        book["lists"] = []
-        list_items = ListItem.objects.filter(book=edition, user=user).distinct()
-
-        for item in list_items:
-            list_info = item.book_list.to_activity()
-            list_info[
-                "privacy"
-            ] = item.book_list.privacy  # this isn't serialized so we add it
-            list_info["list_item"] = item.to_activity()
-            book["lists"].append(list_info)
-
-        # Statuses
-        # Can't use select_subclasses here because
-        # we need to filter on the "book" value,
-        # which is not available on an ordinary Status
-        for status in ["comments", "quotations", "reviews"]:
-            book[status] = []
-
-        comments = Comment.objects.filter(user=user, book=edition).all()
-        for status in comments:
-            obj = status.to_activity()
-            obj["progress"] = status.progress
-            obj["progress_mode"] = status.progress_mode
-            book["comments"].append(obj)
-
-        quotes = Quotation.objects.filter(user=user, book=edition).all()
-        for status in quotes:
-            obj = status.to_activity()
-            obj["position"] = status.position
-            obj["endposition"] = status.endposition
-            obj["position_mode"] = status.position_mode
-            book["quotations"].append(obj)
-
-        reviews = Review.objects.filter(user=user, book=edition).all()
-        for status in reviews:
-            obj = status.to_activity()
-            book["reviews"].append(obj)
-
-        # readthroughs can't be serialized to activity
-        book_readthroughs = (
-            ReadThrough.objects.filter(user=user, book=edition).distinct().values()
-        )
-        book["readthroughs"] = list(book_readthroughs)
-
-        # append everything
-        exported_user["books"].append(book)
-
     # saved book lists - just the remote id
     saved_lists = List.objects.filter(id__in=user.saved_lists.all()).distinct()
     exported_user["saved_lists"] = [l.remote_id for l in saved_lists]
@@ -210,7 +192,130 @@ def json_export(
 
     exported_user["blocks"] = [b.remote_id for b in blocking]
 
-    return DjangoJSONEncoder().encode(exported_user)
+    return exported_user
+
+
+def export_books(user, editions, collections=None):
+    """the export data for a batch of editions. each kind of related row is
+    looked up for the whole batch at once and sorted out by book"""
+    statuses = ("user", "book", "reply_parent")
+    status_tags = ("mention_users", "mention_books", "mention_hashtags", "attachments")
+    related = {
+        "shelf_books": group_by_book(
+            ShelfBook.objects.select_related("shelf", "shelf__user")
+            .filter(user=user, book__in=editions)
+            .distinct()
+        ),
+        "list_items": group_by_book(
+            ListItem.objects.select_related(
+                "book_list", "book_list__user", "book", "user"
+            )
+            .filter(user=user, book__in=editions)
+            .distinct()
+        ),
+        "comments": group_by_book(
+            Comment.objects.select_related(*statuses)
+            .prefetch_related(*status_tags)
+            .filter(user=user, book__in=editions)
+        ),
+        "quotations": group_by_book(
+            Quotation.objects.select_related(*statuses)
+            .prefetch_related(*status_tags)
+            .filter(user=user, book__in=editions)
+        ),
+        "reviews": group_by_book(
+            Review.objects.select_related(*statuses)
+            .prefetch_related(*status_tags)
+            .filter(user=user, book__in=editions)
+        ),
+        "readthroughs": group_by_book(
+            ReadThrough.objects.filter(user=user, book__in=editions).distinct().values()
+        ),
+    }
+    for edition in editions:
+        yield export_book(
+            edition, {k: v[edition.id] for k, v in related.items()}, collections
+        )
+
+
+def group_by_book(queryset):
+    """sort rows out by the book they're about"""
+    rows = defaultdict(list)
+    for row in queryset:
+        rows[row["book_id"] if isinstance(row, dict) else row.book_id].append(row)
+    return rows
+
+
+def export_book(edition, related, collections=None):
+    """an edition and everything the user did with it"""
+    collections = {} if collections is None else collections
+    book = {}
+    book["work"] = edition.parent_work.to_activity()
+    book["edition"] = edition.to_activity()
+
+    if book["edition"].get("cover"):
+        # change the URL to be relative to the JSON file
+        filename = book["edition"]["cover"]["url"].rsplit("/", maxsplit=1)[-1]
+        book["edition"]["cover"]["url"] = f"covers/{filename}"
+
+    # authors
+    book["authors"] = []
+    for author in edition.authors.all():
+        book["authors"].append(author.to_activity())
+
+    # Shelves this book is on
+    # Every ShelfItem is this book so we don't other serializing
+    book["shelves"] = []
+    for shelfbook in related["shelf_books"]:
+        book["shelves"].append(get_collection_activity(shelfbook.shelf, collections))
+
+    # Lists and ListItems
+    # ListItems include "notes" and "approved" so we need them
+    # even though we know it's this book
+    book["lists"] = []
+    for item in related["list_items"]:
+        list_info = dict(get_collection_activity(item.book_list, collections))
+        list_info[
+            "privacy"
+        ] = item.book_list.privacy  # this isn't serialized so we add it
+        list_info["list_item"] = item.to_activity()
+        book["lists"].append(list_info)
+
+    # Statuses
+    # Can't use select_subclasses here because
+    # we need to filter on the "book" value,
+    # which is not available on an ordinary Status
+    for status in ["comments", "quotations", "reviews"]:
+        book[status] = []
+
+    for status in related["comments"]:
+        obj = status.to_activity()
+        obj["progress"] = status.progress
+        obj["progress_mode"] = status.progress_mode
+        book["comments"].append(obj)
+
+    for status in related["quotations"]:
+        obj = status.to_activity()
+        obj["position"] = status.position
+        obj["endposition"] = status.endposition
+        obj["position_mode"] = status.position_mode
+        book["quotations"].append(obj)
+
+    for status in related["reviews"]:
+        obj = status.to_activity()
+        book["reviews"].append(obj)
+
+    # readthroughs can't be serialized to activity
+    book["readthroughs"] = related["readthroughs"]
+
+    return book
+
+
+def get_collection_activity(collection, collections):
+    """a shelf or list, serialized the first time it comes up"""
+    if collection.remote_id not in collections:
+        collections[collection.remote_id] = collection.to_activity()
+    return collections[collection.remote_id]
 
 
 def get_books_for_user(user):
@@ -230,3 +335,22 @@ def get_books_for_user(user):
     )
 
     return editions
+
+
+def get_book_batches(user):
+    """the user's books, loaded from the database a batch at a time"""
+    edition_ids = get_books_for_user(user).order_by("id").values_list("id", flat=True)
+    edition_ids = edition_ids.iterator()
+    while batch := list(islice(edition_ids, EXPORT_BATCH_SIZE)):
+        yield list(
+            Edition.objects.filter(id__in=batch)
+            .select_related("parent_work")
+            .prefetch_related(
+                "authors",
+                "file_links",
+                "parent_work__authors",
+                "parent_work__editions",
+                "parent_work__file_links",
+            )
+            .order_by("id")
+        )
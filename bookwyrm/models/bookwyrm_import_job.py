@@ -1,8 +1,10 @@
 """Import a user from another Bookwyrm instance"""
 
-import json
+from itertools import islice
 import logging
+import math
 
+from django.db import transaction
 from django.db.models import FileField, JSONField, CharField
 from django.utils import timezone
 from django.utils.html import strip_tags
@@ -10,8 +12,10 @@ from django.contrib.postgres.fields import ArrayField as DjangoArrayField
 
 from bookwyrm import activitypub
 from bookwyrm import models
+from bookwyrm.settings import USER_IMPORT_CHUNK_SIZE
 from bookwyrm.tasks import app, IMPORTS
-from bookwyrm.models.job import ParentJob, ParentTask, SubTask
+from bookwyrm.models.job import ChildJob, ParentJob, ParentTask, SubTask
+from bookwyrm.utils.json_stream import iter_json_array
 from bookwyrm.utils.tar import BookwyrmTarFile
 
 logger = logging.getLogger(__name__)
@@ -21,12 +25,43 @@ class BookwyrmImportJob(ParentJob):
     """entry for a specific request for importing a bookwyrm user backup"""
 
     archive_file = FileField(null=True, blank=True)
-    import_data = JSONField(null=True)
     required = DjangoArrayField(CharField(max_length=50, blank=True), blank=True)
 
     def start_job(self):
         """Start the job"""
-        start_import_task.delay(job_id=self.id, no_children=True)
+        start_import_task.delay(job_id=self.id, no_children=False)
+
+    def resume_job(self):
+        """run the chunks of books that never finished, like after a worker
+        crashed. the books that were already imported are skipped over"""
+        if self.complete:
+            return
+        self.queue_chunks()
+
+    def queue_chunks(self):
+        """start a task for each chunk of books that hasn't finished"""
+        for chunk in self.chunks.filter(complete=False):
+            import_books_task.delay(job_id=self.id, child_id=chunk.id)
+
+    @property
+    def chunks(self):
+        """the batches of books being imported"""
+        return BookwyrmImportChunk.objects.filter(parent_job=self)
+
+    @property
+    def percent_complete(self):
+        """How far along?"""
+        chunk_count = self.chunks.count()
+        if not chunk_count:
+            return 0
+        done = self.chunks.filter(complete=True).count()
+        return math.floor(done / chunk_count * 100)
+
+
+class BookwyrmImportChunk(ChildJob):
+    """some of the books from a bookwyrm user backup, imported in their own task"""
+
+    books = JSONField(default=list)
 
 
 @app.task(queue=IMPORTS, base=ParentTask)
@@ -40,89 +75,199 @@ def start_import_task(**kwargs):
         return
 
     try:
+        job.set_status("active")
         archive_file.open("rb")
         with BookwyrmTarFile.open(mode="r:gz", fileobj=archive_file) as tar:
-            job.import_data = json.loads(tar.read("archive.json").decode("utf-8"))
+            # the books are read from the archive as they're split into
+            # chunks, and everything else is collected along the way
+            data = {}
+            create_book_chunks(
+                job, iter_json_array(tar.extractfile("archive.json"), "books", data)
+            )
 
             if "include_user_profile" in job.required:
-                update_user_profile(job.user, tar, job.import_data)
+                update_user_profile(job.user, tar, data)
             if "include_user_settings" in job.required:
-                update_user_settings(job.user, job.import_data)
+                update_user_settings(job.user, data)
             if "include_goals" in job.required:
-                update_goals(job.user, job.import_data.get("goals"))
+                update_goals(job.user, data.get("goals"))
             if "include_saved_lists" in job.required:
-                upsert_saved_lists(job.user, job.import_data.get("saved_lists"))
+                upsert_saved_lists(job.user, data.get("saved_lists"))
             if "include_follows" in job.required:
-                upsert_follows(job.user, job.import_data.get("follows"))
+                upsert_follows(job.user, data.get("follows"))
             if "include_blocks" in job.required:
-                upsert_user_blocks(job.user, job.import_data.get("blocks"))
-
-            process_books(job, tar)
+                upsert_user_blocks(job.user, data.get("blocks"))
+        archive_file.close()
 
+        if job.chunks.exists():
+            job.queue_chunks()
+        else:
             job.set_status("complete")
-        archive_file.close()
 
     except Exception as err:  # pylint: disable=broad-except
         logger.exception("User Import Job %s Failed with error: %s", job.id, err)
         job.set_status("failed")
 
 
-def process_books(job, tar):
+@transaction.atomic
+def create_book_chunks(job, books):
+    """split up the books, so they can be imported in parallel. the tasks
+    can't start until all the chunks exist, or the job would look finished
+    as soon as the first one was done"""
+    while chunk := list(islice(books, USER_IMPORT_CHUNK_SIZE)):
+        BookwyrmImportChunk.objects.create(parent_job=job, books=chunk)
+
+
+@app.task(queue=IMPORTS, base=SubTask)
+def import_books_task(**kwargs):
+    """import one chunk of books"""
+    job = BookwyrmImportJob.objects.get(id=kwargs["job_id"])
+    chunk = BookwyrmImportChunk.objects.get(id=kwargs["child_id"])
+    if job.complete or chunk.complete:
+        return
+
+    job.archive_file.open("rb")
+    with BookwyrmTarFile.open(mode="r:gz", fileobj=job.archive_file) as tar:
+        process_books(job, tar, chunk.books)
+    job.archive_file.close()
+
+    # this reports to the job as a BookwyrmImportJob, so that its
+    # notification goes out when it's done
+    chunk.parent_job = job
+    chunk.complete_job()
+
+
+def process_books(job, tar, books):
     """
     Process user import data related to books
     We always import the books even if not assigning
     them to shelves, lists etc
     """
+    try:
+        with transaction.atomic():
+            editions = get_or_create_editions(books, tar)
+    except Exception as err:  # pylint: disable=broad-except
+        # the books will be looked up one at a time instead
+        logger.exception(
+            "User Import Job %s failed to look up a chunk of books: %s", job.id, err
+        )
+        editions = [None] * len(books)
+
+    for data, edition in zip(books, editions):
+        try:
+            # a book is imported all at once or not at all, so that if the
+            # chunk has to run again it can pick up where it left off
+            with transaction.atomic():
+                process_book(job, tar, data, edition)
+        except Exception as err:  # pylint: disable=broad-except
+            # one bad book shouldn't hold up the rest of the import
+            logger.exception(
+                "User Import Job %s failed to import a book: %s", job.id, err
+            )
 
-    books = job.import_data.get("books")
 
-    for data in books:
-        book = get_or_create_edition(data, tar)
+def process_book(job, tar, data, book=None):
+    """import one book and everything the user did with it"""
+    book = book or get_or_create_edition(data, tar)
 
-        if "include_shelves" in job.required:
-            upsert_shelves(book, job.user, data)
+    if "include_shelves" in job.required:
+        upsert_shelves(book, job.user, data)
 
-        if "include_readthroughs" in job.required:
-            upsert_readthroughs(data.get("readthroughs"), job.user, book.id)
+    if "include_readthroughs" in job.required:
+        upsert_readthroughs(data.get("readthroughs"), job.user, book.id)
 
-        if "include_comments" in job.required:
-            upsert_statuses(
-                job.user, models.Comment, data.get("comments"), book.remote_id
-            )
-        if "include_quotations" in job.required:
-            upsert_statuses(
-                job.user, models.Quotation, data.get("quotations"), book.remote_id
-            )
+    if "include_comments" in job.required:
+        upsert_statuses(job.user, models.Comment, data.get("comments"), book.remote_id)
+    if "include_quotations" in job.required:
+        upsert_statuses(
+            job.user, models.Quotation, data.get("quotations"), book.remote_id
+        )
 
-        if "include_reviews" in job.required:
-            upsert_statuses(
-                job.user, models.Review, data.get("reviews"), book.remote_id
-            )
+    if "include_reviews" in job.required:
+        upsert_statuses(job.user, models.Review, data.get("reviews"), book.remote_id)
 
-        if "include_lists" in job.required:
-            upsert_lists(job.user, data.get("lists"), book.id)
+    if "include_lists" in job.required:
+        upsert_lists(job.user, data.get("lists"), book.id)
 
 
 def get_or_create_edition(book_data, tar):
     """Take a JSON string of work and edition data,
     find or create the edition and work in the database and
     return an edition instance"""
+    return get_or_create_editions([book_data], tar)[0]
 
-    edition = book_data.get("edition")
-    existing = models.Edition.find_existing(edition)
-    if existing:
-        return existing
 
-    # make sure we have the authors in the local DB
-    # replace the old author ids in the edition JSON
-    edition["authors"] = []
-    for author in book_data.get("authors"):
-        parsed_author = activitypub.parse(author)
-        instance = parsed_author.to_model(
-            model=models.Author, save=True, overwrite=True
-        )
+def get_or_create_editions(books, tar):
+    """find or create the editions for a chunk of books. the authors, works
+    and editions that are already here are looked up for the whole chunk at
+    once, and the missing authors are created together"""
+    editions = models.Edition.find_existing_batch([book["edition"] for book in books])
+    missing = [book for book, edition in zip(books, editions) if not edition]
+    if not missing:
+        return editions
 
-        edition["authors"].append(instance.remote_id)
+    authors = get_or_create_authors(
+        [author for book in missing for author in book["authors"]]
+    )
+    works = get_or_create_works([book["work"] for book in missing])
+    return [
+        edition or create_edition(book, tar, authors, works)
+        for book, edition in zip(books, editions)
+    ]
+
+
+def get_or_create_authors(activities):
+    """authors by their id in the archive. the ones we don't have are
+    created all at once"""
+    activities = list({activity["id"]: activity for activity in activities}.values())
+    existing = models.Author.find_existing_batch(activities)
+    authors = {
+        activity["id"]: author
+        for activity, author in zip(activities, existing)
+        if author
+    }
+
+    new = {}
+    for activity in activities:
+        if activity["id"] in authors:
+            continue
+        author = activitypub.parse(activity).to_model(
+            model=models.Author, instance=models.Author(), save=False
+        )
+        # like BookDataModel.save, the archive's id is where this came from,
+        # and the local remote id is set once there's a primary key
+        author.origin_id = activity["id"]
+        author.remote_id = None
+        new[activity["id"]] = author
+    if new:
+        models.Author.objects.bulk_create(new.values())
+        for author in new.values():
+            author.remote_id = author.get_remote_id()
+        models.Author.objects.bulk_update(new.values(), ["remote_id"])
+    return authors | new
+
+
+def get_or_create_works(activities):
+    """works by their id in the archive. a work is a kind of book, which
+    django can't create in bulk, so the missing ones are saved one by one"""
+    activities = list({activity["id"]: activity for activity in activities}.values())
+    existing = models.Work.find_existing_batch(activities)
+    works = {}
+    for activity, work in zip(activities, existing):
+        # the editions are created here, so the work doesn't need to load them
+        works[activity["id"]] = work or activitypub.parse(
+            dict(activity, editions=[])
+        ).to_model(model=models.Work, instance=models.Work(), save=True)
+    return works
+
+
+def create_edition(book_data, tar, authors, works):
+    """create an edition, with its authors and work already in the database"""
+    edition = book_data["edition"]
+    # replace the old author ids in the edition JSON
+    edition["authors"] = [
+        authors[author["id"]].remote_id for author in book_data["authors"]
+    ]
 
     # we will add the cover later from the tar
     # don't try to load it from the old server
@@ -130,17 +275,11 @@ def get_or_create_edition(book_data, tar):
     cover_path = cover.get("url", None)
     edition["cover"] = {}
 
-    # first we need the parent work to exist
-    work = book_data.get("work")
-    work["editions"] = []
-    parsed_work = activitypub.parse(work)
-    work_instance = parsed_work.to_model(model=models.Work, save=True, overwrite=True)
-
-    # now we have a work we can add it to the edition
-    # and create the edition model instance
-    edition["work"] = work_instance.remote_id
+    edition["work"] = works[book_data["work"]["id"]].remote_id
     parsed_edition = activitypub.parse(edition)
-    book = parsed_edition.to_model(model=models.Edition, save=True, overwrite=True)
+    book = parsed_edition.to_model(
+        model=models.Edition, instance=models.Edition(), save=True, overwrite=True
+    )
 
     # set the cover image from the tar
     if cover_path:
@@ -312,14 +451,6 @@ def update_user_settings(user, data):
     user.save(update_fields=update_fields)
 
 
-@app.task(queue=IMPORTS, base=SubTask)
-def update_user_settings_task(job_id):
-    """wrapper task for user's settings import"""
-    parent_job = BookwyrmImportJob.objects.get(id=job_id)
-
-    return update_user_settings(parent_job.user, parent_job.import_data.get("user"))
-
-
 def update_goals(user, data):
     """update the user's goals from import data"""
 
@@ -337,14 +468,6 @@ def update_goals(user, data):
             models.AnnualGoal.objects.create(**goal)
 
 
-@app.task(queue=IMPORTS, base=SubTask)
-def update_goals_task(job_id):
-    """wrapper task for user's goals import"""
-    parent_job = BookwyrmImportJob.objects.get(id=job_id)
-
-    return update_goals(parent_job.user, parent_job.import_data.get("goals"))
-
-
 def upsert_saved_lists(user, values):
     """Take a list of remote ids and add as saved lists"""
 
@@ -354,16 +477,6 @@ def upsert_saved_lists(user, values):
             user.saved_lists.add(book_list)
 
 
-@app.task(queue=IMPORTS, base=SubTask)
-def upsert_saved_lists_task(job_id):
-    """wrapper task for user's saved lists import"""
-    parent_job = BookwyrmImportJob.objects.get(id=job_id)
-
-    return upsert_saved_lists(
-        parent_job.user, parent_job.import_data.get("saved_lists")
-    )
-
-
 def upsert_follows(user, values):
     """Take a list of remote ids and add as follows"""
 
@@ -381,14 +494,6 @@ def upsert_follows(user, values):
                 follow_request.save()
 
 
-@app.task(queue=IMPORTS, base=SubTask)
-def upsert_follows_task(job_id):
-    """wrapper task for user's follows import"""
-    parent_job = BookwyrmImportJob.objects.get(id=job_id)
-
-    return upsert_follows(parent_job.user, parent_job.import_data.get("follows"))
-
-
 def upsert_user_blocks(user, user_ids):
     """block users"""
 
@@ -408,16 +513,6 @@ def upsert_user_blocks(user, user_ids):
                 models.GroupMember.remove(user, user_object)
 
 
-@app.task(queue=IMPORTS, base=SubTask)
-def upsert_user_blocks_task(job_id):
-    """wrapper task for user's blocks import"""
-    parent_job = BookwyrmImportJob.objects.get(id=job_id)
-
-    return upsert_user_blocks(
-        parent_job.user, parent_job.import_data.get("blocked_users")
-    )
-
-
 def update_followers_address(user, field):
     """statuses to or cc followers need to have the followers
     address updated to the new local user"""
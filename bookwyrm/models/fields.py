@@ -1,6 +1,8 @@
 """ activitypub-aware django model fields """
 from dataclasses import MISSING
 from datetime import datetime
+import hashlib
+import os
 import re
 from uuid import uuid4
 from urllib.parse import urljoin
@@ -11,6 +13,7 @@ from django.contrib.postgres.fields import ArrayField as DjangoArrayField
 from django.contrib.postgres.fields import CICharField as DjangoCICharField
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.fields.files import ImageFieldFile
 from django.forms import ClearableFileInput, ImageField as DjangoImageField
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -345,20 +348,27 @@ class ManyToManyField(ActivitypubFieldMixin, models.ManyToManyField):
         if not isinstance(value, list):
             # If this is a link, we currently aren't doing anything with it
             return None
-        items = []
+        remote_ids = []
         for remote_id in value:
             try:
                 validate_remote_id(remote_id)
             except ValidationError:
                 continue
-            items.append(
-                activitypub.resolve_remote_id(
-                    remote_id,
-                    model=self.related_model,
-                    allow_external_connections=allow_external_connections,
-                )
+            remote_ids.append(remote_id)
+
+        # look up everything we already have at once, and only resolve the rest
+        existing = self.related_model.find_existing_batch(
+            [{"id": remote_id} for remote_id in remote_ids]
+        )
+        return [
+            item
+            or activitypub.resolve_remote_id(
+                remote_id,
+                model=self.related_model,
+                allow_external_connections=allow_external_connections,
             )
-        return items
+            for remote_id, item in zip(remote_ids, existing)
+        ]
 
 
 class TagField(ManyToManyField):
@@ -519,6 +529,57 @@ class ImageField(ActivitypubFieldMixin, models.ImageField):
         )
 
 
+class ContentAddressedImageFieldFile(ImageFieldFile):
+    """an image that's stored under a hash of what's in it, so that the same
+    image is only stored once however many objects use it"""
+
+    def save(self, name, content, save=True):
+        name = self.field.generate_filename(
+            self.instance, get_content_name(name, content)
+        )
+        if not self.storage.exists(name):
+            name = self.storage.save(name, content, max_length=self.field.max_length)
+        self.name = name
+        setattr(self.instance, self.field.attname, self.name)
+        self._committed = True
+
+        if save:
+            self.instance.save()
+
+    def delete(self, save=True):
+        """leave the stored file alone if anything else still uses it"""
+        if self.name and self.get_references().exclude(pk=self.instance.pk).exists():
+            self.close()
+            self.name = None
+            setattr(self.instance, self.field.attname, self.name)
+            self._committed = False
+            if save:
+                self.instance.save()
+            return
+        super().delete(save=save)
+
+    def get_references(self):
+        """the objects that use this stored file"""
+        # pylint: disable=protected-access
+        return self.field.model._default_manager.filter(**{self.field.name: self.name})
+
+
+class ContentAddressedImageField(ImageField):
+    """activitypub-aware image field that stores identical images once"""
+
+    attr_class = ContentAddressedImageFieldFile
+
+
+def get_content_name(name, content):
+    """a file name made from a hash of the file's contents"""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    extension = os.path.splitext(name)[1].lower()
+    return f"{digest.hexdigest()}{extension}"
+
+
 def get_absolute_url(value):
     """returns an absolute URL for the image"""
     name = getattr(value, "name")
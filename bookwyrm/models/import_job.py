@@ -1,14 +1,22 @@
 """ track progress of goodreads imports """
+from collections import Counter, defaultdict
 from datetime import datetime
+import json
+import logging
 import math
 import re
+from typing import Any, Iterable
 import dateutil.parser
 
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Count, F, Q
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from bookwyrm.connectors import connector_manager
+from bookwyrm.activitypub import ActivityEncoder
+from bookwyrm.broadcast import broadcast_many_task
+from bookwyrm.connectors import connector_manager, maybe_isbn
 from bookwyrm.models import (
     User,
     Book,
@@ -20,9 +28,12 @@ from bookwyrm.models import (
     Review,
     ReviewRating,
 )
+from bookwyrm.settings import IMPORT_CHUNK_SIZE, IMPORT_USER_CONCURRENCY
 from bookwyrm.tasks import app, IMPORT_TRIGGERED, IMPORTS
 from .fields import PrivacyLevels
 
+logger = logging.getLogger(__name__)
+
 
 def unquote_string(text):
     """resolve csv quote weirdness"""
@@ -64,13 +75,22 @@ class ImportJob(models.Model):
     privacy = models.CharField(max_length=255, default="public", choices=PrivacyLevels)
     retry = models.BooleanField(default=False)
     task_id = models.CharField(max_length=200, null=True, blank=True)
+    # the uploaded csv, kept until its rows have been read
+    import_file = models.FileField(null=True, blank=True)
 
     complete = models.BooleanField(default=False)
     status = models.CharField(
         max_length=50, choices=ImportStatuses, default="pending", null=True
     )
 
-    def start_job(self):
+    # kept up to date as items are saved, so progress doesn't need counting.
+    # jobs from before these were added count their items the first time
+    total_items = models.IntegerField(null=True, default=0)
+    succeeded_items = models.IntegerField(null=True, default=0)
+    failed_items = models.IntegerField(null=True, default=0)
+    finished_items = models.IntegerField(null=True, default=0)
+
+    def start_job(self) -> None:
         """Report that the job has started"""
         task = start_import_task.delay(self.id)
         self.task_id = task.id
@@ -81,7 +101,7 @@ class ImportJob(models.Model):
         """Report that the job has completed"""
         self.status = "complete"
         self.complete = True
-        self.pending_items.update(fail_reason=_("Import stopped"))
+        self.fail_pending_items()
         self.save(update_fields=["status", "complete"])
 
     def stop_job(self):
@@ -89,15 +109,54 @@ class ImportJob(models.Model):
         self.status = "stopped"
         self.complete = True
         self.save(update_fields=["status", "complete"])
-        self.pending_items.update(fail_reason=_("Import stopped"))
+        self.fail_pending_items()
 
         # stop starting
         app.control.revoke(self.task_id, terminate=True)
-        tasks = self.pending_items.filter(task_id__isnull=False).values_list(
-            "task_id", flat=True
+        tasks = (
+            self.pending_items.filter(task_id__isnull=False)
+            .values_list("task_id", flat=True)
+            .distinct()
         )
         app.control.revoke(list(tasks))
 
+    def fail_pending_items(self):
+        """nothing more is going to happen to these"""
+        stopped = self.pending_items.update(fail_reason=_("Import stopped"))
+        self.add_to_counts(failed_items=stopped, finished_items=stopped)
+
+    def add_to_counts(self, **counts: int) -> None:
+        """update the counts in the database, without racing other workers"""
+        counts = {field: F(field) + value for field, value in counts.items() if value}
+        if counts:
+            ImportJob.objects.filter(id=self.id).update(**counts)
+
+    def refresh_counts(self):
+        """load the latest counts, or count everything up if they were never kept
+        for this job"""
+        self.refresh_from_db(fields=COUNT_FIELDS)
+        if self.total_items is None:
+            self.reconcile_counts()
+
+    def reconcile_counts(self):
+        """count the items again, in case the counts are missing or have drifted"""
+        finished = Q(book__isnull=False) | Q(fail_reason__isnull=False)
+        counts = self.items.aggregate(
+            total_items=Count("id"),
+            succeeded_items=Count("id", filter=Q(book__isnull=False)),
+            failed_items=Count("id", filter=Q(fail_reason__isnull=False)),
+            finished_items=Count("id", filter=finished),
+        )
+        for field, value in counts.items():
+            setattr(self, field, value)
+        self.save(update_fields=COUNT_FIELDS)
+
+    def get_count(self, field):
+        """a count, making sure this job has them"""
+        if getattr(self, field) is None:
+            self.reconcile_counts()
+        return getattr(self, field)
+
     @property
     def pending_items(self):
         """items that haven't been processed yet"""
@@ -106,7 +165,7 @@ class ImportJob(models.Model):
     @property
     def item_count(self):
         """How many books do you want to import???"""
-        return self.items.count()
+        return self.get_count("total_items")
 
     @property
     def percent_complete(self):
@@ -119,17 +178,42 @@ class ImportJob(models.Model):
     @property
     def pending_item_count(self):
         """And how many pending items??"""
-        return self.pending_items.count()
+        return self.get_count("total_items") - self.get_count("finished_items")
 
     @property
     def successful_item_count(self):
         """How many found a book?"""
-        return self.items.filter(book__isnull=False).count()
+        return self.get_count("succeeded_items")
 
     @property
     def failed_item_count(self):
         """How many found a book?"""
-        return self.items.filter(fail_reason__isnull=False).count()
+        return self.get_count("failed_items")
+
+
+COUNT_FIELDS = ["total_items", "succeeded_items", "failed_items", "finished_items"]
+
+
+def update_item_counts(items: Iterable["ImportItem"]) -> None:
+    """add items that were just saved to their jobs' counts"""
+    changes = defaultdict(Counter)
+    for item in items:
+        # items that weren't loaded from the database are new
+        old_state = getattr(item, "_saved_state", None)
+        new_state = item.get_state()
+        if old_state == new_state:
+            continue
+        counts = changes[item.job_id]
+        if old_state is None:
+            counts["total_items"] += 1
+            old_state = (False, False)
+        counts["succeeded_items"] += new_state[0] - old_state[0]
+        counts["failed_items"] += new_state[1] - old_state[1]
+        counts["finished_items"] += any(new_state) - any(old_state)
+        item._saved_state = new_state  # pylint: disable=protected-access
+
+    for job_id, counts in changes.items():
+        ImportJob(id=job_id).add_to_counts(**counts)
 
 
 class ImportItem(models.Model):
@@ -153,6 +237,24 @@ class ImportItem(models.Model):
     )
     task_id = models.CharField(max_length=200, null=True, blank=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """remember what state the item was in, to keep the job's counts"""
+        instance = super().from_db(db, field_names, values)
+        if "book_id" in instance.__dict__ and "fail_reason" in instance.__dict__:
+            # pylint: disable=protected-access
+            instance._saved_state = instance.get_state()
+        return instance
+
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        """keep the job's counts up to date"""
+        super().save(*args, **kwargs)
+        update_item_counts([self])
+
+    def get_state(self) -> tuple[bool, bool]:
+        """whether the item has found a book, and whether it has failed"""
+        return (self.book_id is not None, self.fail_reason is not None)
+
     def update_job(self):
         """let the job know when the items get work done"""
         job = self.job
@@ -160,8 +262,9 @@ class ImportItem(models.Model):
             return
 
         job.updated_date = timezone.now()
-        job.save()
-        if not job.pending_items.exists() and not job.complete:
+        job.save(update_fields=["updated_date"])
+        job.refresh_counts()
+        if not job.pending_item_count and not job.complete:
             job.complete_job()
 
     def resolve(self):
@@ -325,7 +428,7 @@ class ImportItem(models.Model):
 
 @app.task(queue=IMPORTS)
 def start_import_task(job_id):
-    """trigger the child tasks for each row"""
+    """start working through the rows a chunk at a time"""
     job = ImportJob.objects.get(id=job_id)
     job.status = "active"
     job.save(update_fields=["status"])
@@ -333,13 +436,114 @@ def start_import_task(job_id):
     if job.complete:
         return
 
-    # these are sub-tasks so that one big task doesn't use up all the memory in celery
-    for item in job.items.all():
-        task = import_item_task.delay(item.id)
-        item.task_id = task.id
-        item.save()
-    job.status = "active"
-    job.save()
+    # each of these tasks takes a chunk of rows and then queues the next one,
+    # so a big import is a handful of tasks on the queue at a time
+    chunks = math.ceil(job.pending_items.count() / IMPORT_CHUNK_SIZE)
+    for _ in range(min(chunks, IMPORT_USER_CONCURRENCY)):
+        import_chunk_task.delay(job.id)
+
+
+def get_import_slot(user_id):
+    """each user can only have a few chunks being imported at once, so that one
+    big import doesn't hold up everyone else's"""
+    for slot in range(IMPORT_USER_CONCURRENCY):
+        slot_key = f"import-slot-{user_id}-{slot}"
+        # the slot expires in case the worker goes away mid-chunk
+        if cache.add(slot_key, 1, timeout=60 * 15):
+            return slot_key
+    return None
+
+
+@app.task(queue=IMPORTS)
+def import_chunk_task(job_id):
+    """resolve a chunk of rows into books"""
+    job = ImportJob.objects.select_related("user").get(id=job_id)
+    # make sure the job has not been stopped
+    if job.complete:
+        return
+
+    slot_key = get_import_slot(job.user_id)
+    if not slot_key:
+        # come back when one of the user's other chunks is done
+        import_chunk_task.apply_async(args=(job_id,), countdown=30)
+        return
+
+    try:
+        # claim the rows, so that other chunks of this job leave them alone
+        with transaction.atomic():
+            item_ids = list(
+                job.pending_items.filter(task_id__isnull=True)
+                .select_for_update(skip_locked=True)
+                .order_by("index")
+                .values_list("id", flat=True)[:IMPORT_CHUNK_SIZE]
+            )
+            ImportItem.objects.filter(id__in=item_ids).update(
+                task_id=import_chunk_task.request.id
+            )
+        items = list(ImportItem.objects.filter(id__in=item_ids).order_by("index"))
+        for item in items:
+            item.job = job
+        import_items(items)
+    finally:
+        cache.delete(slot_key)
+
+    # the job may have been stopped while this chunk was running
+    job.refresh_from_db(fields=["complete"])
+    if job.complete:
+        return
+    job.updated_date = timezone.now()
+    job.save(update_fields=["updated_date"])
+    job.refresh_counts()
+    if not job.pending_item_count:
+        job.complete_job()
+    elif items:
+        import_chunk_task.delay(job_id)
+
+
+def import_items(items):
+    """resolve and shelve rows, saving them all at the end"""
+    find_local_books(items)
+    for item in items:
+        try:
+            item.resolve()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Error loading book for import item %s", item.id)
+            item.fail_reason = _("Error loading book")
+            continue
+
+        if not item.book:
+            item.fail_reason = _("Could not find a match for book")
+
+    # shelves books and handles reviews
+    handle_imported_books([item for item in items if item.book])
+    ImportItem.objects.bulk_update(
+        items, ["book", "book_guess", "fail_reason", "linked_review"]
+    )
+    update_item_counts(items)
+
+
+def find_local_books(items):
+    """look up the isbns of a chunk that are already in the database in one go,
+    instead of searching for each one"""
+    isbns = {}
+    for item in items:
+        if item.book or not item.isbn:
+            continue
+        isbn = item.isbn
+        if maybe_isbn(isbn):
+            isbn = isbn.strip().upper().rjust(10, "0")
+        isbns.setdefault(isbn, []).append(item)
+    if not isbns:
+        return
+
+    editions = Edition.objects.filter(
+        Q(isbn_10__in=isbns.keys()) | Q(isbn_13__in=isbns.keys())
+    ).order_by("-id")
+    for edition in editions:
+        # ordered so the oldest matching edition is the one that's kept
+        for isbn in (edition.isbn_10, edition.isbn_13):
+            for item in isbns.get(isbn, []):
+                item.book = edition
 
 
 @app.task(queue=IMPORTS)
@@ -375,14 +579,11 @@ def handle_imported_book(item):
         return
 
     user = job.user
-    if isinstance(item.book, Work):
-        item.book = item.book.default_edition
+    item.book = get_import_edition(item.book)
     if not item.book:
         item.fail_reason = _("Error loading book")
         item.save()
         return
-    if not isinstance(item.book, Edition):
-        item.book = item.book.edition
 
     existing_shelf = ShelfBook.objects.filter(book=item.book, user=user).exists()
 
@@ -412,11 +613,7 @@ def handle_imported_book(item):
         # but "now" is a bad guess
         published_date_guess = item.date_read or item.date_added
         if item.review:
-            # pylint: disable=consider-using-f-string
-            review_title = "Review of {!r} on {!r}".format(
-                item.book.title,
-                job.source,
-            )
+            review_title = get_review_title(item)
             review = Review.objects.filter(
                 user=user,
                 book=item.book,
@@ -456,3 +653,195 @@ def handle_imported_book(item):
         # only broadcast this review to other bookwyrm instances
         item.linked_review = review
     item.save()
+
+
+def get_import_edition(book):
+    """the edition to shelve for the book a row matched"""
+    if isinstance(book, Work):
+        return book.default_edition
+    if book and not isinstance(book, Edition):
+        return book.edition
+    return book
+
+
+def get_review_title(item):
+    """what imported reviews are called"""
+    # pylint: disable=consider-using-f-string
+    return "Review of {!r} on {!r}".format(item.book.title, item.job.source)
+
+
+def handle_imported_books(items):
+    """shelve a chunk of rows and post about them. what the user already has is
+    looked up once for the whole chunk, new rows are created together, and
+    the streams and other servers hear about the chunk all at once"""
+    if not items or items[0].job.complete:
+        return
+    job = items[0].job
+
+    for item in items:
+        item.book = get_import_edition(item.book)
+        if not item.book:
+            item.fail_reason = _("Error loading book")
+    items = [item for item in items if item.book]
+
+    # activities to send, and the servers to send them to
+    activities = shelve_imported_books(job.user, items)
+    create_imported_reads(job.user, items)
+    if job.include_reviews:
+        activities += create_imported_reviews(job, items)
+
+    if activities:
+        broadcast_many_task.apply_async(
+            args=(
+                job.user.id,
+                [
+                    (json.dumps(activity, cls=ActivityEncoder), recipients)
+                    for activity, recipients in activities
+                ],
+            ),
+            queue=IMPORT_TRIGGERED,
+        )
+
+
+def shelve_imported_books(user, items):
+    """shelve the books that haven't been shelved already. returns the
+    activities for the new shelf books"""
+    books = {item.book.id: item.book for item in items}
+    shelves = {shelf.identifier: shelf for shelf in Shelf.objects.filter(user=user)}
+    shelved = set(
+        ShelfBook.objects.filter(user=user, book__in=books).values_list(
+            "book", flat=True
+        )
+    )
+    shelved_works = set(
+        ShelfBook.objects.filter(
+            user=user, book__parent_work__in={b.parent_work_id for b in books.values()}
+        ).values_list("book__parent_work", flat=True)
+    )
+    shelf_books = []
+    for item in items:
+        if not item.shelf or item.book.id in shelved or item.shelf not in shelves:
+            continue
+        shelved.add(item.book.id)
+        shelf_books.append(
+            ShelfBook(
+                book=item.book,
+                shelf=shelves[item.shelf],
+                user=user,
+                shelved_date=item.date_added or timezone.now(),
+            )
+        )
+    if not shelf_books:
+        return []
+
+    ShelfBook.objects.bulk_create(shelf_books)
+    for shelf_book in shelf_books:
+        shelf_book.remote_id = shelf_book.get_remote_id()
+    ShelfBook.objects.bulk_update(shelf_books, ["remote_id"])
+    for shelf in {shelf_book.shelf for shelf_book in shelf_books}:
+        shelf.clear_activity_cache()
+
+    # the books stream only needs statuses for works that are new to the user
+    new_works = {}
+    for shelf_book in shelf_books:
+        if shelf_book.book.parent_work_id not in shelved_works:
+            new_works.setdefault(shelf_book.book.parent_work_id, shelf_book.book.id)
+    if new_works:
+        # pylint: disable-next=import-outside-toplevel
+        from bookwyrm.activitystreams import add_books_statuses_task  # circular
+
+        add_books_statuses_task.delay(user.id, list(new_works.values()))
+
+    return [
+        (
+            shelf_book.to_add_activity(user),
+            shelf_book.get_recipients(software="bookwyrm"),
+        )
+        for shelf_book in shelf_books
+    ]
+
+
+def create_imported_reads(user, items):
+    """add readthroughs, unless there's one with the same dates"""
+    read_dates = set(
+        ReadThrough.objects.filter(
+            user=user, book__in={item.book.id for item in items}
+        ).values_list("book", "start_date", "finish_date")
+    )
+    reads = []
+    for item in items:
+        for read in item.reads:
+            dates = (item.book.id, read.start_date, read.finish_date)
+            if dates in read_dates:
+                continue
+            read_dates.add(dates)
+            read.book = item.book
+            read.user = user
+            read.is_active = not (read.finish_date or read.stopped_date)
+            reads.append(read)
+    if not reads:
+        return
+
+    ReadThrough.objects.bulk_create(reads)
+    cache.delete_many(
+        [f"latest_read_through-{user.id}-{read.book_id}" for read in reads]
+    )
+    user.update_active_date()
+
+
+def create_imported_reviews(job, items):
+    """link rows to their reviews and ratings, creating the ones that don't
+    exist yet. returns the activities for the new ones"""
+    items = [
+        item
+        for item in items
+        if (item.rating or item.review) and not item.linked_review
+    ]
+    if not items:
+        return []
+    books = {item.book.id for item in items}
+    # a rating is a kind of review, so this finds both
+    existing = {}
+    for review in Review.objects.filter(
+        user=job.user, book__in=books, deleted=False
+    ).select_related("reviewrating"):
+        rating = float(review.rating) if review.rating is not None else None
+        if hasattr(review, "reviewrating"):
+            key = (review.book_id, None, rating, review.published_date)
+        else:
+            key = (review.book_id, review.name, rating, review.published_date)
+        existing.setdefault(key, review)
+
+    activities = []
+    for item in items:
+        # we don't know the publication date of the review,
+        # but "now" is a bad guess
+        published_date_guess = item.date_read or item.date_added
+        name = get_review_title(item) if item.review else None
+        key = (item.book.id, name, item.rating, published_date_guess)
+        if key not in existing:
+            review = ReviewRating(
+                user=job.user,
+                book=item.book,
+                rating=item.rating,
+                published_date=published_date_guess,
+                privacy=job.privacy,
+            )
+            if item.review:
+                review = Review(
+                    user=job.user,
+                    book=item.book,
+                    name=name,
+                    content=item.review,
+                    rating=item.rating,
+                    published_date=published_date_guess,
+                    privacy=job.privacy,
+                )
+            review.save(broadcast=False)
+            # only broadcast this review to other bookwyrm instances
+            activity = review.to_create_activity(job.user)
+            review.prime_activity_cache(activity.get("object"))
+            activities.append((activity, review.get_recipients(software="bookwyrm")))
+            existing[key] = review
+        item.linked_review = existing[key]
+    return activities
@@ -0,0 +1,131 @@
+""" the reviews and ratings of a work, counted as they come in """
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.apps import apps
+from django.contrib.postgres.fields import ArrayField
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Count
+
+# the reviews that anyone can see are the ones that are counted
+COUNTED_PRIVACY = ("public", "unlisted")
+# ratings go from half a star to five stars
+HISTOGRAM_SIZE = 10
+
+
+def empty_histogram():
+    """no ratings of any number of stars"""
+    return [0] * HISTOGRAM_SIZE
+
+
+class WorkRatingStats(models.Model):
+    """how many reviews and ratings a work has, across all its editions"""
+
+    work = models.OneToOneField(
+        "Work", on_delete=models.CASCADE, primary_key=True, related_name="rating_stats"
+    )
+    review_count = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.DecimalField(default=0, decimal_places=2, max_digits=12)
+    # how many ratings there are of each half star
+    histogram = ArrayField(
+        models.IntegerField(), size=HISTOGRAM_SIZE, default=empty_histogram
+    )
+    # the average, stored so that books can be sorted by it
+    rating = models.DecimalField(null=True, decimal_places=2, max_digits=3)
+
+    @classmethod
+    def get_for_work(cls, work_id):
+        """the stats for a work, which are empty if it's never been reviewed"""
+        return cls.objects.filter(work_id=work_id).first() or cls(work_id=work_id)
+
+    def add(self, rating, count=1):
+        """count a review (or take it away, with a negative count)"""
+        self.review_count += count
+        if rating:
+            self.rating_count += count
+            self.rating_sum += rating * count
+            self.histogram[get_histogram_index(rating)] += count
+
+        self.rating = None
+        if self.rating_count > 0:
+            self.rating = (self.rating_sum / self.rating_count).quantize(
+                Decimal("0.01"), rounding=ROUND_HALF_UP
+            )
+
+    def save(self, *args, **kwargs):
+        """the cached rating is out of date once this is committed"""
+        super().save(*args, **kwargs)
+        cache_key = f"book-rating-{self.work_id}"
+        transaction.on_commit(lambda: cache.delete(cache_key))
+
+
+def get_histogram_index(rating):
+    """which half star a rating counts towards"""
+    index = int((rating * 2).to_integral_value(rounding=ROUND_HALF_UP)) - 1
+    return min(max(index, 0), HISTOGRAM_SIZE - 1)
+
+
+def get_counted_review(review_id):
+    """the work a saved review counts towards, and its rating, if it counts"""
+    review_model = apps.get_model("bookwyrm.Review", require_ready=True)
+    return (
+        review_model.objects.filter(
+            id=review_id,
+            deleted=False,
+            privacy__in=COUNTED_PRIVACY,
+            book__parent_work__isnull=False,
+        )
+        .values_list("book__parent_work", "rating")
+        .first()
+    )
+
+
+def update_rating_stats(old, new):
+    """move a review from where it was counted to where it's counted now"""
+    if old == new:
+        return
+    changes = [(*old, -1)] if old else []
+    changes += [(*new, 1)] if new else []
+
+    with transaction.atomic():
+        # lock the rows in the same order every time, so saves can't deadlock
+        for work_id in sorted({change[0] for change in changes}):
+            stats, _ = WorkRatingStats.objects.select_for_update().get_or_create(
+                work_id=work_id
+            )
+            for change_work_id, rating, count in changes:
+                if change_work_id == work_id:
+                    stats.add(rating, count)
+            stats.save()
+
+
+def refresh_rating_stats(work_ids=None):
+    """count up the reviews of these works (or every work) from scratch.
+    returns how many works have been reviewed"""
+    review_model = apps.get_model("bookwyrm.Review", require_ready=True)
+    work_model = apps.get_model("bookwyrm.Work", require_ready=True)
+    reviews = review_model.objects.filter(
+        deleted=False, privacy__in=COUNTED_PRIVACY, book__parent_work__isnull=False
+    )
+    works = work_model.objects.all()
+    if work_ids is not None:
+        reviews = reviews.filter(book__parent_work__in=work_ids)
+        works = works.filter(id__in=work_ids)
+
+    counts = (
+        reviews.values_list("book__parent_work", "rating")
+        .annotate(Count("id"))
+        .order_by("book__parent_work")
+    )
+    stats = {}
+    for work_id, rating, count in counts.iterator():
+        stats.setdefault(work_id, WorkRatingStats(work_id=work_id)).add(rating, count)
+
+    with transaction.atomic():
+        WorkRatingStats.objects.filter(work__in=works).exclude(
+            work__in=stats.keys()
+        ).delete()
+        for work_stats in stats.values():
+            work_stats.save()
+    return len(stats)
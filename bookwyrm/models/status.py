@@ -4,7 +4,6 @@ from typing import Optional
 import re
 
 from django.apps import apps
-from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
@@ -18,11 +17,13 @@ from model_utils import FieldTracker
 from model_utils.managers import InheritanceManager
 
 from bookwyrm import activitypub
-from bookwyrm.preview_images import generate_edition_preview_image_task
+from bookwyrm.preview_images import queue_edition_preview_image
 from bookwyrm.settings import ENABLE_PREVIEW_IMAGES
 from .activitypub_mixin import ActivitypubMixin, ActivityMixin
 from .activitypub_mixin import OrderedCollectionPageMixin
 from .base_model import BookWyrmModel
+from .rating_stats import get_counted_review, refresh_rating_stats
+from .rating_stats import update_rating_stats
 from .readthrough import ProgressMode
 from . import fields
 
@@ -88,7 +89,10 @@ class Status(OrderedCollectionPageMixin, BookWyrmModel):
 
         super().save(*args, **kwargs)
 
-        if not self.reply_parent:
+        if self.reply_parent:
+            # the parent's replies collection has changed
+            self.reply_parent.clear_activity_cache()
+        else:
             self.thread_id = self.id
             super().save(broadcast=False, update_fields=["thread_id"])
 
@@ -454,10 +458,10 @@ class Review(BookStatus):
     pure_type = "Article"
 
     def save(self, *args, **kwargs):
-        """clear rating caches"""
-        if self.book.parent_work:
-            cache.delete(f"book-rating-{self.book.parent_work.id}")
+        """update the rating stats of the work, as this is counted now"""
+        counted = get_counted_review(self.id) if self.id else None
         super().save(*args, **kwargs)
+        update_rating_stats(counted, get_counted_review(self.id))
 
 
 class ReviewRating(Review):
@@ -536,5 +540,28 @@ def preview_image(instance, sender, *args, **kwargs):
     changed_fields = instance.field_tracker.changed()
 
     if len(changed_fields) > 0:
-        edition = instance.book
-        generate_edition_preview_image_task.delay(edition.id)
+        # every edition shows the rating of the whole work
+        edition_ids = (
+            apps.get_model("bookwyrm.Edition", require_ready=True)
+            .objects.filter(parent_work__editions=instance.book_id)
+            .values_list("id", flat=True)
+        )
+        for edition_id in edition_ids or [instance.book_id]:
+            queue_edition_preview_image(edition_id)
+
+
+# pylint: disable=unused-argument
+@receiver(models.signals.post_delete)
+def recount_rating_stats(instance, sender, *args, **kwargs):
+    """a review that's really deleted (and not just marked deleted) is gone
+    from its work's stats"""
+    if sender not in (Review, ReviewRating):
+        return
+    work_id = (
+        apps.get_model("bookwyrm.Edition", require_ready=True)
+        .objects.filter(id=instance.book_id)
+        .values_list("parent_work", flat=True)
+        .first()
+    )
+    if work_id:
+        refresh_rating_stats([work_id])
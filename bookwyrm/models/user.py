@@ -99,6 +99,8 @@ class User(OrderedCollectionPageMixin, AbstractUser):
     preview_image = models.ImageField(
         upload_to="previews/avatars/", blank=True, null=True
     )
+    # a hash of what went into the preview image, to tell if it's out of date
+    preview_image_fingerprint = models.CharField(max_length=64, blank=True, null=True)
     followers_url = fields.CharField(max_length=255, activitypub_field="followers")
     followers = models.ManyToManyField(
         "self",
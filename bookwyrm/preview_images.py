@@ -1,4 +1,7 @@
 """ Generate social media preview images for twitter/mastodon/etc """
+from functools import cache, lru_cache
+import hashlib
+import json
 import math
 import os
 import textwrap
@@ -10,12 +13,13 @@ import colorsys
 from colorthief import ColorThief
 from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageColor
 
+from django.core.cache import cache as django_cache
 from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.core.files.storage import default_storage
-from django.db.models import Avg
 
 from bookwyrm import models, settings
+from bookwyrm.redis_store import r
 from bookwyrm.tasks import app, IMAGES
 
 logger = logging.getLogger(__name__)
@@ -33,6 +37,14 @@ gutter = math.floor(margin / 2)
 inner_img_height = math.floor(IMG_HEIGHT * 0.8)
 inner_img_width = math.floor(inner_img_height * 0.7)
 
+# how small a copy of a cover its color is worked out from
+COLOR_SAMPLE_SIZE = 100
+# how long to remember the color of a cover, in seconds
+COLOR_CACHE_TTL = 60 * 60 * 24 * 30
+
+# fonts, icons and the parts of the image that don't change from one preview
+# to the next are kept around for as long as the worker process runs
+
 
 def get_imagefont(name, size):
     """Loads an ImageFont based on config"""
@@ -48,6 +60,7 @@ def get_imagefont(name, size):
     return ImageFont.load_default()
 
 
+@lru_cache(maxsize=None)
 def get_font(weight, size=28):
     """Gets a custom font with the given weight and size"""
     font = get_imagefont(DEFAULT_FONT, size)
@@ -167,14 +180,22 @@ def generate_texts_layer(texts, content_width):
     return text_layer.crop(text_layer_box)
 
 
-def generate_instance_layer(content_width):
+def generate_instance_layer(content_width, site=None):
     """Places components for instance preview"""
-    font_instance = get_font("light", size=28)
+    site = site or models.SiteSettings.objects.get()
+    # the layer only has to be drawn again if the site's name or logo changes
+    return get_instance_layer(content_width, site.name, site.logo_small.name or None)
 
-    site = models.SiteSettings.objects.get()
 
-    if site.logo_small:
-        logo_img = Image.open(site.logo_small)
+@lru_cache(maxsize=8)
+def get_instance_layer(content_width, site_name, logo_name):
+    """the site's logo and name"""
+    font_instance = get_font("light", size=28)
+
+    if logo_name:
+        with default_storage.open(logo_name) as logo_file:
+            logo_img = Image.open(logo_file)
+            logo_img.load()
     else:
         try:
             static_path = os.path.join(settings.STATIC_ROOT, "images/logo-small.png")
@@ -195,10 +216,10 @@ def generate_instance_layer(content_width):
 
     instance_layer_draw = ImageDraw.Draw(instance_layer)
     instance_layer_draw.text(
-        (instance_text_x, 10), site.name, font=font_instance, fill=TEXT_COLOR
+        (instance_text_x, 10), site_name, font=font_instance, fill=TEXT_COLOR
     )
 
-    line_width = 50 + 10 + round(font_instance.getlength(site.name))
+    line_width = 50 + 10 + round(font_instance.getlength(site_name))
 
     line_layer = Image.new(
         "RGBA", (line_width, 2), color=(*(ImageColor.getrgb(TEXT_COLOR)), 50)
@@ -208,21 +229,26 @@ def generate_instance_layer(content_width):
     return instance_layer
 
 
-def generate_rating_layer(rating, content_width):
-    """Places components for rating preview"""
+@cache
+def get_star_icons():
+    """the full, empty and half star icons"""
     try:
-        icon_star_full = Image.open(
-            os.path.join(settings.STATIC_ROOT, "images/icons/star-full.png")
-        )
-        icon_star_empty = Image.open(
-            os.path.join(settings.STATIC_ROOT, "images/icons/star-empty.png")
-        )
-        icon_star_half = Image.open(
-            os.path.join(settings.STATIC_ROOT, "images/icons/star-half.png")
+        return tuple(
+            Image.open(
+                os.path.join(settings.STATIC_ROOT, f"images/icons/star-{name}.png")
+            )
+            for name in ("full", "empty", "half")
         )
     except FileNotFoundError:
         return None
 
+
+def generate_rating_layer(rating, content_width):
+    """Places components for rating preview"""
+    if not (icons := get_star_icons()):
+        return None
+    icon_star_full, icon_star_empty, icon_star_half = icons
+
     icon_size = 64
     icon_margin = 10
 
@@ -258,6 +284,7 @@ def generate_rating_layer(rating, content_width):
     return rating_layer_composite
 
 
+@cache
 def generate_default_inner_img():
     """Adds cover image"""
     font_cover = get_font("light", size=28)
@@ -283,18 +310,20 @@ def generate_default_inner_img():
 # pylint: disable=too-many-locals
 # pylint: disable=too-many-statements
 def generate_preview_image(
-    texts=None, picture=None, rating=None, show_instance_layer=True
+    texts=None, picture=None, rating=None, show_instance_layer=True, site=None
 ):
     """Puts everything together"""
     texts = texts or {}
     # Cover
     try:
-        inner_img_layer = Image.open(picture)
+        picture_data = read_picture(picture)
+        inner_img_layer = Image.open(BytesIO(picture_data))
         inner_img_layer.thumbnail(
             (inner_img_width, inner_img_height), Image.Resampling.LANCZOS
         )
-        color_thief = ColorThief(picture)
-        dominant_color = color_thief.get_color(quality=1)
+        dominant_color = get_dominant_color(
+            inner_img_layer, hashlib.sha256(picture_data).hexdigest()
+        )
     except:  # pylint: disable=bare-except
         inner_img_layer = generate_default_inner_img()
         dominant_color = ImageColor.getrgb(DEFAULT_COVER_COLOR)
@@ -339,7 +368,7 @@ def generate_preview_image(
     contents_composite_y = 0
 
     if show_instance_layer:
-        instance_layer = generate_instance_layer(content_width)
+        instance_layer = generate_instance_layer(content_width, site=site)
         contents_layer.alpha_composite(instance_layer, (0, contents_composite_y))
         contents_composite_y = contents_composite_y + instance_layer.height + gutter
 
@@ -376,7 +405,162 @@ def generate_preview_image(
     return img.convert("RGB")
 
 
-def save_and_cleanup(image, instance=None):
+def read_picture(picture):
+    """the contents of an image, from a file field or a path"""
+    if isinstance(picture, bytes):
+        return picture
+    if isinstance(picture, (str, os.PathLike)):
+        with open(picture, "rb") as picture_file:
+            return picture_file.read()
+    picture.open("rb")
+    try:
+        return picture.read()
+    finally:
+        picture.close()
+
+
+def get_dominant_color(image, file_hash):
+    """the main color of an image, worked out from a small copy of it. this is
+    slow, so it's remembered for each file"""
+    cache_key = f"preview-image-color-{file_hash}"
+    if color := django_cache.get(cache_key):
+        return tuple(color)
+
+    sample = image.convert("RGB")
+    sample.thumbnail((COLOR_SAMPLE_SIZE, COLOR_SAMPLE_SIZE))
+    sample_file = BytesIO()
+    sample.save(sample_file, format="PNG")
+    color = ColorThief(sample_file).get_color(quality=1)
+
+    django_cache.set(cache_key, color, COLOR_CACHE_TTL)
+    return color
+
+
+def get_preview_fingerprint(site, texts, picture, rating=None):
+    """a hash of everything that goes into a preview image, to tell whether
+    it has to be drawn again"""
+    picture_name = getattr(picture, "name", picture) or None
+    inputs = [
+        texts,
+        str(picture_name) if picture_name else None,
+        rating,
+        site.name,
+        site.logo_small.name or None,
+        [IMG_WIDTH, IMG_HEIGHT, BG_COLOR, TEXT_COLOR, DEFAULT_COVER_COLOR],
+        DEFAULT_FONT,
+    ]
+    return hashlib.sha256(json.dumps(inputs, default=str).encode("utf-8")).hexdigest()
+
+
+def get_ratings(book_ids):
+    """the average rating of the work each of these books belongs to"""
+    return dict(
+        models.Edition.objects.filter(id__in=book_ids).values_list(
+            "id", "parent_work__rating_stats__rating"
+        )
+    )
+
+
+def get_edition_preview_inputs(book, rating):
+    """what goes into a book's preview image"""
+    return {
+        "texts": {
+            "text_one": book.title,
+            "text_two": book.subtitle,
+            "text_three": book.author_text,
+        },
+        "picture": book.cover,
+        "rating": get_star_rating(rating),
+    }
+
+
+def get_star_rating(rating):
+    """a rating the way it's drawn, in whole and half stars, so that a change
+    to the average that doesn't change the stars doesn't change the image"""
+    if not rating:
+        return None
+    return math.floor(rating) + (0.5 if rating % 1 else 0)
+
+
+def get_user_preview_inputs(user):
+    """what goes into a user's preview image"""
+    if user.avatar:
+        avatar = user.avatar
+    else:
+        avatar = os.path.join(settings.STATIC_ROOT, "images/default_avi.jpg")
+    return {
+        "texts": {
+            "text_one": user.display_name,
+            "text_three": f"@{user.localname}@{settings.DOMAIN}",
+        },
+        "picture": avatar,
+    }
+
+
+def is_preview_current(instance, fingerprint):
+    """whether the preview image was drawn from the same inputs"""
+    return bool(
+        instance.preview_image and instance.preview_image_fingerprint == fingerprint
+    )
+
+
+def render_preview_image(inputs):
+    """draw a preview image as a jpeg. this runs in a worker process in batch
+    mode, so it's given everything it needs and doesn't use the database"""
+    image = generate_preview_image(**inputs)
+    image_buffer = BytesIO()
+    image.save(image_buffer, format="jpeg", quality=75)
+    return image_buffer.getvalue()
+
+
+def generate_preview_images_batch(model, previews, executor):
+    """draw preview images for a batch of books or users in worker processes,
+    skipping those that are up to date, and store them together.
+    previews is a dict of the objects and the inputs for their images"""
+    if not previews:
+        return 0
+    site = models.SiteSettings.objects.get()
+    changed = {}
+    for instance, inputs in previews.items():
+        fingerprint = get_preview_fingerprint(site, **inputs)
+        if not is_preview_current(instance, fingerprint):
+            changed[instance] = fingerprint
+
+    render_inputs = []
+    for instance in changed:
+        inputs = previews[instance]
+        try:
+            picture = read_picture(inputs["picture"]) if inputs["picture"] else None
+        except (OSError, ValueError):
+            picture = None
+        render_inputs.append(dict(inputs, picture=picture, site=site))
+
+    for (instance, fingerprint), image_data in zip(
+        changed.items(), executor.map(render_preview_image, render_inputs)
+    ):
+        store_preview_image(instance, image_data)
+        instance.preview_image_fingerprint = fingerprint
+
+    model.objects.bulk_update(changed, ["preview_image", "preview_image_fingerprint"])
+    return len(changed)
+
+
+def store_preview_image(instance, image_data):
+    """put a preview image in storage in place of the old one, without saving
+    the object it belongs to"""
+    try:
+        file_name = instance.preview_image.name
+    except ValueError:
+        file_name = None
+
+    if file_name and default_storage.exists(file_name):
+        default_storage.delete(file_name)
+
+    file_name = os.path.basename(file_name or f"{instance.id}-{uuid4()}.jpg")
+    instance.preview_image.save(file_name, ContentFile(image_data), save=False)
+
+
+def save_and_cleanup(image, instance=None, fingerprint=None):
     """Save and close the file"""
     if not isinstance(instance, (models.Book, models.User, models.SiteSettings)):
         return False
@@ -408,11 +592,16 @@ def save_and_cleanup(image, instance=None):
             None,
         )
 
+        update_fields = ["preview_image"]
+        if fingerprint:
+            instance.preview_image_fingerprint = fingerprint
+            update_fields.append("preview_image_fingerprint")
+
         save_without_broadcast = isinstance(instance, (models.Book, models.User))
         if save_without_broadcast:
-            instance.save(broadcast=False, update_fields=["preview_image"])
+            instance.save(broadcast=False, update_fields=update_fields)
         else:
-            instance.save(update_fields=["preview_image"])
+            instance.save(update_fields=update_fields)
 
     finally:
         image_buffer.close()
@@ -444,30 +633,42 @@ def generate_site_preview_image_task():
     save_and_cleanup(image, instance=site)
 
 
+def get_pending_key(book_id):
+    """marks a book whose preview is waiting to be redrawn"""
+    return f"preview-image-pending-{book_id}"
+
+
+def queue_edition_preview_image(book_id):
+    """redraw a book's preview once its ratings have settled down. ratings
+    that come in while it's waiting don't queue it again"""
+    # the key expires in case the task is lost, so the book isn't stuck
+    if r.set(
+        get_pending_key(book_id), 1, nx=True, ex=settings.PREVIEW_RATING_DELAY * 10
+    ):
+        generate_edition_preview_image_task.apply_async(
+            args=(book_id,), countdown=settings.PREVIEW_RATING_DELAY
+        )
+
+
 # pylint: disable=invalid-name
 @app.task(queue=IMAGES)
 def generate_edition_preview_image_task(book_id):
     """generate preview_image for a book"""
     if not settings.ENABLE_PREVIEW_IMAGES:
         return
+    # ratings from now on will need another look
+    r.delete(get_pending_key(book_id))
 
     book = models.Book.objects.select_subclasses().get(id=book_id)
 
-    rating = models.Review.objects.filter(
-        privacy="public",
-        deleted=False,
-        book__in=[book_id],
-    ).aggregate(Avg("rating"))["rating__avg"]
-
-    texts = {
-        "text_one": book.title,
-        "text_two": book.subtitle,
-        "text_three": book.author_text,
-    }
+    inputs = get_edition_preview_inputs(book, get_ratings([book_id]).get(book_id))
+    fingerprint = get_preview_fingerprint(models.SiteSettings.objects.get(), **inputs)
+    if is_preview_current(book, fingerprint):
+        return
 
-    image = generate_preview_image(texts=texts, picture=book.cover, rating=rating)
+    image = generate_preview_image(**inputs)
 
-    save_and_cleanup(image, instance=book)
+    save_and_cleanup(image, instance=book, fingerprint=fingerprint)
 
 
 @app.task(queue=IMAGES)
@@ -481,19 +682,14 @@ def generate_user_preview_image_task(user_id):
     if not user.local:
         return
 
-    texts = {
-        "text_one": user.display_name,
-        "text_three": f"@{user.localname}@{settings.DOMAIN}",
-    }
-
-    if user.avatar:
-        avatar = user.avatar
-    else:
-        avatar = os.path.join(settings.STATIC_ROOT, "images/default_avi.jpg")
+    inputs = get_user_preview_inputs(user)
+    fingerprint = get_preview_fingerprint(models.SiteSettings.objects.get(), **inputs)
+    if is_preview_current(user, fingerprint):
+        return
 
-    image = generate_preview_image(texts=texts, picture=avatar)
+    image = generate_preview_image(**inputs)
 
-    save_and_cleanup(image, instance=user)
+    save_and_cleanup(image, instance=user, fingerprint=fingerprint)
 
 
 @app.task(queue=IMAGES)
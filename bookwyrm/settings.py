@@ -68,6 +68,8 @@ PREVIEW_IMG_WIDTH = env.int("PREVIEW_IMG_WIDTH", 1200)
 PREVIEW_IMG_HEIGHT = env.int("PREVIEW_IMG_HEIGHT", 630)
 PREVIEW_DEFAULT_COVER_COLOR = env.str("PREVIEW_DEFAULT_COVER_COLOR", "#002549")
 PREVIEW_DEFAULT_FONT = env.str("PREVIEW_DEFAULT_FONT", "Source Han Sans")
+# how long (in seconds) to wait for more ratings before redrawing a book's preview
+PREVIEW_RATING_DELAY = env.int("PREVIEW_RATING_DELAY", 60)
 
 FONTS = {
     "Source Han Sans": {
@@ -242,6 +244,54 @@ SEARCH_TIMEOUT = env.int("SEARCH_TIMEOUT", 8)
 # timeout for a query to an individual connector
 QUERY_TIMEOUT = env.int("INTERACTIVE_QUERY_TIMEOUT", env.int("QUERY_TIMEOUT", 5))
 
+# Federation caches (in seconds)
+# how long to keep the serialized activitypub json of local objects
+ACTIVITY_CACHE_TTL = env.int("ACTIVITY_CACHE_TTL", 60 * 15)
+# how long to keep the total size of collections like outboxes and shelves
+COLLECTION_COUNT_CACHE_TTL = env.int("COLLECTION_COUNT_CACHE_TTL", 60 * 5)
+# how long to remember which object a remote id belongs to
+REMOTE_ID_CACHE_TTL = env.int("REMOTE_ID_CACHE_TTL", 60 * 60 * 24)
+# how long to remember incoming activities so duplicates are dropped
+INBOX_DEDUPLICATION_TTL = env.int("INBOX_DEDUPLICATION_TTL", 60 * 60)
+# how often to recount the users and statuses that nodeinfo reports
+INSTANCE_STATS_TTL = env.int("INSTANCE_STATS_TTL", 60 * 15)
+# how long to keep remote objects that don't say how long they can be cached
+FETCH_CACHE_DEFAULT_TTL = env.int("FETCH_CACHE_DEFAULT_TTL", 60 * 5)
+# the longest we'll keep a remote object without checking back
+FETCH_CACHE_MAX_TTL = env.int("FETCH_CACHE_MAX_TTL", 60 * 60)
+# how long to remember that a remote object is gone
+FETCH_CACHE_NEGATIVE_TTL = env.int("FETCH_CACHE_NEGATIVE_TTL", 60 * 10)
+# the largest response body (in bytes) we'll keep
+FETCH_CACHE_MAX_SIZE = env.int("FETCH_CACHE_MAX_SIZE", 1024 * 512)
+
+# Imports
+# how many rows of an import to work on in one task
+IMPORT_CHUNK_SIZE = env.int("IMPORT_CHUNK_SIZE", 20)
+# how many chunks of one user's imports can be worked on at once
+IMPORT_USER_CONCURRENCY = env.int("IMPORT_USER_CONCURRENCY", 2)
+# how many books from a bookwyrm user import to work on in one task
+USER_IMPORT_CHUNK_SIZE = env.int("USER_IMPORT_CHUNK_SIZE", 25)
+# how many covers a bookwyrm user export downloads at once
+USER_EXPORT_COVER_WORKERS = env.int("USER_EXPORT_COVER_WORKERS", 4)
+
+# Outgoing activities
+# how long (in seconds) to collect activities for a server before sending them
+BROADCAST_DELIVERY_WINDOW = env.int("BROADCAST_DELIVERY_WINDOW", 2)
+# how many requests to have open to one server at once
+BROADCAST_DELIVERY_CONCURRENCY = env.int("BROADCAST_DELIVERY_CONCURRENCY", 4)
+# the most activities to send to a server in one task
+BROADCAST_DELIVERY_BATCH_SIZE = env.int("BROADCAST_DELIVERY_BATCH_SIZE", 200)
+
+# Cover downloads
+# the largest cover image (in bytes) that will be downloaded
+COVER_DOWNLOAD_MAX_SIZE = env.int("COVER_DOWNLOAD_MAX_SIZE", 10 * 1024 * 1024)
+# how long (in seconds) to collect covers before downloading them together
+COVER_DOWNLOAD_WINDOW = env.int("COVER_DOWNLOAD_WINDOW", 2)
+# how many covers to download at once
+COVER_DOWNLOAD_CONCURRENCY = env.int("COVER_DOWNLOAD_CONCURRENCY", 8)
+# the most covers to download in one task
+COVER_DOWNLOAD_BATCH_SIZE = env.int("COVER_DOWNLOAD_BATCH_SIZE", 50)
+
 # Redis cache backend
 if env.bool("USE_DUMMY_CACHE", False):
     CACHES = {
@@ -3,6 +3,7 @@ import hashlib
 from urllib.parse import urlparse
 import datetime
 from base64 import b64encode, b64decode
+from functools import lru_cache
 
 from Crypto import Random
 from Crypto.PublicKey import RSA
@@ -22,6 +23,12 @@ def create_key_pair():
     return private_key, public_key
 
 
+@lru_cache(maxsize=128)
+def load_private_key(private_key):
+    """parsing a key takes tens of milliseconds, so keep the recent ones around"""
+    return RSA.import_key(private_key)
+
+
 def make_signature(method, sender, destination, date, **kwargs):
     """uses a private key to sign an outgoing message"""
     inbox_parts = urlparse(destination)
@@ -37,7 +44,7 @@ def make_signature(method, sender, destination, date, **kwargs):
         headers = "(request-target) host date digest"
 
     message_to_sign = "\n".join(signature_headers)
-    signer = pkcs1_15.new(RSA.import_key(sender.key_pair.private_key))
+    signer = pkcs1_15.new(load_private_key(sender.key_pair.private_key))
     signed_message = signer.sign(SHA256.new(message_to_sign.encode("utf8")))
     # For legacy reasons we need to use an incorrect keyId for older Bookwyrm versions
     key_id = (
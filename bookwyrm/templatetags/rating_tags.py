@@ -1,6 +1,5 @@
 """ template filters """
 from django import template
-from django.db.models import Avg
 
 from bookwyrm import models
 from bookwyrm.utils import cache
@@ -18,12 +17,8 @@ def get_rating(book, user):
 
     return cache.get_or_set(
         f"book-rating-{book.parent_work.id}",
-        lambda u, b: models.Review.objects.filter(
-            book__parent_work__editions=b, rating__gt=0
-        ).aggregate(Avg("rating"))["rating__avg"]
-        or 0,
-        user,
-        book,
+        lambda w: models.WorkRatingStats.get_for_work(w).rating or 0,
+        book.parent_work.id,
         timeout=15552000,
     )
 
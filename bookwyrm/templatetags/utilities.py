@@ -81,6 +81,10 @@ def get_book_cover_thumbnail(book, size="medium", ext="jpg"):
         size = "medium"
     try:
         cover_thumbnail = getattr(book, f"cover_bw_book_{size}_{ext}")
+        if not cover_thumbnail:
+            # the thumbnail is queued to be generated, so until it's ready
+            # the browser can scale down the full size cover
+            return book.cover.url if book.cover else static("images/no_cover.jpg")
         return cover_thumbnail.url
     except OSError:
         return static("images/no_cover.jpg")
@@ -0,0 +1,68 @@
+""" time parsing and serializing activitypub json
+
+run with: ./bw-dev runweb python -m bookwyrm.tests.activitypub.benchmark
+"""
+import argparse
+import json
+import os
+import pathlib
+import timeit
+
+FIXTURES = [
+    "ap_comment.json",
+    "ap_generated_shelve_note.json",
+    "ap_note.json",
+    "ap_quotation.json",
+    "ap_user.json",
+    "bw_edition.json",
+    "bw_work.json",
+]
+DATA_DIR = pathlib.Path(__file__).parent.joinpath("../data")
+
+
+def load_fixtures():
+    """the sample activities used in the tests"""
+    return {name: json.loads(DATA_DIR.joinpath(name).read_bytes()) for name in FIXTURES}
+
+
+def benchmark(activity_json, iterations):
+    """seconds per parse and per serialize for one activity"""
+    # pylint: disable=import-outside-toplevel
+    from bookwyrm import activitypub
+
+    activity = activitypub.parse(activity_json)
+    parse_time = timeit.timeit(
+        lambda: activitypub.parse(activity_json), number=iterations
+    )
+    serialize_time = timeit.timeit(activity.serialize, number=iterations)
+    return parse_time / iterations, serialize_time / iterations
+
+
+def main():
+    """run the benchmarks"""
+    parser = argparse.ArgumentParser(
+        description="Time parsing and serializing the activitypub test fixtures"
+    )
+    parser.add_argument(
+        "--iterations",
+        "-n",
+        type=int,
+        default=10000,
+        help="How many times to parse and serialize each fixture",
+    )
+    iterations = parser.parse_args().iterations
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "bookwyrm.settings")
+    # pylint: disable=import-outside-toplevel
+    import django
+
+    django.setup()
+
+    print(f"{'fixture':<32}{'parse (µs)':>14}{'serialize (µs)':>18}")
+    for name, activity_json in load_fixtures().items():
+        parse_time, serialize_time = benchmark(activity_json, iterations)
+        print(f"{name:<32}{parse_time * 1e6:>14.1f}{serialize_time * 1e6:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
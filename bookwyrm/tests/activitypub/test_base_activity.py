@@ -12,8 +12,10 @@ import responses
 from bookwyrm import activitypub
 from bookwyrm.activitypub.base_activity import (
     ActivityObject,
+    get_parse_plan,
     resolve_remote_id,
     set_related_field,
+    set_related_fields,
     get_representative,
 )
 from bookwyrm.activitypub import ActivitySerializerError
@@ -97,6 +99,29 @@ class BaseActivity(TestCase):
         self.assertEqual(serialized["id"], "a")
         self.assertEqual(serialized["type"], "b")
 
+    def test_serialize_nested(self, *_):
+        """nested activities are serialized too"""
+        activity = activitypub.parse(self.userdata)
+        serialized = activity.serialize()
+        self.assertEqual(serialized["id"], self.userdata["id"])
+        self.assertEqual(
+            serialized["publicKey"]["id"], self.userdata["publicKey"]["id"]
+        )
+        self.assertEqual(
+            serialized["@context"], "https://www.w3.org/ns/activitystreams"
+        )
+
+    def test_get_parse_plan(self, *_):
+        """the dataclass fields are only inspected once"""
+        plan = get_parse_plan(activitypub.Person)
+        self.assertIs(plan, get_parse_plan(activitypub.Person))
+
+        fields = {f.name: f for f in plan}
+        self.assertTrue(fields["id"].required)
+        self.assertFalse(fields["summary"].required)
+        self.assertEqual(fields["publicKey"].serializer, activitypub.PublicKey)
+        self.assertIsNone(fields["name"].serializer)
+
     @responses.activate
     def test_resolve_remote_id(self, *_):
         """look up or load remote data"""
@@ -232,7 +257,7 @@ class BaseActivity(TestCase):
         )
 
         # sets the celery task call to the function call
-        with patch("bookwyrm.activitypub.base_activity.set_related_field.delay"):
+        with patch("bookwyrm.activitypub.base_activity.set_related_fields.delay"):
             with patch("bookwyrm.models.status.Status.ignore_activity") as discarder:
                 discarder.return_value = False
                 update_data.to_model(model=models.Status, instance=status)
@@ -261,3 +286,42 @@ class BaseActivity(TestCase):
 
         self.assertIsInstance(status.attachments.first(), models.Image)
         self.assertIsNotNone(status.attachments.first().image)
+
+    def test_set_related_fields(self, *_):
+        """one task loads every edition of a work"""
+        work = models.Work.objects.create(
+            title="Test Work", remote_id="https://example.com/book/1"
+        )
+        other_work = models.Work.objects.create(
+            title="Other Work", remote_id="https://example.com/book/2"
+        )
+        linked = models.Edition.objects.create(
+            title="Linked", remote_id="https://example.com/book/3", parent_work=work
+        )
+        unlinked = models.Edition.objects.create(
+            title="Unlinked",
+            remote_id="https://example.com/book/4",
+            parent_work=other_work,
+        )
+
+        with patch(
+            "bookwyrm.activitypub.base_activity.set_related_item"
+        ) as mock_set, self.assertLogs(
+            "bookwyrm.activitypub.base_activity", level="ERROR"
+        ):
+            mock_set.side_effect = [None, ValueError()]
+            set_related_fields(
+                "Edition",
+                "Work",
+                "parent_work",
+                work.remote_id,
+                [linked.remote_id, unlinked.remote_id, "https://example.com/book/5"],
+            )
+
+        # the edition that already belongs to the work is skipped, and the
+        # failed one doesn't stop the others
+        self.assertEqual(mock_set.call_count, 2)
+        self.assertEqual(mock_set.call_args_list[0][0][3], unlinked.remote_id)
+        self.assertEqual(mock_set.call_args_list[0][0][4], unlinked)
+        self.assertEqual(mock_set.call_args_list[1][0][3], "https://example.com/book/5")
+        self.assertIsNone(mock_set.call_args_list[1][0][4])
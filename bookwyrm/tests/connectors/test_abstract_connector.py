@@ -114,6 +114,28 @@ class AbstractConnector(TestCase):
         self.assertEqual(models.Edition.objects.count(), 1)
         self.assertEqual(models.Edition.objects.count(), 1)
 
+    @patch("bookwyrm.connectors.abstract_connector.queue_cover")
+    def test_create_edition_from_data_cover(self, mock_queue):
+        """the edition is created without waiting for its cover"""
+        # pylint: disable=attribute-defined-outside-init
+        self.connector.book_mappings.append(Mapping("cover"))
+        work = models.Work.objects.create(title="Test work")
+
+        edition = self.connector.create_edition_from_data(
+            work,
+            {
+                "id": "abc3",
+                "title": "Cover edition",
+                "cover": "https://example.com/covers/1.jpg",
+            },
+        )
+
+        self.assertEqual(edition.title, "Cover edition")
+        self.assertFalse(edition.cover)
+        mock_queue.assert_called_once_with(
+            edition.id, "https://example.com/covers/1.jpg"
+        )
+
     @responses.activate
     def test_get_or_create_author(self):
         """load an author"""
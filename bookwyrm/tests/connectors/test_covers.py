@@ -0,0 +1,150 @@
+""" downloading covers in the background """
+import asyncio
+import json
+import pathlib
+from unittest.mock import patch
+
+from django.core.files import File
+from django.test import TestCase
+
+from bookwyrm import models
+from bookwyrm.connectors import covers
+
+
+class FakeResponse:
+    """just enough of an aiohttp response"""
+
+    def __init__(self, body, status=200, content_length=None):
+        self.body = body
+        self.ok = status < 400  # pylint: disable=invalid-name
+        self.content_length = content_length
+        self.content = self
+
+    async def iter_chunked(self, size):
+        """the body, a bit at a time"""
+        for i in range(0, len(self.body), size):
+            yield self.body[i : i + size]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        return False
+
+
+class FakeSession:
+    """hands out the same response for every request"""
+
+    def __init__(self, response):
+        self.response = response
+        self.urls = []
+
+    def get(self, url):
+        """make a "request" """
+        self.urls.append(url)
+        return self.response
+
+
+@patch("bookwyrm.connectors.covers.r")
+class Covers(TestCase):
+    """streaming covers into files"""
+
+    def setUp(self):
+        """an image to download"""
+        self.image_data = (
+            pathlib.Path(__file__)
+            .parent.joinpath("../../static/images/default_avi.jpg")
+            .read_bytes()
+        )
+
+    def test_image_download(self, _):
+        """an image is kept"""
+        image = covers.ImageDownload()
+        self.assertTrue(image.write(self.image_data[:10]))
+        self.assertTrue(image.write(self.image_data[10:]))
+        content, extension = image.result()
+        self.assertEqual(extension, "jpeg")
+        self.assertEqual(content.read(), self.image_data)
+
+    def test_image_download_not_an_image(self, _):
+        """it stops as soon as it can tell it's not an image"""
+        image = covers.ImageDownload()
+        self.assertFalse(image.write(b"<html>" + b" " * 100))
+        self.assertEqual(image.discard(), (None, None))
+
+    def test_image_download_too_big(self, _):
+        """there's a limit to how much is downloaded"""
+        image = covers.ImageDownload()
+        with patch("bookwyrm.connectors.covers.COVER_DOWNLOAD_MAX_SIZE", 100):
+            self.assertTrue(image.write(self.image_data[:50]))
+            self.assertFalse(image.write(self.image_data[50:200]))
+
+    def test_download_image(self, _):
+        """stream a response into a file"""
+        session = FakeSession(FakeResponse(self.image_data))
+        content, extension = asyncio.run(
+            covers.download_image(session, "https://example.com/1.jpg")
+        )
+        self.assertEqual(extension, "jpeg")
+        self.assertEqual(content.read(), self.image_data)
+
+    def test_download_image_too_big(self, _):
+        """a response that says it's too big isn't read"""
+        session = FakeSession(
+            FakeResponse(self.image_data, content_length=1024 * 1024 * 1024)
+        )
+        result = asyncio.run(
+            covers.download_image(session, "https://example.com/1.jpg")
+        )
+        self.assertEqual(result, (None, None))
+
+    def test_get_valid_urls(self, _):
+        """urls are checked before anything is requested"""
+        self.assertEqual(
+            covers.get_valid_urls(
+                [
+                    "https://example.com/1.jpg",
+                    "http://127.0.0.1/1.jpg",
+                    "https://example.com/1.jpg",
+                ]
+            ),
+            ["https://example.com/1.jpg"],
+        )
+
+    def test_queue_cover(self, mock_redis):
+        """covers wait to be downloaded with others"""
+        mock_redis.set.return_value = True
+        with patch(
+            "bookwyrm.connectors.covers.download_covers_task.apply_async"
+        ) as mock_task:
+            covers.queue_cover(1, "https://example.com/1.jpg")
+
+        mock_redis.rpush.assert_called_once_with(
+            covers.QUEUE_KEY, json.dumps([1, "https://example.com/1.jpg"])
+        )
+        self.assertEqual(mock_task.call_args[1]["countdown"], 2)
+
+    def test_download_covers_task(self, mock_redis):
+        """the covers are attached to the books that still need one"""
+        book = models.Edition.objects.create(title="hi")
+        mock_redis.pipeline.return_value.execute.return_value = [
+            [json.dumps([book.id, "https://example.com/1.jpg"])],
+            True,
+            0,
+        ]
+
+        async def download_images(urls):
+            self.assertEqual(urls, ["https://example.com/1.jpg"])
+            content = covers.ImageDownload()
+            content.write(self.image_data)
+            return {urls[0]: content.result()}
+
+        with patch(
+            "bookwyrm.connectors.covers.download_images", download_images
+        ), patch("bookwyrm.preview_images.generate_edition_preview_image_task.delay"):
+            covers.download_covers_task()
+
+        mock_redis.delete.assert_called_once_with(covers.SCHEDULED_KEY)
+        book.refresh_from_db()
+        self.assertTrue(book.cover)
+        self.assertIsInstance(book.cover.file, File)
@@ -0,0 +1,170 @@
+""" testing the remote fetch cache """
+from itertools import count
+from unittest.mock import patch
+import responses
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from bookwyrm.connectors import fetch_cache
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class FetchCache(TestCase):
+    """caching remote objects"""
+
+    def setUp(self):
+        """start fresh"""
+        cache.clear()
+
+    @responses.activate
+    def test_get_cached(self):
+        """the second request is served from the cache"""
+        responses.add(
+            responses.GET,
+            "https://example.com/user/mouse",
+            json={"id": "https://example.com/user/mouse"},
+            headers={"Cache-Control": "max-age=60"},
+        )
+        first = fetch_cache.get("https://example.com/user/mouse")
+        second = fetch_cache.get("https://example.com/user/mouse")
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(first.json(), second.json())
+        stats = fetch_cache.get_stats()
+        self.assertEqual(stats["hit"], 1)
+        self.assertEqual(stats["miss"], 1)
+        self.assertEqual(stats["hit_rate"], 50)
+
+    @responses.activate
+    def test_get_no_store(self):
+        """respect the remote server's wishes"""
+        responses.add(
+            responses.GET,
+            "https://example.com/user/mouse",
+            json={"id": "https://example.com/user/mouse"},
+            headers={"Cache-Control": "no-store"},
+        )
+        fetch_cache.get("https://example.com/user/mouse")
+        fetch_cache.get("https://example.com/user/mouse")
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_get_revalidate(self):
+        """a stale copy is revalidated with its etag"""
+        responses.add(
+            responses.GET,
+            "https://example.com/user/mouse",
+            json={"id": "https://example.com/user/mouse"},
+            headers={"Cache-Control": "no-cache", "ETag": '"abc"'},
+        )
+        responses.add(responses.GET, "https://example.com/user/mouse", status=304)
+
+        fetch_cache.get("https://example.com/user/mouse")
+        result = fetch_cache.get("https://example.com/user/mouse")
+
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(responses.calls[1].request.headers["If-None-Match"], '"abc"')
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json(), {"id": "https://example.com/user/mouse"})
+
+    @responses.activate
+    def test_get_negative(self):
+        """gone objects are remembered as gone"""
+        responses.add(responses.GET, "https://example.com/user/mouse", status=410)
+
+        fetch_cache.get("https://example.com/user/mouse")
+        result = fetch_cache.get("https://example.com/user/mouse")
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(result.status_code, 410)
+        self.assertEqual(fetch_cache.get_stats()["negative"], 1)
+
+    @responses.activate
+    def test_get_refresh(self):
+        """refreshing skips the fresh copy"""
+        responses.add(
+            responses.GET,
+            "https://example.com/user/mouse",
+            json={"id": "https://example.com/user/mouse"},
+            headers={"Cache-Control": "max-age=60"},
+        )
+        fetch_cache.get("https://example.com/user/mouse")
+        fetch_cache.get("https://example.com/user/mouse", refresh=True)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_get_lock_released(self):
+        """waiters stop waiting when the lock holder gives up"""
+        responses.add(responses.GET, "https://example.com/user/mouse", status=500)
+        lock_key = f"{fetch_cache.get_cache_key('https://example.com/user/mouse')}-lock"
+        cache.set(lock_key, "someone else")
+
+        with patch("bookwyrm.connectors.fetch_cache.time.sleep") as mock_sleep:
+            mock_sleep.side_effect = lambda _: cache.delete(lock_key)
+            result = fetch_cache.get("https://example.com/user/mouse")
+
+        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertEqual(result.status_code, 500)
+        self.assertIsNone(cache.get(lock_key))
+
+    @responses.activate
+    def test_get_lock_not_owned(self):
+        """a waiter that times out doesn't release someone else's lock"""
+        responses.add(responses.GET, "https://example.com/user/mouse", status=500)
+        lock_key = f"{fetch_cache.get_cache_key('https://example.com/user/mouse')}-lock"
+        cache.set(lock_key, "someone else")
+
+        with patch("bookwyrm.connectors.fetch_cache.time.sleep"), patch(
+            "bookwyrm.connectors.fetch_cache.time.time"
+        ) as mock_time:
+            mock_time.side_effect = count()
+            fetch_cache.get("https://example.com/user/mouse", timeout=1)
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(cache.get(lock_key), "someone else")
+
+    @responses.activate
+    def test_get_not_stored(self):
+        """private and very large responses aren't kept"""
+        responses.add(
+            responses.GET,
+            "https://example.com/user/mouse",
+            json={"id": "https://example.com/user/mouse"},
+            headers={"Cache-Control": "private, max-age=60"},
+        )
+        responses.add(
+            responses.GET,
+            "https://example.com/user/rat",
+            body="a" * 100,
+            headers={"Cache-Control": "max-age=60"},
+        )
+        fetch_cache.get("https://example.com/user/mouse")
+        with patch("bookwyrm.connectors.fetch_cache.settings.FETCH_CACHE_MAX_SIZE", 10):
+            fetch_cache.get("https://example.com/user/rat")
+
+        self.assertIsNone(
+            cache.get(fetch_cache.get_cache_key("https://example.com/user/mouse"))
+        )
+        self.assertIsNone(
+            cache.get(fetch_cache.get_cache_key("https://example.com/user/rat"))
+        )
+
+    def test_get_cache_key(self):
+        """signed and unsigned fetches are kept apart"""
+        self.assertNotEqual(
+            fetch_cache.get_cache_key("https://example.com/user/mouse"),
+            fetch_cache.get_cache_key("https://example.com/user/mouse", signed=True),
+        )
+
+    def test_get_freshness(self):
+        """parse cache-control headers"""
+        self.assertEqual(fetch_cache.get_freshness("max-age=30"), 30)
+        self.assertEqual(fetch_cache.get_freshness("public, s-maxage=20"), 20)
+        self.assertEqual(fetch_cache.get_freshness("max-age=99999999"), 60 * 60)
+        self.assertEqual(fetch_cache.get_freshness("no-cache"), 0)
+        self.assertIsNone(fetch_cache.get_freshness("no-store"))
+        self.assertIsNone(fetch_cache.get_freshness("private, max-age=30"))
+        self.assertEqual(fetch_cache.get_freshness(None), 60 * 5)
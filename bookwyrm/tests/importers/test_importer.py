@@ -1,5 +1,6 @@
 """ testing import """
 from collections import namedtuple
+from io import BytesIO
 import pathlib
 from unittest.mock import patch
 import datetime
@@ -9,9 +10,14 @@ from django.test import TestCase
 import responses
 
 from bookwyrm import models
-from bookwyrm.importers import Importer
-from bookwyrm.models.import_job import start_import_task, import_item_task
-from bookwyrm.models.import_job import handle_imported_book
+from bookwyrm.importers import Importer, LibrarythingImporter
+from bookwyrm.importers.importer import get_importer, ingest_import_task
+from bookwyrm.models.import_job import (
+    start_import_task,
+    import_chunk_task,
+    import_item_task,
+)
+from bookwyrm.models.import_job import handle_imported_book, handle_imported_books
 
 
 def make_date(*args):
@@ -19,7 +25,7 @@ def make_date(*args):
     return datetime.datetime(*args, tzinfo=pytz.UTC)
 
 
-# pylint: disable=consider-using-with
+# pylint: disable=consider-using-with,too-many-public-methods
 @patch("bookwyrm.suggested_users.rerank_suggestions_task.delay")
 @patch("bookwyrm.activitystreams.populate_stream_task.delay")
 @patch("bookwyrm.activitystreams.add_book_statuses_task.delay")
@@ -80,6 +86,50 @@ class GenericImporter(TestCase):
         self.assertEqual(import_items[3].normalized_data["id"], "10")
         self.assertEqual(import_items[3].normalized_data["title"], "Patisserie at Home")
 
+    def test_queue_job(self, *_):
+        """the csv is stored and read in a task"""
+        datafile = pathlib.Path(__file__).parent.joinpath("../data/generic.csv")
+        with open(datafile, "rb") as csv_file, patch(
+            "bookwyrm.importers.importer.ingest_import_task.delay"
+        ) as mock_ingest:
+            import_job = self.importer.queue_job(
+                self.local_user, csv_file, False, "public"
+            )
+        self.assertEqual(mock_ingest.call_args[0][0], import_job.id)
+        self.assertEqual(import_job.mappings["title"], "title")
+        self.assertFalse(import_job.items.exists())
+        self.assertTrue(import_job.import_file)
+
+        with patch("bookwyrm.importers.importer.INGEST_BATCH_SIZE", 3), patch(
+            "bookwyrm.models.import_job.ImportJob.start_job"
+        ) as mock_start:
+            ingest_import_task(import_job.id)
+        self.assertTrue(mock_start.called)
+
+        import_job.refresh_from_db()
+        self.assertFalse(import_job.import_file)
+        self.assertEqual(
+            list(import_job.items.order_by("index").values_list("index", flat=True)),
+            [0, 1, 2, 3],
+        )
+        self.assertEqual(
+            import_job.items.get(index=3).normalized_data["title"],
+            "Patisserie at Home",
+        )
+
+    def test_queue_job_empty(self, *_):
+        """nothing to read"""
+        with self.assertRaises(ValueError):
+            self.importer.queue_job(
+                self.local_user, BytesIO(b"Title,Author\n"), False, "public"
+            )
+        self.assertFalse(models.ImportJob.objects.exists())
+
+    def test_get_importer(self, *_):
+        """the task reads the file the same way the upload was checked"""
+        self.assertIsInstance(get_importer("LibraryThing"), LibrarythingImporter)
+        self.assertIsInstance(get_importer("Import"), Importer)
+
     def test_create_retry_job(self, *_):
         """trying again with items that didn't import"""
         import_job = self.importer.create_job(
@@ -122,12 +172,66 @@ class GenericImporter(TestCase):
             self.local_user, self.csv, False, "unlisted"
         )
 
-        MockTask = namedtuple("Task", ("id"))
-        with patch("bookwyrm.models.import_job.import_item_task.delay") as mock:
-            mock.return_value = MockTask(123)
+        with patch("bookwyrm.models.import_job.import_chunk_task.delay") as mock:
             start_import_task(import_job.id)
 
-        self.assertEqual(mock.call_count, 4)
+        # all four rows fit in one chunk
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(mock.call_args[0][0], import_job.id)
+
+    def test_import_chunk_task(self, *_):
+        """work through the rows a few at a time"""
+        import_job = self.importer.create_job(
+            self.local_user, self.csv, False, "unlisted"
+        )
+        self.book.isbn_13 = "9781250313195"
+        self.book.save(broadcast=False)
+
+        with patch("bookwyrm.models.import_job.IMPORT_CHUNK_SIZE", 2), patch(
+            "bookwyrm.models.import_job.import_chunk_task.delay"
+        ) as mock_next, patch(
+            "bookwyrm.connectors.connector_manager.first_search_result"
+        ) as mock_search, patch(
+            "bookwyrm.models.import_job.handle_imported_books"
+        ) as mock_handle:
+            mock_search.return_value = None
+            import_chunk_task(import_job.id)
+
+            # the first row was already in the database, so only the second
+            # needed a search
+            self.assertEqual(mock_search.call_count, 1)
+            self.assertEqual(mock_handle.call_count, 1)
+            self.assertEqual(mock_next.call_count, 1)
+            items = import_job.items.order_by("index")
+            self.assertEqual(items[0].book_id, self.book.id)
+            self.assertIsNotNone(items[1].fail_reason)
+            import_job.refresh_from_db()
+            self.assertEqual(import_job.pending_item_count, 2)
+            self.assertEqual(import_job.successful_item_count, 1)
+            self.assertEqual(import_job.failed_item_count, 1)
+
+            import_chunk_task(import_job.id)
+
+        import_job.refresh_from_db()
+        self.assertTrue(import_job.complete)
+        self.assertEqual(import_job.pending_item_count, 0)
+        self.assertEqual(mock_next.call_count, 1)
+
+    def test_import_chunk_task_busy(self, *_):
+        """a user can't have too many chunks running at once"""
+        import_job = self.importer.create_job(
+            self.local_user, self.csv, False, "unlisted"
+        )
+        with patch("bookwyrm.models.import_job.get_import_slot") as mock_slot, patch(
+            "bookwyrm.models.import_job.import_chunk_task.apply_async"
+        ) as mock_later:
+            mock_slot.return_value = None
+            import_chunk_task(import_job.id)
+
+        self.assertEqual(mock_later.call_args[1]["args"], (import_job.id,))
+        import_job.refresh_from_db()
+        self.assertEqual(import_job.item_count, 4)
+        self.assertEqual(import_job.pending_item_count, 4)
 
     @responses.activate
     def test_import_item_task(self, *_):
@@ -256,6 +360,49 @@ class GenericImporter(TestCase):
         self.assertEqual(shelf.books.first(), self.book)
         self.assertEqual(models.ReadThrough.objects.count(), 1)
 
+    @patch("bookwyrm.activitystreams.add_status_task.delay")
+    @patch("bookwyrm.activitystreams.add_books_statuses_task.delay")
+    def test_handle_imported_books(self, *args):
+        """a chunk of rows is shelved and posted about together"""
+        mock_statuses = args[0]
+        other_book = models.Edition.objects.create(
+            title="Other Edition", parent_work=models.Work.objects.create(title="Hi")
+        )
+        import_job = self.importer.create_job(
+            self.local_user, self.csv, True, "unlisted"
+        )
+        items = list(import_job.items.order_by("index"))
+        items[0].book = self.book
+        items[3].book = other_book
+
+        with patch(
+            "bookwyrm.models.import_job.broadcast_many_task.apply_async"
+        ) as mock:
+            handle_imported_books([items[0], items[3]])
+            handle_imported_books([items[0], items[3]])
+
+        # one message for the whole chunk, and nothing the second time
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(mock_statuses.call_count, 1)
+        self.assertCountEqual(
+            mock_statuses.call_args[0][1], [self.book.id, other_book.id]
+        )
+        activities = mock.call_args[1]["args"][1]
+        # two books shelved and a review
+        self.assertEqual(len(activities), 3)
+
+        self.assertEqual(
+            models.ShelfBook.objects.filter(user=self.local_user).count(), 2
+        )
+        shelf_book = models.ShelfBook.objects.get(book=self.book)
+        self.assertEqual(shelf_book.shelf.identifier, models.Shelf.READ_FINISHED)
+        self.assertIsNotNone(shelf_book.remote_id)
+        self.assertEqual(models.ReadThrough.objects.count(), 2)
+        review = models.Review.objects.get(book=other_book, user=self.local_user)
+        self.assertEqual(review.content, "mixed feelings")
+        self.assertEqual(items[3].linked_review, review)
+        self.assertIsNone(items[0].linked_review)
+
     @patch("bookwyrm.activitystreams.add_status_task.delay")
     def test_handle_imported_book_review(self, *_):
         """review import"""
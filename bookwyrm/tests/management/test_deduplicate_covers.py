@@ -0,0 +1,49 @@
+""" test combining covers that are stored more than once """
+import pathlib
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase
+
+from bookwyrm import models
+from bookwyrm.management.commands.deduplicate_covers import dedupe_covers
+
+
+class DeduplicateCovers(TestCase):
+    """moving covers to shared files"""
+
+    def setUp(self):
+        """books with copies of the same cover, from before they were shared"""
+        patcher = patch("bookwyrm.thumbnail_generation.generate_thumbnails_task.delay")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        image_data = (
+            pathlib.Path(__file__)
+            .parent.joinpath("../../static/images/default_avi.jpg")
+            .read_bytes()
+        )
+        self.names = [
+            default_storage.save(f"covers/{name}.jpg", ContentFile(image_data))
+            for name in ("first", "second")
+        ]
+        self.books = [
+            models.Edition.objects.create(title=name, cover=name)
+            for name in self.names + [self.names[1]]
+        ]
+        self.shared_book = models.Edition.objects.create(title="shared")
+        self.shared_book.cover.save("test.jpg", ContentFile(image_data))
+
+    def test_dedupe_covers(self):
+        """every copy becomes the shared file"""
+        self.assertEqual(dedupe_covers(), 2)
+
+        for book in self.books:
+            book.refresh_from_db()
+            self.assertEqual(book.cover.name, self.shared_book.cover.name)
+        for name in self.names:
+            self.assertFalse(default_storage.exists(name))
+        self.assertTrue(default_storage.exists(self.shared_book.cover.name))
+
+        # there's nothing left to do
+        self.assertEqual(dedupe_covers(), 0)
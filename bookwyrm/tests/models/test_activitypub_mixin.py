@@ -2,9 +2,11 @@
 from unittest.mock import patch
 from collections import namedtuple
 from dataclasses import dataclass
+import json
 import re
 from django import db
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
 from bookwyrm.activitypub.base_activity import ActivityObject
 from bookwyrm import models
@@ -13,8 +15,11 @@ from bookwyrm.models.activitypub_mixin import (
     ActivitypubMixin,
     ActivityMixin,
     broadcast_task,
+    get_deduplication_key,
     ObjectMixin,
     OrderedCollectionMixin,
+    get_keyset_ordering,
+    parse_page_cursor,
     to_ordered_collection_page,
 )
 from bookwyrm.settings import PAGE_LENGTH
@@ -141,6 +146,106 @@ class ActivitypubMixins(TestCase):
         )
         self.assertEqual(result, matching_book)
 
+    def test_find_existing_cached_remote_id(self, *_):
+        """a remote id we've seen before is looked up by primary key"""
+        book = models.Edition.objects.create(
+            title="Test edition", remote_id="https://example.com/book/1"
+        )
+        with patch("bookwyrm.models.activitypub_mixin.cache") as cache_mock:
+            cache_mock.get.return_value = book.id
+            result = models.Edition.find_existing_by_remote_id(
+                "https://example.com/book/1"
+            )
+        self.assertEqual(result, book)
+        self.assertFalse(cache_mock.set.called)
+
+        # a stale cache entry falls back to the full query
+        with patch("bookwyrm.models.activitypub_mixin.cache") as cache_mock:
+            cache_mock.get.return_value = book.id + 1
+            result = models.Edition.find_existing_by_remote_id(
+                "https://example.com/book/1"
+            )
+        self.assertEqual(result, book)
+        cache_mock.set.assert_called_once()
+        self.assertEqual(cache_mock.set.call_args[0][1], book.id)
+
+    def test_find_existing_batch(self, *_):
+        """match many blobs of data at once"""
+        book = models.Edition.objects.create(
+            title="Test edition", openlibrary_key="OL1234"
+        )
+        other_book = models.Edition.objects.create(
+            title="Another test edition", remote_id="https://example.com/book/1"
+        )
+
+        results = models.Edition.find_existing_batch(
+            [
+                {"openlibraryKey": "OL1234"},
+                {"id": "https://example.com/book/nope"},
+                {"id": "https://example.com/book/1"},
+                {},
+            ]
+        )
+        self.assertEqual(results, [book, None, other_book, None])
+
+        self.assertEqual(models.Edition.find_existing_batch([{}]), [None])
+
+    def test_find_existing_batch_case_insensitive(self, *_):
+        """match the way the database does"""
+        hashtag = models.Hashtag.objects.create(name="#foo")
+        self.assertEqual(
+            models.Hashtag.find_existing_batch([{"name": "#foo"}]), [hashtag]
+        )
+        # whatever the database thinks, the batch agrees with it
+        self.assertEqual(
+            models.Hashtag.find_existing_batch([{"name": "#Foo"}]),
+            [models.Hashtag.find_existing({"name": "#Foo"})],
+        )
+        self.assertEqual(
+            get_deduplication_key("name", "#Foo", case_insensitive={"name"}),
+            get_deduplication_key("name", "#foo", case_insensitive={"name"}),
+        )
+        self.assertNotEqual(
+            get_deduplication_key("name", "#Foo"), get_deduplication_key("name", "#foo")
+        )
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_find_existing_batch_cached(self, *_):
+        """remote ids we've matched before are looked up by pk"""
+        cache.clear()
+        book = models.Edition.objects.create(
+            title="Test edition", remote_id="https://example.com/book/1"
+        )
+        models.Edition.find_existing_batch([{"id": "https://example.com/book/1"}])
+
+        with patch("bookwyrm.models.activitypub_mixin.reduce") as mock_reduce:
+            results = models.Edition.find_existing_batch(
+                [{"id": "https://example.com/book/1"}]
+            )
+        self.assertEqual(results, [book])
+        self.assertFalse(mock_reduce.called)
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_to_activity_json(self, *_):
+        """the serialized activity is cached until the object changes"""
+        cache.clear()
+        work = models.Work.objects.create(title="Test work")
+        book = models.Edition.objects.create(title="Test edition", parent_work=work)
+
+        activity_json = book.to_activity_json()
+        self.assertEqual(json.loads(activity_json)["title"], "Test edition")
+        with patch("bookwyrm.models.Edition.to_activity") as to_activity:
+            self.assertEqual(book.to_activity_json(), activity_json)
+        self.assertFalse(to_activity.called)
+
+        book.title = "New title"
+        book.save()
+        self.assertEqual(json.loads(book.to_activity_json())["title"], "New title")
+
     def test_get_recipients_public_object(self, *_):
         """determines the recipients for an object's broadcast"""
         MockSelf = namedtuple("Self", ("privacy"))
@@ -410,10 +515,29 @@ class ActivitypubMixins(TestCase):
         )
         self.assertEqual(page_1.partOf, "http://fish.com/")
         self.assertEqual(page_1.id, "http://fish.com/?page=1")
-        self.assertEqual(page_1.next, "http://fish.com/?page=2")
+        self.assertTrue(page_1.next.startswith("http://fish.com/?page="))
+        self.assertIsNone(page_1.prev)
         self.assertEqual(page_1.orderedItems[0]["content"], "<p>test status 29</p>")
         self.assertEqual(page_1.orderedItems[1]["content"], "<p>test status 28</p>")
 
+        # the next page picks up where the last one left off
+        cursor = page_1.next.split("?page=")[1]
+        next_page = to_ordered_collection_page(
+            models.Status.objects.all(), "http://fish.com/", page=cursor
+        )
+        self.assertEqual(next_page.id, page_1.next)
+        self.assertEqual(next_page.orderedItems[0]["content"], "<p>test status 14</p>")
+        self.assertEqual(next_page.orderedItems[-1]["content"], "<p>test status 0</p>")
+        self.assertIsNone(next_page.next)
+
+        # and back again
+        cursor = next_page.prev.split("?page=")[1]
+        prev_page = to_ordered_collection_page(
+            models.Status.objects.all(), "http://fish.com/", page=cursor
+        )
+        self.assertEqual(prev_page.orderedItems, page_1.orderedItems)
+        self.assertIsNone(prev_page.prev)
+
         page_2 = to_ordered_collection_page(
             models.Status.objects.all(), "http://fish.com/", page=2
         )
@@ -422,6 +546,34 @@ class ActivitypubMixins(TestCase):
         self.assertEqual(page_2.orderedItems[0]["content"], "<p>test status 14</p>")
         self.assertEqual(page_2.orderedItems[-1]["content"], "<p>test status 0</p>")
 
+    def test_to_ordered_collection_page_not_keyset(self, *_):
+        """querysets that can't be paged by keyset use numbered pages"""
+        models.Status.objects.bulk_create(
+            models.Status(
+                user=self.local_user,
+                content=f"test status {number}",
+            )
+            for number in range(2 * PAGE_LENGTH)
+        )
+        queryset = models.Status.objects.order_by("user__localname", "content")
+        self.assertIsNone(get_keyset_ordering(queryset))
+
+        page_1 = to_ordered_collection_page(queryset, "http://fish.com/", page=1)
+        self.assertEqual(page_1.next, "http://fish.com/?page=2")
+        self.assertIsNone(page_1.prev)
+        page_2 = to_ordered_collection_page(queryset, "http://fish.com/", page=2)
+        self.assertIsNone(page_2.next)
+        self.assertEqual(page_2.prev, "http://fish.com/?page=1")
+        self.assertEqual(len(page_2.orderedItems), PAGE_LENGTH)
+
+    def test_parse_page_cursor(self, *_):
+        """numbers and junk aren't cursors"""
+        ordering = get_keyset_ordering(models.Status.objects.all())
+        self.assertIsNone(parse_page_cursor(1, ordering))
+        self.assertIsNone(parse_page_cursor("2", ordering))
+        self.assertIsNone(parse_page_cursor("nonsense!", ordering))
+        self.assertIsNone(parse_page_cursor("WzEsIDJd", ordering))
+
     def test_to_ordered_collection(self, *_):
         """convert a queryset into an ordered collection object"""
         self.assertEqual(PAGE_LENGTH, 15)
@@ -457,7 +609,9 @@ class ActivitypubMixins(TestCase):
             "https://instance.example/user/inbox",
             "https://instance.example/okay/inbox",
         ]
-        with patch("bookwyrm.models.activitypub_mixin.asyncio.run") as mock:
+        with patch("bookwyrm.broadcast.asyncio.run") as mock, patch(
+            "bookwyrm.broadcast.BROADCAST_DELIVERY_WINDOW", 0
+        ):
             broadcast_task(self.local_user.id, {}, recipients)
         self.assertTrue(mock.called)
         self.assertEqual(mock.call_count, 1)
@@ -1,6 +1,7 @@
 """ testing models """
 from io import BytesIO
 import pathlib
+from unittest.mock import patch
 
 import pytest
 
@@ -128,7 +129,8 @@ class Book(TestCase):
         not ENABLE_THUMBNAIL_GENERATION,
         reason="Thumbnail generation disabled in settings",
     )
-    def test_thumbnail_fields(self):
+    @patch("bookwyrm.thumbnail_generation.generate_thumbnails_task.delay")
+    def test_thumbnail_fields(self, _):
         """Just hit them"""
         image_file = pathlib.Path(__file__).parent.joinpath(
             "../../static/images/default_avi.jpg"
@@ -1,14 +1,21 @@
 """test bookwyrm user export functions"""
 import datetime
+from io import BytesIO
 import json
+import pathlib
 from unittest.mock import patch
 
+from django.core.files.base import ContentFile
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from PIL import Image
 
 from bookwyrm import models
 import bookwyrm.models.bookwyrm_export_job as export_job
+from bookwyrm.utils.tar import BookwyrmTarFile
 
 
 class BookwyrmExport(TestCase):
@@ -229,3 +236,92 @@ class BookwyrmExport(TestCase):
             json_data["books"][0]["quotations"][0]["quote"],
             "<p>A rose by any other name</p>",
         )
+
+    def test_json_export_batches(self):
+        """books are written out a batch at a time"""
+        other = models.Edition.objects.create(
+            title="Another Edition", parent_work=self.work
+        )
+        models.ReadThrough.objects.create(user=self.local_user, book=other)
+
+        with patch("bookwyrm.models.bookwyrm_export_job.EXPORT_BATCH_SIZE", 1):
+            json_data = json.loads(export_job.json_export(self.local_user))
+
+        self.assertEqual(
+            [book["edition"]["title"] for book in json_data["books"]],
+            ["Example Edition", "Another Edition"],
+        )
+        self.assertEqual(json_data["preferredUsername"], "mouse")
+
+    def test_export_books_queries(self):
+        """a batch takes the same queries however many books are in it"""
+
+        def count_queries():
+            editions = next(export_job.get_book_batches(self.local_user))
+            with CaptureQueriesContext(connection) as context:
+                list(export_job.export_books(self.local_user, editions, {}))
+            return len(context.captured_queries)
+
+        one_book = count_queries()
+
+        with patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"):
+            for i in range(3):
+                edition = models.Edition.objects.create(
+                    title=f"Edition {i}", parent_work=self.work
+                )
+                edition.authors.add(self.author)
+                models.ReadThrough.objects.create(user=self.local_user, book=edition)
+                models.ShelfBook.objects.create(
+                    book=edition,
+                    shelf=models.Shelf.objects.get(
+                        user=self.local_user, identifier="read"
+                    ),
+                    user=self.local_user,
+                )
+                models.ListItem.objects.create(
+                    book_list=self.list,
+                    user=self.local_user,
+                    book=edition,
+                    approved=True,
+                    order=i + 2,
+                )
+
+        self.assertEqual(count_queries(), one_book)
+
+    def test_tar_export(self):
+        """the archive json is added to the tar from a temporary file"""
+        output = ContentFile(b"")
+        export_job.tar_export(self.local_user, output)
+
+        output.seek(0)
+        with BookwyrmTarFile.open(mode="r:gz", fileobj=output) as tar:
+            json_data = json.loads(tar.read("archive.json"))
+        self.assertEqual(json_data["books"][0]["edition"]["title"], "Example Edition")
+
+    def test_tar_export_covers(self):
+        """each cover file goes in the tar once, however many editions use it"""
+        image_file = pathlib.Path(__file__).parent.joinpath(
+            "../../static/images/default_avi.jpg"
+        )
+        image = Image.open(image_file)
+        cover = BytesIO()
+        image.save(cover, format=image.format)
+
+        other = models.Edition.objects.create(
+            title="Another Edition", parent_work=self.work
+        )
+        models.ReadThrough.objects.create(user=self.local_user, book=other)
+        with patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"):
+            self.edition.cover.save("test.jpg", ContentFile(cover.getvalue()))
+            other.cover = self.edition.cover.name
+            other.save()
+
+        output = ContentFile(b"")
+        with patch("bookwyrm.models.bookwyrm_export_job.USER_EXPORT_COVER_WORKERS", 1):
+            export_job.tar_export(self.local_user, output)
+
+        output.seek(0)
+        with BookwyrmTarFile.open(mode="r:gz", fileobj=output) as tar:
+            covers = [name for name in tar.getnames() if name.startswith("covers/")]
+            self.assertEqual(covers, [self.edition.cover.name])
+            self.assertEqual(tar.read(covers[0]), cover.getvalue())
@@ -4,11 +4,13 @@ import json
 import pathlib
 from unittest.mock import patch
 
+from django.core.files import File
 from django.db.models import Q
 from django.utils.dateparse import parse_datetime
 from django.test import TestCase
 
 from bookwyrm import models
+from bookwyrm.settings import DOMAIN
 from bookwyrm.utils.tar import BookwyrmTarFile
 from bookwyrm.models import bookwyrm_import_job
 
@@ -75,6 +77,89 @@ class BookwyrmImport(TestCase):  # pylint: disable=too-many-public-methods
             "../data/bookwyrm_account_export.tar.gz"
         )
 
+    def get_job(self, **kwargs):
+        """an import job for the test archive"""
+        job = models.BookwyrmImportJob.objects.create(
+            user=self.local_user, required=["include_readthroughs"], **kwargs
+        )
+        with open(self.archive_file, "rb") as fileobj:
+            job.archive_file.save("archive.tar.gz", File(fileobj))
+        return job
+
+    def test_start_import_task(self):
+        """the books are split into chunks that run in their own tasks"""
+        job = self.get_job()
+        with patch(
+            "bookwyrm.models.bookwyrm_import_job.USER_IMPORT_CHUNK_SIZE", 1
+        ), patch(
+            "bookwyrm.models.bookwyrm_import_job.import_books_task.delay"
+        ) as mock, self.captureOnCommitCallbacks(
+            execute=True
+        ):
+            bookwyrm_import_job.start_import_task(job_id=job.id, no_children=False)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "active")
+        self.assertEqual(mock.call_count, 2)
+        chunks = job.chunks.order_by("id")
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(
+            chunks[0].books[0]["edition"]["title"],
+            "Seeking Like A State",
+        )
+        self.assertEqual(
+            mock.call_args[1], {"job_id": job.id, "child_id": chunks[1].id}
+        )
+        self.assertEqual(job.percent_complete, 0)
+
+    def test_import_books_task(self):
+        """a chunk imports its books and lets the job know when it's done"""
+        job = self.get_job(status="active")
+        first = models.BookwyrmImportChunk.objects.create(
+            parent_job=job, books=self.json_data["books"][:1]
+        )
+        second = models.BookwyrmImportChunk.objects.create(
+            parent_job=job, books=self.json_data["books"][1:]
+        )
+
+        bookwyrm_import_job.import_books_task(job_id=job.id, child_id=first.id)
+        first.refresh_from_db()
+        job.refresh_from_db()
+        self.assertTrue(first.complete)
+        self.assertFalse(job.complete)
+        self.assertEqual(job.percent_complete, 50)
+        self.assertTrue(models.Edition.objects.filter(isbn_13="9780300070163").exists())
+
+        # running a chunk again doesn't import anything twice
+        first.complete = False
+        first.save()
+        bookwyrm_import_job.import_books_task(job_id=job.id, child_id=first.id)
+        self.assertEqual(models.Edition.objects.count(), 2)
+        self.assertEqual(models.ReadThrough.objects.count(), 1)
+
+        with patch("bookwyrm.models.job.app.control.revoke"):
+            bookwyrm_import_job.import_books_task(job_id=job.id, child_id=second.id)
+        job.refresh_from_db()
+        self.assertTrue(job.complete)
+        self.assertTrue(
+            models.Notification.objects.filter(
+                user=self.local_user, notification_type="USER_IMPORT"
+            ).exists()
+        )
+
+    def test_resume_job(self):
+        """only the chunks that didn't finish run again"""
+        job = self.get_job(status="active")
+        models.BookwyrmImportChunk.objects.create(parent_job=job, complete=True)
+        chunk = models.BookwyrmImportChunk.objects.create(parent_job=job)
+
+        with patch(
+            "bookwyrm.models.bookwyrm_import_job.import_books_task.delay"
+        ) as mock:
+            job.resume_job()
+
+        mock.assert_called_once_with(job_id=job.id, child_id=chunk.id)
+
     def test_update_user_profile(self):
         """Test update the user's profile from import data"""
 
@@ -272,6 +357,29 @@ class BookwyrmImport(TestCase):  # pylint: disable=too-many-public-methods
         self.assertTrue(models.Edition.objects.filter(isbn_13="9780300070163").exists())
         self.assertEqual(models.Edition.objects.count(), 2)
 
+    def test_get_or_create_editions(self):
+        """a chunk's authors and works are looked up and created together"""
+        books = [self.json_data["books"][0], self.json_data["books"][1]]
+        author_id = books[0]["authors"][0]["id"]
+
+        with open(self.archive_file, "rb") as fileobj:
+            with BookwyrmTarFile.open(mode="r:gz", fileobj=fileobj) as tarfile:
+                editions = bookwyrm_import_job.get_or_create_editions(books, tarfile)
+
+        self.assertEqual(editions[0].isbn_13, "9780300070163")
+        self.assertEqual(editions[1], self.book)
+        author = models.Author.objects.get(origin_id=author_id)
+        self.assertEqual(author.remote_id, f"https://{DOMAIN}/author/{author.id}")
+        self.assertEqual(list(editions[0].authors.all()), [author])
+        self.assertEqual(editions[0].parent_work.origin_id, books[0]["work"]["id"])
+
+        # running it again finds everything that was created
+        with open(self.archive_file, "rb") as fileobj:
+            with BookwyrmTarFile.open(mode="r:gz", fileobj=fileobj) as tarfile:
+                again = bookwyrm_import_job.get_or_create_editions(books, tarfile)
+        self.assertEqual(again, editions)
+        self.assertEqual(models.Author.objects.count(), 1)
+
     def test_upsert_readthroughs(self):
         """Test take a JSON string of readthroughs, find or create the
         instances in the database and return a list of saved instances"""
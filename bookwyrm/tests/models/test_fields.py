@@ -3,6 +3,7 @@ from io import BytesIO
 from collections import namedtuple
 from dataclasses import dataclass
 import datetime
+import hashlib
 import json
 import pathlib
 import re
@@ -14,6 +15,7 @@ from PIL import Image
 import responses
 
 from django.core.exceptions import ValidationError
+from django.core.files import File
 from django.core.files.base import ContentFile
 from django.db import models
 from django.test import TestCase
@@ -459,7 +461,7 @@ class ModelFields(TestCase):
             )
         loaded_image = instance.field_from_activity("http://www.example.com/image.jpg")
         self.assertIsInstance(loaded_image, list)
-        self.assertIsInstance(loaded_image[1], ContentFile)
+        self.assertIsInstance(loaded_image[1], File)
 
     @responses.activate
     def test_image_field_set_field_from_activity(self, *_):
@@ -588,6 +590,33 @@ class ModelFields(TestCase):
         self.assertIsNotNone(book.cover.name)
         self.assertNotEqual(book.cover.size, cover_size)
 
+    def test_content_addressed_image_field(self, *_):
+        """the same image is stored once"""
+        image_file = pathlib.Path(__file__).parent.joinpath(
+            "../../static/images/default_avi.jpg"
+        )
+        image_data = image_file.read_bytes()
+        book = Edition.objects.create(title="hello")
+        book.cover.save("test.jpg", ContentFile(image_data))
+        another_book = Edition.objects.create(title="hi")
+        another_book.cover.save("another.JPG", ContentFile(image_data))
+
+        self.assertEqual(
+            book.cover.name,
+            f"covers/{hashlib.sha256(image_data).hexdigest()}.jpg",
+        )
+        self.assertEqual(another_book.cover.name, book.cover.name)
+        self.assertEqual(book.cover.get_references().count(), 2)
+
+        # the file stays while another book uses it
+        book.cover.delete()
+        self.assertFalse(book.cover)
+        self.assertTrue(another_book.cover.storage.exists(another_book.cover.name))
+
+        name = another_book.cover.name
+        another_book.cover.delete()
+        self.assertFalse(another_book.cover.storage.exists(name))
+
     def test_datetime_field(self, *_):
         """this one is pretty simple, it just has to use isoformat"""
         instance = fields.DateTimeField()
@@ -29,6 +29,64 @@ class ImportJob(TestCase):
     def setUp(self):
         self.job = models.ImportJob.objects.create(user=self.local_user, mappings={})
 
+    def test_item_counts(self):
+        """the job keeps count as items are added and worked through"""
+        items = [
+            models.ImportItem.objects.create(
+                index=i, job=self.job, data={}, normalized_data={}
+            )
+            for i in range(3)
+        ]
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.item_count, 3)
+        self.assertEqual(self.job.pending_item_count, 3)
+        self.assertEqual(self.job.percent_complete, 0)
+
+        items[0].fail_reason = "Could not find a match"
+        items[0].save()
+        # saving again doesn't count it twice
+        items[0].save()
+        item = models.ImportItem.objects.get(id=items[1].id)
+        item.fail_reason = "Could not find a match"
+        item.save()
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.failed_item_count, 2)
+        self.assertEqual(self.job.successful_item_count, 0)
+        self.assertEqual(self.job.pending_item_count, 1)
+        self.assertEqual(self.job.percent_complete, 66)
+
+        with patch("bookwyrm.models.import_job.app.control.revoke"):
+            self.job.stop_job()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.failed_item_count, 3)
+        self.assertEqual(self.job.pending_item_count, 0)
+
+    def test_reconcile_counts(self):
+        """jobs from before the counts were kept are counted up"""
+        models.ImportItem.objects.create(
+            index=1, job=self.job, data={}, normalized_data={}
+        )
+        models.ImportItem.objects.create(
+            index=2,
+            job=self.job,
+            data={},
+            normalized_data={},
+            fail_reason="Import stopped",
+        )
+        models.ImportJob.objects.filter(id=self.job.id).update(
+            total_items=None,
+            succeeded_items=None,
+            failed_items=None,
+            finished_items=None,
+        )
+        self.job.refresh_from_db()
+
+        self.assertEqual(self.job.item_count, 2)
+        self.assertEqual(self.job.pending_item_count, 1)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.finished_items, 1)
+
     def test_isbn(self):
         """it unquotes the isbn13 field from data"""
         item = models.ImportItem.objects.create(
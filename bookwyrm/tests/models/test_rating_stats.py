@@ -0,0 +1,153 @@
+""" counting up the reviews and ratings of a work """
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from bookwyrm import models
+from bookwyrm.models.rating_stats import get_histogram_index, refresh_rating_stats
+
+
+@patch("bookwyrm.activitystreams.add_status_task.delay")
+@patch("bookwyrm.activitystreams.remove_status_task.delay")
+@patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
+class WorkRatingStats(TestCase):
+    """the stats keep up with reviews as they change"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """a work with two editions"""
+        with patch("bookwyrm.suggested_users.rerank_suggestions_task.delay"), patch(
+            "bookwyrm.activitystreams.populate_stream_task.delay"
+        ), patch("bookwyrm.lists_stream.populate_lists_task.delay"):
+            cls.local_user = models.User.objects.create_user(
+                "mouse@local.com",
+                "mouse@mouse.mouse",
+                "password",
+                local=True,
+                localname="mouse",
+            )
+        cls.work = models.Work.objects.create(title="Work title")
+        cls.book = models.Edition.objects.create(title="Example", parent_work=cls.work)
+        cls.other_book = models.Edition.objects.create(
+            title="Another edition", parent_work=cls.work
+        )
+
+    def get_stats(self, work=None):
+        """the stats for a work, as they're saved"""
+        return models.WorkRatingStats.get_for_work((work or self.work).id)
+
+    def test_new_reviews(self, *_):
+        """reviews of any edition count towards the work"""
+        models.ReviewRating.objects.create(
+            user=self.local_user, book=self.book, rating=4
+        )
+        models.Review.objects.create(
+            user=self.local_user, book=self.other_book, rating=2.5, content="hi"
+        )
+        models.Review.objects.create(
+            user=self.local_user, book=self.book, content="no rating"
+        )
+
+        stats = self.get_stats()
+        self.assertEqual(stats.review_count, 3)
+        self.assertEqual(stats.rating_count, 2)
+        self.assertEqual(stats.rating_sum, Decimal("6.5"))
+        self.assertEqual(stats.rating, Decimal("3.25"))
+        self.assertEqual(stats.histogram, [0, 0, 0, 0, 1, 0, 0, 1, 0, 0])
+
+    def test_edit_rating(self, *_):
+        """a changed rating replaces the old one"""
+        review = models.Review.objects.create(
+            user=self.local_user, book=self.book, rating=1
+        )
+        review.rating = 5
+        review.save()
+
+        stats = self.get_stats()
+        self.assertEqual(stats.review_count, 1)
+        self.assertEqual(stats.rating, 5)
+        self.assertEqual(stats.histogram, [0, 0, 0, 0, 0, 0, 0, 0, 0, 1])
+
+    def test_private_reviews(self, *_):
+        """reviews that not everyone can see aren't counted"""
+        review = models.Review.objects.create(
+            user=self.local_user, book=self.book, rating=1, privacy="followers"
+        )
+        self.assertEqual(self.get_stats().review_count, 0)
+
+        review.privacy = "unlisted"
+        review.save()
+        self.assertEqual(self.get_stats().rating, 1)
+
+        review.privacy = "direct"
+        review.save()
+        stats = self.get_stats()
+        self.assertEqual(stats.review_count, 0)
+        self.assertIsNone(stats.rating)
+
+    def test_deleted_review(self, *_):
+        """a deleted review is taken away"""
+        review = models.ReviewRating.objects.create(
+            user=self.local_user, book=self.book, rating=3
+        )
+        other_review = models.ReviewRating.objects.create(
+            user=self.local_user, book=self.book, rating=4
+        )
+        # marked deleted
+        review.delete()
+
+        stats = self.get_stats()
+        self.assertEqual(stats.review_count, 1)
+        self.assertEqual(stats.rating, 4)
+
+        # removed from the database
+        models.Review.objects.filter(id=other_review.id).delete()
+        self.assertEqual(self.get_stats().review_count, 0)
+
+    def test_moved_review(self, *_):
+        """a review of a different book counts for that book's work instead"""
+        other_work = models.Work.objects.create(title="Another work")
+        other_book = models.Edition.objects.create(
+            title="Another book", parent_work=other_work
+        )
+        review = models.Review.objects.create(
+            user=self.local_user, book=self.book, rating=2
+        )
+        review.book = other_book
+        review.save()
+
+        self.assertEqual(self.get_stats().review_count, 0)
+        self.assertEqual(self.get_stats(other_work).rating, 2)
+
+    def test_refresh_rating_stats(self, *_):
+        """counting from scratch gets the same result"""
+        models.Review.objects.create(user=self.local_user, book=self.book, rating=2)
+        models.Review.objects.create(
+            user=self.local_user, book=self.other_book, rating=3
+        )
+        expected = self.get_stats()
+        models.WorkRatingStats.objects.filter(work=self.work).update(
+            review_count=10, rating_count=0, rating=None
+        )
+        empty_work = models.Work.objects.create(title="Not reviewed")
+        models.WorkRatingStats.objects.create(work=empty_work, review_count=2)
+
+        self.assertEqual(refresh_rating_stats(), 1)
+
+        stats = self.get_stats()
+        self.assertEqual(stats.review_count, expected.review_count)
+        self.assertEqual(stats.rating_count, expected.rating_count)
+        self.assertEqual(stats.rating, Decimal("2.5"))
+        self.assertEqual(stats.histogram, expected.histogram)
+        self.assertFalse(
+            models.WorkRatingStats.objects.filter(work=empty_work).exists()
+        )
+
+    def test_get_histogram_index(self, *_):
+        """ratings are counted by the half star"""
+        self.assertEqual(get_histogram_index(Decimal("0.5")), 0)
+        self.assertEqual(get_histogram_index(Decimal("3")), 5)
+        self.assertEqual(get_histogram_index(Decimal("3.24")), 5)
+        self.assertEqual(get_histogram_index(Decimal("3.25")), 6)
+        self.assertEqual(get_histogram_index(Decimal("5")), 9)
@@ -230,7 +230,7 @@ class Status(TestCase):
         self.assertEqual(activity["attachment"][0]["type"], "Document")
         self.assertTrue(
             re.match(
-                r"https:\/\/your.domain.here\/images\/covers\/test(_[A-z0-9]+)?.jpg",
+                r"https:\/\/your.domain.here\/images\/covers\/[0-9a-f]{64}.jpg",
                 activity["attachment"][0]["url"],
             )
         )
@@ -266,7 +266,7 @@ class Status(TestCase):
         self.assertEqual(activity["attachment"][0]["type"], "Document")
         # self.assertTrue(
         #    re.match(
-        #        r"https:\/\/your.domain.here\/images\/covers\/test_[A-z0-9]+.jpg",
+        #        r"https:\/\/your.domain.here\/images\/covers\/[0-9a-f]{64}.jpg",
         #        activity["attachment"][0].url,
         #    )
         # )
@@ -309,7 +309,7 @@ class Status(TestCase):
         self.assertEqual(activity["attachment"][0]["type"], "Document")
         self.assertTrue(
             re.match(
-                r"https:\/\/your.domain.here\/images\/covers\/test(_[A-z0-9]+)?.jpg",
+                r"https:\/\/your.domain.here\/images\/covers\/[0-9a-f]{64}.jpg",
                 activity["attachment"][0]["url"],
             )
         )
@@ -398,7 +398,7 @@ class Status(TestCase):
         self.assertEqual(activity["attachment"][0]["type"], "Document")
         self.assertTrue(
             re.match(
-                r"https:\/\/your.domain.here\/images\/covers\/test_[A-z0-9]+.jpg",
+                r"https:\/\/your.domain.here\/images\/covers\/[0-9a-f]{64}.jpg",
                 activity["attachment"][0]["url"],
             )
         )
@@ -423,7 +423,7 @@ class Status(TestCase):
         self.assertEqual(activity["attachment"][0]["type"], "Document")
         self.assertTrue(
             re.match(
-                r"https:\/\/your.domain.here\/images\/covers\/test_[A-z0-9]+.jpg",
+                r"https:\/\/your.domain.here\/images\/covers\/[0-9a-f]{64}.jpg",
                 activity["attachment"][0]["url"],
             )
         )
@@ -446,7 +446,7 @@ class Status(TestCase):
         self.assertEqual(activity["attachment"][0]["type"], "Document")
         self.assertTrue(
             re.match(
-                r"https:\/\/your.domain.here\/images\/covers\/test_[A-z0-9]+.jpg",
+                r"https:\/\/your.domain.here\/images\/covers\/[0-9a-f]{64}.jpg",
                 activity["attachment"][0]["url"],
             )
         )
@@ -0,0 +1,136 @@
+""" sending activities to other servers """
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from django.test import TestCase
+
+from bookwyrm import broadcast, models
+
+
+@patch("bookwyrm.broadcast.deliver_task.apply_async")
+@patch("bookwyrm.broadcast.r")
+class Broadcast(TestCase):
+    """collecting activities and delivering them per server"""
+
+    @classmethod
+    def setUpTestData(self):  # pylint: disable=bad-classmethod-argument
+        """a user to send from"""
+        with patch("bookwyrm.suggested_users.rerank_suggestions_task.delay"), patch(
+            "bookwyrm.activitystreams.populate_stream_task.delay"
+        ), patch("bookwyrm.lists_stream.populate_lists_task.delay"):
+            self.local_user = models.User.objects.create_user(
+                "mouse", "mouse@mouse.com", "mouseword", local=True, localname="mouse"
+            )
+
+    def test_broadcast_task_queues(self, mock_redis, mock_deliver):
+        """activities wait to be sent with others for the same server"""
+        mock_redis.set.return_value = True
+        with patch("bookwyrm.broadcast.asyncio.run") as mock_run:
+            broadcast.broadcast_task(
+                self.local_user.id,
+                "{}",
+                [
+                    "https://a.example/inbox",
+                    "https://a.example/user/inbox",
+                    "https://b.example/inbox",
+                ],
+            )
+        self.assertFalse(mock_run.called)
+
+        pipeline = mock_redis.pipeline.return_value
+        self.assertEqual(pipeline.rpush.call_count, 2)
+        args = pipeline.rpush.call_args_list[0][0]
+        self.assertEqual(args[0], "broadcast-queue-a.example")
+        self.assertEqual(len(args), 3)
+        self.assertEqual(
+            json.loads(args[1]), [self.local_user.id, "https://a.example/inbox", "{}"]
+        )
+
+        self.assertEqual(mock_deliver.call_count, 2)
+        self.assertEqual(mock_deliver.call_args_list[0][1]["args"], ("a.example",))
+        self.assertEqual(mock_deliver.call_args_list[0][1]["countdown"], 2)
+
+    def test_broadcast_task_already_scheduled(self, mock_redis, mock_deliver):
+        """only one task waits for a server at a time"""
+        mock_redis.set.return_value = None
+        broadcast.broadcast_task(self.local_user.id, "{}", ["https://a.example/inbox"])
+        self.assertTrue(mock_redis.pipeline.return_value.rpush.called)
+        self.assertFalse(mock_deliver.called)
+
+    def test_broadcast_many_task(self, mock_redis, _):
+        """a batch of activities from one user is queued in one go"""
+        mock_redis.set.return_value = None
+        broadcast.broadcast_many_task(
+            self.local_user.id,
+            [("{}", ["https://a.example/inbox"]), ("[]", ["https://b.example/inbox"])],
+        )
+        self.assertEqual(mock_redis.pipeline.return_value.rpush.call_count, 2)
+
+    def test_deliver_task(self, mock_redis, mock_deliver):
+        """send what's waiting for a server"""
+        item = json.dumps([self.local_user.id, "https://a.example/inbox", "{}"])
+        missing = json.dumps(
+            [self.local_user.id + 100, "https://a.example/inbox", "{}"]
+        )
+        mock_redis.pipeline.return_value.execute.return_value = [
+            [item, item, missing],
+            True,
+            0,
+        ]
+        with patch("bookwyrm.broadcast.async_deliver", MagicMock()) as mock_send, patch(
+            "bookwyrm.broadcast.asyncio.run"
+        ):
+            broadcast.deliver_task("a.example")
+
+        mock_redis.delete.assert_called_once_with("broadcast-scheduled-a.example")
+        self.assertFalse(mock_deliver.called)
+        # the duplicate is dropped, and so is the sender that doesn't exist
+        self.assertEqual(
+            mock_send.call_args[0][0],
+            [(self.local_user, "https://a.example/inbox", "{}")],
+        )
+
+    def test_deliver_task_remaining(self, mock_redis, mock_deliver):
+        """a full batch goes out and the rest follows right away"""
+        mock_redis.set.return_value = True
+        mock_redis.pipeline.return_value.execute.return_value = [[], True, 5]
+        with patch("bookwyrm.broadcast.asyncio.run"):
+            broadcast.deliver_task("a.example")
+        self.assertEqual(mock_deliver.call_args[1]["countdown"], 0)
+
+    def test_get_delivery_order_key(self, *_):
+        """activities are kept in order by the object they're about"""
+        self.assertEqual(
+            broadcast.get_delivery_order_key(
+                json.dumps({"id": "a", "object": {"id": "b"}})
+            ),
+            "b",
+        )
+        self.assertEqual(
+            broadcast.get_delivery_order_key(json.dumps({"id": "a", "object": "c"})),
+            "c",
+        )
+        self.assertEqual(broadcast.get_delivery_order_key(json.dumps({"id": "a"})), "a")
+
+    def test_async_deliver(self, *_):
+        """each object's activities go out in order, with one digest each"""
+        create = json.dumps({"id": "create", "object": {"id": "status"}})
+        delete = json.dumps({"id": "delete", "object": {"id": "status"}})
+        deliveries = [
+            (self.local_user, "https://a.example/inbox", create),
+            (self.local_user, "https://a.example/user/inbox", create),
+            (self.local_user, "https://a.example/inbox", delete),
+        ]
+        with patch("bookwyrm.broadcast.sign_and_send", AsyncMock()) as mock_send, patch(
+            "bookwyrm.broadcast.make_digest", return_value="digest"
+        ) as mock_digest:
+            asyncio.run(broadcast.async_deliver(deliveries))
+
+        self.assertEqual(mock_digest.call_count, 2)
+        self.assertEqual(
+            [call[0][2:] for call in mock_send.call_args_list],
+            [(create, recipient) for _, recipient, _ in deliveries[:2]]
+            + [(delete, "https://a.example/inbox")],
+        )
+        self.assertEqual(mock_send.call_args[1]["digest"], "digest")
@@ -0,0 +1,67 @@
+""" the usage counts snapshot """
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from bookwyrm import instance_stats, models
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class InstanceStats(TestCase):
+    """counting things up once in a while"""
+
+    @classmethod
+    def setUpTestData(self):  # pylint: disable=bad-classmethod-argument
+        """a user to count"""
+        with patch("bookwyrm.suggested_users.rerank_suggestions_task.delay"), patch(
+            "bookwyrm.activitystreams.populate_stream_task.delay"
+        ), patch("bookwyrm.lists_stream.populate_lists_task.delay"):
+            models.User.objects.create_user(
+                "mouse", "mouse@mouse.mouse", "password", local=True, localname="mouse"
+            )
+        models.FederatedServer.objects.create(server_name="test.server")
+
+    def setUp(self):
+        """start without a snapshot"""
+        cache.clear()
+
+    def test_compute_instance_stats(self):
+        """the counts"""
+        stats = instance_stats.compute_instance_stats()
+        self.assertEqual(stats["users"], 1)
+        self.assertEqual(stats["active_month"], 1)
+        self.assertEqual(stats["active_halfyear"], 1)
+        self.assertEqual(stats["statuses"], 0)
+        self.assertEqual(stats["works"], 0)
+        self.assertEqual(stats["peers"], ["test.server"])
+
+    def test_get_instance_stats(self):
+        """counted once, then served from the snapshot"""
+        with patch(
+            "bookwyrm.instance_stats.refresh_instance_stats_task.delay"
+        ) as mock_task:
+            self.assertEqual(instance_stats.get_instance_stats()["users"], 1)
+            with self.assertNumQueries(0):
+                self.assertEqual(instance_stats.get_instance_stats()["users"], 1)
+        self.assertFalse(mock_task.called)
+
+    def test_get_instance_stats_stale(self):
+        """an old snapshot is used while a task replaces it"""
+        stats = instance_stats.compute_instance_stats()
+        stats["computed"] = 0
+        cache.set(instance_stats.CACHE_KEY, stats)
+
+        with patch(
+            "bookwyrm.instance_stats.refresh_instance_stats_task.delay"
+        ) as mock_task:
+            with self.assertNumQueries(0):
+                self.assertEqual(instance_stats.get_instance_stats(), stats)
+            instance_stats.get_instance_stats()
+        # only one refresh at a time
+        self.assertEqual(mock_task.call_count, 1)
+
+        instance_stats.refresh_instance_stats_task()
+        self.assertNotEqual(instance_stats.get_instance_stats()["computed"], 0)
@@ -1,4 +1,6 @@
 """ test generating preview images """
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 import pathlib
 from unittest.mock import patch
 from PIL import Image
@@ -10,10 +12,16 @@ from django.db.models.fields.files import ImageFieldFile
 
 from bookwyrm import models, settings
 from bookwyrm.preview_images import (
+    generate_instance_layer,
     generate_site_preview_image_task,
     generate_edition_preview_image_task,
     generate_user_preview_image_task,
     generate_preview_image,
+    generate_preview_images_batch,
+    get_dominant_color,
+    get_edition_preview_inputs,
+    get_star_rating,
+    queue_edition_preview_image,
     remove_user_preview_image_task,
     save_and_cleanup,
 )
@@ -22,6 +30,7 @@ from bookwyrm.preview_images import (
 # pylint: disable=unused-argument
 # pylint: disable=missing-function-docstring
 # pylint: disable=consider-using-with
+@patch("bookwyrm.preview_images.r")
 class PreviewImages(TestCase):
     """every response to a get request, html or json"""
 
@@ -177,3 +186,95 @@ class PreviewImages(TestCase):
         self.remote_user_with_preview.refresh_from_db()
 
         self.assertFalse(self.remote_user_with_preview.preview_image)
+
+    def test_get_dominant_color(self, *args, **kwargs):
+        """the color comes from a small copy, and is remembered by file hash"""
+        image = Image.new("RGB", (600, 900), color="#0000F0")
+        with patch("bookwyrm.preview_images.django_cache") as cache_mock:
+            cache_mock.get.return_value = None
+            color = get_dominant_color(image, "abc")
+        # it's close enough, color thief quantizes
+        self.assertGreater(color[2], 200)
+        self.assertLess(color[0], 20)
+        self.assertEqual(
+            cache_mock.set.call_args[0][:2], ("preview-image-color-abc", color)
+        )
+
+        with patch("bookwyrm.preview_images.django_cache") as cache_mock:
+            cache_mock.get.return_value = [1, 2, 3]
+            self.assertEqual(get_dominant_color(image, "abc"), (1, 2, 3))
+
+    def test_generate_instance_layer(self, *args, **kwargs):
+        """the instance layer is only drawn again when the site changes"""
+        layer = generate_instance_layer(500)
+        self.assertIs(generate_instance_layer(500), layer)
+
+        self.site.name = "Another name"
+        self.site.save()
+        self.assertIsNot(generate_instance_layer(500), layer)
+
+    def test_edition_preview_unchanged(self, *args, **kwargs):
+        """a preview isn't drawn again if nothing that goes into it changed"""
+        generate_edition_preview_image_task(self.edition.id)
+        self.edition.refresh_from_db()
+        self.assertIsNotNone(self.edition.preview_image_fingerprint)
+
+        with patch("bookwyrm.preview_images.generate_preview_image") as generate_mock:
+            generate_edition_preview_image_task(self.edition.id)
+        self.assertFalse(generate_mock.called)
+
+        self.edition.title = "Another Title"
+        self.edition.save(broadcast=False)
+        with patch(
+            "bookwyrm.preview_images.generate_preview_image",
+            return_value=Image.new("RGB", (10, 10)),
+        ) as generate_mock:
+            generate_edition_preview_image_task(self.edition.id)
+        self.assertTrue(generate_mock.called)
+
+    def test_generate_preview_images_batch(self, *args, **kwargs):
+        """a batch of books is rendered together and stored in bulk"""
+        book = models.Book.objects.get(id=self.edition.id)
+        previews = {book: get_edition_preview_inputs(book, 4)}
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(
+                generate_preview_images_batch(models.Book, previews, executor), 1
+            )
+            self.edition.refresh_from_db()
+            self.assertEqual(
+                self.edition.preview_image.width, settings.PREVIEW_IMG_WIDTH
+            )
+            self.assertEqual(
+                self.edition.preview_image_fingerprint,
+                book.preview_image_fingerprint,
+            )
+
+            # it's up to date now
+            book = models.Book.objects.get(id=self.edition.id)
+            previews = {book: get_edition_preview_inputs(book, 4)}
+            self.assertEqual(
+                generate_preview_images_batch(models.Book, previews, executor), 0
+            )
+
+    def test_queue_edition_preview_image(self, mock_redis, *args):
+        """a book waiting to be redrawn isn't queued again"""
+        mock_redis.set.return_value = True
+        with patch(
+            "bookwyrm.preview_images.generate_edition_preview_image_task.apply_async"
+        ) as mock_task:
+            queue_edition_preview_image(self.edition.id)
+            mock_redis.set.return_value = None
+            queue_edition_preview_image(self.edition.id)
+
+        self.assertEqual(mock_task.call_count, 1)
+        self.assertEqual(mock_task.call_args[1]["args"], (self.edition.id,))
+        self.assertEqual(
+            mock_task.call_args[1]["countdown"], settings.PREVIEW_RATING_DELAY
+        )
+
+    def test_get_star_rating(self, *args):
+        """ratings that are drawn the same are the same"""
+        self.assertEqual(get_star_rating(Decimal("4.2")), 4.5)
+        self.assertEqual(get_star_rating(Decimal("4.9")), 4.5)
+        self.assertEqual(get_star_rating(Decimal("4.0")), 4)
+        self.assertIsNone(get_star_rating(None))
@@ -0,0 +1,89 @@
+""" generating thumbnails in the background """
+from io import BytesIO
+import pathlib
+from unittest.mock import patch
+
+import pytest
+
+from PIL import Image
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from bookwyrm import models, thumbnail_generation
+from bookwyrm.settings import ENABLE_THUMBNAIL_GENERATION
+from bookwyrm.templatetags import utilities
+
+
+@pytest.mark.skipif(
+    not ENABLE_THUMBNAIL_GENERATION,
+    reason="Thumbnail generation disabled in settings",
+)
+@patch("bookwyrm.thumbnail_generation.generate_thumbnails_task.delay")
+class ThumbnailGeneration(TestCase):
+    """thumbnails are made in a task, not while a page renders"""
+
+    def setUp(self):
+        """a book with a cover"""
+        image_file = pathlib.Path(__file__).parent.joinpath(
+            "../static/images/default_avi.jpg"
+        )
+        image = Image.open(image_file)
+        output = BytesIO()
+        image.save(output, format=image.format)
+        self.cover = output.getvalue()
+        self.book = models.Edition.objects.create(title="hello")
+
+    def test_source_saved(self, mock_task):
+        """a new cover queues its thumbnails"""
+        self.book.cover.save("test.jpg", ContentFile(self.cover))
+        mock_task.assert_called_with("bookwyrm.Edition", self.book.id, "cover")
+
+    def test_get_book_cover_thumbnail_missing(self, mock_task):
+        """the full size cover is used until the thumbnail exists"""
+        self.book.cover.save("test.jpg", ContentFile(self.cover))
+        # covers are shared, so another test may have made the thumbnail
+        thumbnail = self.book.cover_bw_book_small_webp
+        if thumbnail.storage.exists(thumbnail.name):
+            thumbnail.storage.delete(thumbnail.name)
+        mock_task.reset_mock()
+
+        url = utilities.get_book_cover_thumbnail(self.book, "small", "webp")
+
+        self.assertEqual(url, self.book.cover.url)
+        self.assertTrue(mock_task.called)
+
+    def test_generate_thumbnails(self, mock_task):
+        """the task makes every size, and then they're used"""
+        self.book.cover.save("test.jpg", ContentFile(self.cover))
+        mock_task.reset_mock()
+
+        thumbnail_generation.generate_thumbnails_task(
+            "bookwyrm.Edition", self.book.id, "cover"
+        )
+        book = models.Edition.objects.get(id=self.book.id)
+
+        url = utilities.get_book_cover_thumbnail(book, "small", "webp")
+        self.assertNotEqual(url, book.cover.url)
+        self.assertEqual(url, book.cover_bw_book_small_webp.url)
+        self.assertTrue(
+            book.cover_bw_book_xxlarge_jpg.storage.exists(
+                book.cover_bw_book_xxlarge_jpg.name
+            )
+        )
+        self.assertFalse(mock_task.called)
+
+    def test_get_book_cover_thumbnail_no_cover(self, mock_task):
+        """a book without a cover gets the placeholder"""
+        url = utilities.get_book_cover_thumbnail(self.book, "small", "webp")
+        self.assertTrue(url.endswith("images/no_cover.jpg"))
+        self.assertFalse(mock_task.called)
+
+    def test_get_thumbnail_names(self, _):
+        """every size and format of the cover"""
+        names = thumbnail_generation.get_thumbnail_names(models.Edition, "cover")
+        self.assertEqual(len(names), 12)
+        self.assertIn("cover_bw_book_small_webp", names)
+        self.assertEqual(
+            thumbnail_generation.get_thumbnail_names(models.Edition, "preview_image"),
+            (),
+        )
@@ -0,0 +1,33 @@
+"""reading json a piece at a time"""
+import json
+from io import BytesIO
+
+from bookwyrm.utils.json_stream import JsonStream, iter_array, iter_json_array
+
+
+def test_iter_json_array():
+    """the array is read item by item, and the rest is collected"""
+    data = {"name": "mouse", "books": [{"title": "é" * 5}, 12345], "goals": [1]}
+    other_values = {}
+    items = iter_json_array(
+        BytesIO(json.dumps(data, ensure_ascii=False).encode("utf-8")),
+        "books",
+        other_values,
+    )
+    assert list(items) == data["books"]
+    assert other_values == {"name": "mouse", "goals": [1]}
+
+
+def test_json_stream_small_reads():
+    """values that are split between reads are put back together"""
+    data = [{"title": "é" * 5, "pages": 12345}, None, "text"]
+    stream = JsonStream(
+        BytesIO(json.dumps(data, ensure_ascii=False).encode("utf-8")), read_size=3
+    )
+    assert list(iter_array(stream)) == data
+
+
+def test_iter_json_array_empty():
+    """nothing to read"""
+    assert not list(iter_json_array(BytesIO(b'{"books": []}'), "books", {}))
+    assert not list(iter_json_array(BytesIO(b"{}"), "books", {}))
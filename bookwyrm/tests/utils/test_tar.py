@@ -1,3 +1,4 @@
+from io import BytesIO
 import os
 import pytest
 from bookwyrm.utils.tar import BookwyrmTarFile
@@ -23,3 +24,10 @@ def write_tar():
 
 def test_write_bytes(write_tar):
     write_tar.write_bytes(b"ABCDEF")
+
+
+def test_write_json_file(write_tar):
+    json_file = BytesIO(b"{}")
+    json_file.seek(0, 2)
+    write_tar.write_json_file(json_file)
+    assert write_tar.getmember("archive.json").size == 2
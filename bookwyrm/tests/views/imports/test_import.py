@@ -90,11 +90,16 @@ class ImportViews(TestCase):
         request = self.factory.post("", form.data)
         request.user = self.local_user
 
-        with patch("bookwyrm.models.import_job.ImportJob.start_job"):
+        with patch("bookwyrm.importers.importer.ingest_import_task.delay") as mock:
             view(request)
         job = models.ImportJob.objects.get()
         self.assertFalse(job.include_reviews)
         self.assertEqual(job.privacy, "public")
+        # the rows are read later
+        self.assertEqual(mock.call_args[0][0], job.id)
+        self.assertTrue(job.import_file)
+        self.assertFalse(job.items.exists())
+        job.import_file.delete()
 
     def test_retry_item(self):
         """try again on a single row"""
@@ -3,9 +3,10 @@ import json
 import pathlib
 from unittest.mock import patch
 
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.http import HttpResponseNotAllowed, HttpResponseNotFound
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.test.client import RequestFactory
 
 from bookwyrm import models, views
@@ -128,6 +129,107 @@ class Inbox(TestCase):
                 )
         self.assertEqual(result.status_code, 200)
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_inbox_duplicate(self):
+        """an activity we've already accepted is acknowledged and dropped"""
+        cache.clear()
+        activity = self.create_json
+        activity["id"] = "https://example.com/users/rat/statuses/1/activity"
+        activity["actor"] = "https://example.com/users/rat"
+        with patch("bookwyrm.views.inbox.has_valid_signature") as mock_valid, patch(
+            "bookwyrm.views.inbox.sometimes_async_activity_task"
+        ) as mock_task:
+            mock_valid.return_value = True
+            first = self.client.post(
+                "/inbox", json.dumps(activity), content_type="application/json"
+            )
+            second = self.client.post(
+                "/inbox", json.dumps(activity), content_type="application/json"
+            )
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 202)
+        self.assertEqual(mock_valid.call_count, 1)
+        self.assertEqual(mock_task.call_count, 1)
+        self.assertEqual(
+            views.inbox.get_duplicate_count("example.com", verified=False), 1
+        )
+
+        # a verified copy that raced the first one is counted against the sender
+        self.assertFalse(views.inbox.mark_activity_received(activity))
+        self.assertEqual(views.inbox.get_duplicate_count("example.com"), 1)
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_inbox_duplicate_unverified(self):
+        """activities aren't remembered until we know who sent them"""
+        cache.clear()
+        with patch("bookwyrm.views.inbox.has_valid_signature") as mock_valid:
+            mock_valid.return_value = False
+            result = self.client.post(
+                "/inbox", json.dumps(self.create_json), content_type="application/json"
+            )
+        self.assertEqual(result.status_code, 401)
+        self.assertFalse(views.inbox.is_duplicate_activity(self.create_json))
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_inbox_duplicate_failed(self):
+        """an activity we couldn't handle can be retried"""
+        cache.clear()
+        with patch("bookwyrm.views.inbox.has_valid_signature") as mock_valid, patch(
+            "bookwyrm.views.inbox.sometimes_async_activity_task"
+        ) as mock_task:
+            mock_valid.return_value = True
+            mock_task.side_effect = ValueError()
+            with self.assertRaises(ValueError):
+                self.client.post(
+                    "/inbox",
+                    json.dumps(self.create_json),
+                    content_type="application/json",
+                )
+        self.assertFalse(views.inbox.is_duplicate_activity(self.create_json))
+
+    def test_get_activity_cache_key(self):
+        """activities are identified by id, or by content if they lack one"""
+        self.assertEqual(
+            views.inbox.get_activity_cache_key(self.create_json), "inbox-activity-hi"
+        )
+
+        activity = {"type": "Like", "actor": "hi", "object": "exists"}
+        key = views.inbox.get_activity_cache_key(activity)
+        self.assertTrue(key.startswith("inbox-activity-"))
+        self.assertEqual(
+            key,
+            views.inbox.get_activity_cache_key(
+                {"object": "exists", "actor": "hi", "type": "Like"}
+            ),
+        )
+        self.assertNotEqual(
+            key,
+            views.inbox.get_activity_cache_key(
+                {"type": "Like", "actor": "hi", "object": "other"}
+            ),
+        )
+
+        # an id from another server isn't trusted
+        activity = {
+            "id": "https://example.com/users/rat/statuses/1/activity",
+            "type": "Like",
+            "actor": "https://evil.example/users/rat",
+            "object": "exists",
+        }
+        key = views.inbox.get_activity_cache_key(activity)
+        self.assertNotEqual(key, f"inbox-activity-{activity['id']}")
+        activity["actor"] = "https://example.com/users/rat"
+        self.assertEqual(
+            views.inbox.get_activity_cache_key(activity),
+            f"inbox-activity-{activity['id']}",
+        )
+
     def test_is_blocked_user_agent(self):
         """check for blocked servers"""
         request = self.factory.post(
@@ -87,6 +87,7 @@ class WellknownViews(TestCase):
         self.assertIsInstance(result, JsonResponse)
         self.assertEqual(data["software"]["name"], "bookwyrm")
         self.assertEqual(data["usage"]["users"]["total"], 2)
+        self.assertIn("max-age", result["Cache-Control"])
         self.assertEqual(models.User.objects.count(), 3)
 
     def test_instanceinfo(self):
@@ -1,20 +1,86 @@
 """thumbnail generation strategy for django-imagekit"""
+from functools import cache
+import inspect
+
+from django.apps import apps
+from django.core.cache import cache as django_cache
+from imagekit.models.fields.utils import ImageSpecFileDescriptor
+
+from bookwyrm.tasks import app, IMAGES
+
+# how long to wait for a queued task before queueing another one
+PENDING_TIMEOUT = 60 * 10
 
 
 class Strategy:
     """
-    A strategy that generates the image on source saved (Optimistic),
-    but also on demand, for old images (JustInTime).
+    A strategy that generates the images in a task when the source is saved,
+    and on demand for old images, instead of while a page is rendering.
     """
 
     def on_source_saved(self, file):  # pylint: disable=no-self-use
         """What happens on source saved"""
-        file.generate()
+        queue_thumbnails(file.generator.source)
 
     def on_existence_required(self, file):  # pylint: disable=no-self-use
         """What happens on existence required"""
-        file.generate()
+        if not file.cachefile_backend.exists(file):
+            queue_thumbnails(file.generator.source)
 
     def on_content_required(self, file):  # pylint: disable=no-self-use
-        """What happens on content required"""
+        """What happens on content required, which can't wait for a task"""
         file.generate()
+
+    # pylint: disable=no-self-use,unused-argument
+    def should_verify_existence(self, file):
+        """the file may still be waiting for its task"""
+        return True
+
+
+def get_pending_key(model_label, instance_id, field_name):
+    """marks that the thumbnails for an image are waiting to be generated"""
+    return f"thumbnails-pending-{model_label}-{instance_id}-{field_name}"
+
+
+def queue_thumbnails(source):
+    """generate all the thumbnails of an image in one task"""
+    if not source:
+        return
+    # pylint: disable=protected-access
+    args = (source.instance._meta.label, source.instance.id, source.field.name)
+    if django_cache.add(get_pending_key(*args), 1, timeout=PENDING_TIMEOUT):
+        generate_thumbnails_task.delay(*args)
+
+
+@app.task(queue=IMAGES, ignore_result=True)
+def generate_thumbnails_task(model_label, instance_id, field_name):
+    """generate the thumbnails that are missing for an image"""
+    django_cache.delete(get_pending_key(model_label, instance_id, field_name))
+    instance = apps.get_model(model_label).objects.filter(id=instance_id).first()
+    if instance:
+        generate_thumbnails(instance, field_name)
+
+
+def generate_thumbnails(instance, field_name="cover"):
+    """generate the thumbnails that are missing for an image, right now.
+    returns how many there are"""
+    if not getattr(instance, field_name):
+        return 0
+    names = get_thumbnail_names(type(instance), field_name)
+    for name in names:
+        getattr(instance, name).generate()
+    return len(names)
+
+
+@cache
+def get_thumbnail_names(model, field_name):
+    """the attributes of a model that are thumbnails of one of its images"""
+    return tuple(
+        name
+        for name in dir(model)
+        if isinstance(
+            descriptor := inspect.getattr_static(model, name, None),
+            ImageSpecFileDescriptor,
+        )
+        and descriptor.source_field_name == field_name
+    )
@@ -16,3 +16,13 @@ def get_or_set(
         value = function(*args)
         cache.set(cache_key, value, timeout=timeout)
     return value
+
+
+def incr(cache_key: str, delta: int = 1, timeout: Union[float, None] = None) -> int:
+    """increment a counter in the cache, creating it if it isn't there yet"""
+    cache.add(cache_key, 0, timeout=timeout)
+    try:
+        return cache.incr(cache_key, delta)
+    except ValueError:
+        # the key was evicted in between (or the cache doesn't store anything)
+        return 0
@@ -0,0 +1,104 @@
+"""read large json documents from a file a piece at a time"""
+import codecs
+import json
+from typing import Any, IO, Iterator
+
+# how much of the file to read at once
+READ_SIZE = 64 * 1024
+WHITESPACE = " \t\n\r"
+
+
+class JsonStream:
+    """a json document that's decoded as it's read from a binary file"""
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, fileobj: IO[bytes], read_size: int = READ_SIZE) -> None:
+        self.fileobj = fileobj
+        self.read_size = read_size
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+        self.finished = False
+
+    def fill(self) -> bool:
+        """read more of the file, dropping what's already been decoded"""
+        if self.finished:
+            return False
+        data = self.fileobj.read(self.read_size)
+        self.finished = not data
+        self.buffer = self.buffer[self.position :] + self.text_decoder.decode(
+            data, final=self.finished
+        )
+        self.position = 0
+        return not self.finished
+
+    def peek(self) -> str:
+        """the next character that isn't whitespace, without moving past it"""
+        while True:
+            while (
+                self.position < len(self.buffer)
+                and self.buffer[self.position] in WHITESPACE
+            ):
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                raise ValueError("Unexpected end of json")
+
+    def expect(self, char: str) -> None:
+        """move past the next character, which has to be this one"""
+        if (found := self.peek()) != char:
+            raise ValueError(f"Expected {char!r} in json but found {found!r}")
+        self.position += 1
+
+    def value(self) -> Any:
+        """decode the next value, reading more of the file until it's all there"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # a number at the end of the buffer may go on in the next read
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.position = end
+            return value
+
+
+def iter_json_array(
+    fileobj: IO[bytes], key: str, other_values: dict[str, Any]
+) -> Iterator[Any]:
+    """the items in one array of a json object, decoded one at a time. the
+    object's other values are put in other_values as they're read"""
+    stream = JsonStream(fileobj)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        name = stream.value()
+        stream.expect(":")
+        if name == key and stream.peek() == "[":
+            yield from iter_array(stream)
+        else:
+            other_values[name] = stream.value()
+        if stream.peek() == "}":
+            return
+        stream.expect(",")
+
+
+def iter_array(stream: JsonStream) -> Iterator[Any]:
+    """the items of the array that's next in the stream"""
+    stream.expect("[")
+    if stream.peek() == "]":
+        stream.expect("]")
+        return
+    while True:
+        yield stream.value()
+        if stream.peek() == "]":
+            stream.expect("]")
+            return
+        stream.expect(",")
@@ -1,7 +1,7 @@
 """manage tar files for user exports"""
 import io
 import tarfile
-from typing import Any, Optional
+from typing import Any, IO, Optional
 from uuid import uuid4
 from django.core.files import File
 
@@ -16,6 +16,17 @@ class BookwyrmTarFile(tarfile.TarFile):
         info.size = len(data)
         self.addfile(info, fileobj=buffer)
 
+    def write_json_file(self, fileobj: IO[bytes]) -> None:
+        """Add the archive json from a file, without reading it into memory"""
+        self.write_file("archive.json", fileobj)
+
+    def write_file(self, filename: str, fileobj: IO[bytes]) -> None:
+        """Add a file that has just been written, from its start to where it's at"""
+        info = tarfile.TarInfo(filename)
+        info.size = fileobj.tell()
+        fileobj.seek(0)
+        self.addfile(info, fileobj=fileobj)
+
     def add_image(
         self, image: Any, filename: Optional[str] = None, directory: Any = ""
     ) -> None:
@@ -18,6 +18,7 @@ from django_celery_beat.models import PeriodicTask, IntervalSchedule
 from csp.decorators import csp_update
 
 from bookwyrm import forms, models, settings
+from bookwyrm.instance_stats import get_instance_stats
 from bookwyrm.utils import regex
 
 
@@ -155,16 +156,15 @@ def get_charts_and_stats(request):
             ).count()
         },
     )
+    stats = get_instance_stats()
     return {
         "start": start.strftime("%Y-%m-%d"),
         "end": end.strftime("%Y-%m-%d"),
         "interval": interval,
-        "users": user_queryset.filter(is_active=True).count(),
-        "active_users": user_queryset.filter(
-            is_active=True, last_active_date__gte=now - timedelta(days=31)
-        ).count(),
-        "statuses": status_queryset.count(),
-        "works": models.Work.objects.count(),
+        "users": stats["users"],
+        "active_users": stats["active_month"],
+        "statuses": stats["statuses"],
+        "works": stats["works"],
         "reports": models.Report.objects.filter(resolved=False).count(),
         "pending_domains": models.LinkDomain.objects.filter(status="pending").count(),
         "invite_requests": models.InviteRequest.objects.filter(
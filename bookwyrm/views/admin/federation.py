@@ -10,8 +10,10 @@ from django.views import View
 from django.views.decorators.http import require_POST
 
 from bookwyrm import forms, models
+from bookwyrm.connectors import fetch_cache
 from bookwyrm.settings import PAGE_LENGTH
 from bookwyrm.models.user import get_or_create_remote_server
+from bookwyrm.views.inbox import get_duplicate_count
 
 
 # pylint: disable= no-self-use
@@ -66,6 +68,7 @@ class Federation(View):
             .distinct()
             .order_by("application_type"),
             "form": forms.ServerForm(),
+            "fetch_stats": fetch_cache.get_stats(),
         }
         return TemplateResponse(request, "settings/federation/instance_list.html", data)
 
@@ -149,6 +152,10 @@ class FederatedServer(View):
             "blocked_by_us": models.UserBlocks.objects.filter(
                 user_subject__in=users.all()
             ),
+            "duplicate_activities": get_duplicate_count(server.server_name),
+            "unverified_duplicate_activities": get_duplicate_count(
+                server.server_name, verified=False
+            ),
         }
         return TemplateResponse(request, "settings/federation/instance.html", data)
 
@@ -3,7 +3,7 @@ from uuid import uuid4
 
 from django.contrib.auth.decorators import login_required, permission_required
 from django.core.paginator import Paginator
-from django.db.models import Avg, Q
+from django.db.models import Q
 from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect
 from django.template.response import TemplateResponse
@@ -28,7 +28,7 @@ class Book(View):
             book = get_object_or_404(
                 models.Book.objects.select_subclasses(), id=book_id
             )
-            return ActivitypubResponse(book.to_activity())
+            return ActivitypubResponse(serialized=book.to_activity_json())
 
         user_statuses = (
             kwargs.get("user_statuses", False)
@@ -74,6 +74,7 @@ class Book(View):
         queryset = queryset.select_related("user").order_by("-published_date")
         paginated = Paginator(queryset, PAGE_LENGTH)
 
+        stats = models.WorkRatingStats.get_for_work(book.parent_work.id)
         lists = models.List.privacy_filter(request.user,).filter(
             listitem__approved=True,
             listitem__book__in=book.parent_work.editions.all(),
@@ -81,13 +82,13 @@ class Book(View):
         data = {
             "book": book,
             "statuses": paginated.get_page(request.GET.get("page")),
-            "review_count": reviews.count(),
+            "review_count": stats.review_count,
             "ratings": reviews.filter(
                 Q(content__isnull=True) | Q(content="")
             ).select_related("user")
             if not user_statuses
             else None,
-            "rating": reviews.aggregate(Avg("rating"))["rating__avg"],
+            "rating": stats.rating,
             "lists": lists,
             "update_error": kwargs.get("update_error", False),
         }
@@ -144,7 +144,9 @@ class Status(View):
 
         if is_api_request(request):
             return ActivitypubResponse(
-                status.to_activity(pure=not is_bookwyrm_request(request))
+                serialized=status.to_activity_json(
+                    pure=not is_bookwyrm_request(request)
+                )
             )
 
         if redirect_local_path := maybe_redirect_local_path(request, status):
@@ -1,5 +1,4 @@
 """ import books from another app """
-from io import TextIOWrapper
 import datetime
 
 from django.contrib.auth.decorators import login_required
@@ -96,17 +95,13 @@ class Import(View):
             importer = GoodreadsImporter()
 
         try:
-            job = importer.create_job(
-                request.user,
-                TextIOWrapper(request.FILES["csv_file"], encoding=importer.encoding),
-                include_reviews,
-                privacy,
+            # the rows are read in a task, which then starts the import
+            job = importer.queue_job(
+                request.user, request.FILES["csv_file"], include_reviews, privacy
             )
         except (UnicodeDecodeError, ValueError, KeyError):
             return self.get(request, invalid=True)
 
-        job.start_job()
-
         return redirect(f"/import/{job.id}")
 
 
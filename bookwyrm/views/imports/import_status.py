@@ -26,7 +26,8 @@ class ImportStatus(View):
             raise PermissionDenied()
 
         items = job.items.order_by("index")
-        item_count = items.count() or 1
+        row_count = job.item_count
+        item_count = row_count or 1
 
         paginated = Paginator(items, PAGE_LENGTH)
         page = paginated.get_page(request.GET.get("page"))
@@ -46,6 +47,9 @@ class ImportStatus(View):
                 page.number, on_each_side=2, on_ends=1
             ),
             "show_progress": True,
+            # the uploaded file is still being read
+            "reading_file": bool(job.import_file) and not job.complete,
+            "row_count": row_count,
             "item_count": item_count,
             "complete_count": item_count - pending_item_count,
             "percent": job.percent_complete,
@@ -1,10 +1,13 @@
 """ incoming activities """
+import hashlib
 import json
 import re
 import logging
+from urllib.parse import urlparse
 
 import requests
 
+from django.core.cache import cache
 from django.http import HttpResponse, Http404
 from django.core.exceptions import BadRequest, PermissionDenied
 from django.shortcuts import get_object_or_404
@@ -13,9 +16,10 @@ from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 
 from bookwyrm import activitypub, models
+from bookwyrm.settings import INBOX_DEDUPLICATION_TTL
 from bookwyrm.tasks import app, INBOX
 from bookwyrm.signatures import Signature
-from bookwyrm.utils import regex
+from bookwyrm.utils import cache as cache_utils, regex
 
 logger = logging.getLogger(__name__)
 
@@ -50,6 +54,10 @@ class Inbox(View):
         ):
             raise Http404()
 
+        # we've already accepted this exact activity from another inbox or a retry
+        if is_duplicate_activity(activity_json):
+            return HttpResponse(status=202)
+
         # verify the signature
         if not has_valid_signature(request, activity_json):
             if activity_json["type"] == "Delete":
@@ -59,7 +67,17 @@ class Inbox(View):
                 return HttpResponse()
             return HttpResponse(status=401)
 
-        sometimes_async_activity_task(activity_json)
+        # only remember activities we've verified, so forgeries can't block them
+        if not mark_activity_received(activity_json):
+            # a concurrent delivery of the same activity got here first
+            return HttpResponse(status=202)
+
+        try:
+            sometimes_async_activity_task(activity_json)
+        except Exception:
+            # we didn't handle it, so the sender's retry shouldn't be dropped
+            clear_activity_received(activity_json)
+            raise
         return HttpResponse()
 
 
@@ -97,6 +115,68 @@ def raise_is_blocked_activity(activity_json):
         raise PermissionDenied()
 
 
+def get_activity_cache_key(activity_json):
+    """the activity id, or a digest of the activity if it doesn't have one.
+    the id is only trusted if it lives on the actor's server, so that one
+    server can't claim another server's activity ids"""
+    activity_id = activity_json.get("id")
+    actor = activity_json.get("actor")
+    if (
+        not isinstance(activity_id, str)
+        or not isinstance(actor, str)
+        or urlparse(activity_id).netloc != urlparse(actor).netloc
+    ):
+        activity_id = hashlib.sha256(
+            json.dumps(activity_json, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+    return f"inbox-activity-{activity_id}"
+
+
+def get_duplicate_count_cache_key(server_name, verified=True):
+    """where we keep track of duplicates suppressed per peer"""
+    if not verified:
+        return f"inbox-duplicates-unverified-{server_name}"
+    return f"inbox-duplicates-{server_name}"
+
+
+def is_duplicate_activity(activity_json):
+    """have we already accepted this activity? the signature hasn't been checked
+    yet, so the sender is only who the activity claims it's from"""
+    if cache.get(get_activity_cache_key(activity_json)) is None:
+        return False
+    record_duplicate_activity(activity_json, verified=False)
+    return True
+
+
+def mark_activity_received(activity_json):
+    """remember a verified activity, False if it was already there"""
+    added = cache.add(
+        get_activity_cache_key(activity_json), True, timeout=INBOX_DEDUPLICATION_TTL
+    )
+    if not added:
+        record_duplicate_activity(activity_json)
+    return added
+
+
+def clear_activity_received(activity_json):
+    """forget an activity, so it can be delivered again"""
+    cache.delete(get_activity_cache_key(activity_json))
+
+
+def record_duplicate_activity(activity_json, verified=True):
+    """increment the count of suppressed duplicates for the sending server"""
+    actor = activity_json.get("actor")
+    server_name = urlparse(actor).netloc if isinstance(actor, str) else None
+    if not server_name:
+        return
+    cache_utils.incr(get_duplicate_count_cache_key(server_name, verified=verified))
+
+
+def get_duplicate_count(server_name, verified=True):
+    """how many duplicate activities from this server we've suppressed"""
+    return cache.get(get_duplicate_count_cache_key(server_name, verified=verified), 0)
+
+
 def sometimes_async_activity_task(activity_json):
     """Sometimes we can effectively respond to a request without queuing a new task,
     and whenever that is possible, we should do it."""
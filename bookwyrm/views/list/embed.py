@@ -1,6 +1,6 @@
 """ book list views"""
 from django.core.paginator import Paginator
-from django.db.models import Avg, DecimalField
+from django.db.models import DecimalField, Value
 from django.db.models.functions import Coalesce
 from django.http import Http404
 from django.shortcuts import get_object_or_404
@@ -46,8 +46,9 @@ class EmbedList(View):
         items = book_list.listitem_set.prefetch_related("user", "book", "book__authors")
         if sort_by == "rating":
             items = items.annotate(
-                average_rating=Avg(
-                    Coalesce("book__review__rating", 0.0),
+                average_rating=Coalesce(
+                    "book__parent_work__rating_stats__rating",
+                    Value(0.0),
                     output_field=DecimalField(),
                 )
             )
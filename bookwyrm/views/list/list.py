@@ -5,7 +5,7 @@ from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator
 from django.db import transaction
-from django.db.models import Avg, DecimalField, Q, Max
+from django.db.models import DecimalField, Max, Q, Value
 from django.db.models.functions import Coalesce
 from django.http import HttpResponseBadRequest, HttpResponse
 from django.shortcuts import get_object_or_404, redirect
@@ -38,7 +38,9 @@ class List(View):
         book_list.raise_visible_to_user(request.user)
 
         if is_api_request(request):
-            return ActivitypubResponse(book_list.to_activity(**request.GET))
+            if request.GET:
+                return ActivitypubResponse(book_list.to_activity(**request.GET))
+            return ActivitypubResponse(serialized=book_list.to_activity_json())
 
         if redirect_option := maybe_redirect_local_path(request, book_list):
             return redirect_option
@@ -147,8 +149,9 @@ def sort_list(request, items):
 
     if sort_by == "rating":
         items = items.annotate(
-            average_rating=Avg(
-                Coalesce("book__review__rating", 0.0),
+            average_rating=Coalesce(
+                "book__parent_work__rating_stats__rating",
+                Value(0.0),
                 output_field=DecimalField(),
             )
         )
@@ -59,7 +59,9 @@ class Shelf(View):
             shelf = FakeShelf("all", _("All books"), user, books, "public")
 
         if is_api_request(request) and shelf_identifier:
-            return ActivitypubResponse(shelf.to_activity(**request.GET))
+            if request.GET:
+                return ActivitypubResponse(shelf.to_activity(**request.GET))
+            return ActivitypubResponse(serialized=shelf.to_activity_json())
 
         reviews = models.Review.objects
         if not is_self:
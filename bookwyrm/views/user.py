@@ -28,7 +28,7 @@ class User(View):
 
         if is_api_request(request):
             # we have a json request
-            return ActivitypubResponse(user.to_activity())
+            return ActivitypubResponse(serialized=user.to_activity_json())
         # otherwise we're at a UI view
 
         # if it's not an API request, never show the instance actor profile page
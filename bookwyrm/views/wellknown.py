@@ -1,15 +1,15 @@
 """ responds to various requests to /.well-know """
 
-from dateutil.relativedelta import relativedelta
 from django.http import HttpResponseNotFound
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.template.response import TemplateResponse
-from django.utils import timezone
+from django.views.decorators.cache import cache_control
 from django.views.decorators.http import require_GET
 
 from bookwyrm import models
-from bookwyrm.settings import DOMAIN, VERSION, LANGUAGE_CODE
+from bookwyrm.instance_stats import get_instance_stats
+from bookwyrm.settings import DOMAIN, INSTANCE_STATS_TTL, VERSION, LANGUAGE_CODE
 
 
 @require_GET
@@ -57,21 +57,10 @@ def nodeinfo_pointer(_):
 
 
 @require_GET
+@cache_control(public=True, max_age=INSTANCE_STATS_TTL)
 def nodeinfo(_):
     """basic info about the server"""
-    status_count = models.Status.objects.filter(user__local=True, deleted=False).count()
-    user_count = models.User.objects.filter(is_active=True, local=True).count()
-
-    month_ago = timezone.now() - relativedelta(months=1)
-    last_month_count = models.User.objects.filter(
-        is_active=True, local=True, last_active_date__gt=month_ago
-    ).count()
-
-    six_months_ago = timezone.now() - relativedelta(months=6)
-    six_month_count = models.User.objects.filter(
-        is_active=True, local=True, last_active_date__gt=six_months_ago
-    ).count()
-
+    stats = get_instance_stats()
     site = models.SiteSettings.get()
     return JsonResponse(
         {
@@ -80,11 +69,11 @@ def nodeinfo(_):
             "protocols": ["activitypub"],
             "usage": {
                 "users": {
-                    "total": user_count,
-                    "activeMonth": last_month_count,
-                    "activeHalfyear": six_month_count,
+                    "total": stats["users"],
+                    "activeMonth": stats["active_month"],
+                    "activeHalfyear": stats["active_halfyear"],
                 },
-                "localPosts": status_count,
+                "localPosts": stats["statuses"],
             },
             "openRegistrations": site.allow_registration,
         }
@@ -92,10 +81,10 @@ def nodeinfo(_):
 
 
 @require_GET
+@cache_control(public=True, max_age=INSTANCE_STATS_TTL)
 def instance_info(_):
     """let's talk about your cool unique instance"""
-    user_count = models.User.objects.filter(is_active=True, local=True).count()
-    status_count = models.Status.objects.filter(user__local=True, deleted=False).count()
+    stats = get_instance_stats()
 
     site = models.SiteSettings.get()
     logo = site.logo_url
@@ -107,8 +96,8 @@ def instance_info(_):
             "description": site.instance_description,
             "version": VERSION,
             "stats": {
-                "user_count": user_count,
-                "status_count": status_count,
+                "user_count": stats["users"],
+                "status_count": stats["statuses"],
             },
             "thumbnail": logo,
             "languages": [LANGUAGE_CODE[:2]],
@@ -121,12 +110,10 @@ def instance_info(_):
 
 
 @require_GET
+@cache_control(public=True, max_age=INSTANCE_STATS_TTL)
 def peers(_):
     """list of federated servers this instance connects with"""
-    names = models.FederatedServer.objects.filter(status="federated").values_list(
-        "server_name", flat=True
-    )
-    return JsonResponse(list(names), safe=False)
+    return JsonResponse(get_instance_stats()["peers"], safe=False)
 
 
 @require_GET